@@ -1,108 +1,124 @@
 from client_hw import get_model_response
 
-# RAG 相关的类和函数
-from langchain_embed_siliconflow import SiliconFlowEmbeddings
-#from langchain.vectorstores import Chroma
-from langchain_community.vectorstores import Chroma
-
 from dotenv import load_dotenv
 import os
+import asyncio
 import use_neo4j
+import tracing
+import usage_ledger
+import prompt_builder
+import rag_store
+from retrieval_result import RetrievalResult
+from shared_cache import get_shared_cache, hash_key, ANSWER_CACHE_TTL
 # 加载环境变量
 load_dotenv()
-silicon_api_key = os.getenv("SILICON_API_KEY")
-
-persist_directory = "./local_pdf_chroma_db_sf"
-collection_name = "sf_pdf_documents_collection"
 
-embeddings_model_instance = None
-vector_store_instance = None
+# RETRIEVAL_SERVICE_URL 指向 retrieval_service.py 启动的检索服务时，检索交给该服务，
+# 本进程不再加载向量库；否则在本进程加载（检索逻辑见 rag_store.py，检索服务与评测共用）
+retrieval_service_url = os.getenv("RETRIEVAL_SERVICE_URL")
+retrieval_client = None
+if retrieval_service_url:
+    from retrieval_service import RetrievalClient
 
-if silicon_api_key:
-    if os.path.exists(persist_directory):
-        try:
-            embeddings_model_instance = SiliconFlowEmbeddings(
-                api_key=silicon_api_key,
-                model_name="BAAI/bge-large-zh-v1.5",
-            )
-            vector_store_instance = Chroma(
-                collection_name=collection_name,
-                persist_directory=persist_directory,
-                embedding_function=embeddings_model_instance,
-            )
-            print("Chroma 数据库已成功加载用于 RAG (使用 SiliconFlow)。")
-        except Exception as e:
-            print(f"初始化 RAG 组件 (SiliconFlow) 时出错: {e}。RAG 功能可能受限。")
-            vector_store_instance = None
-    else:
-        print(
-            f"警告: Chroma 数据库目录 '{persist_directory}' 未找到。RAG 将不检索上下文。"
-        )
-        vector_store_instance = None
+    retrieval_client = RetrievalClient(retrieval_service_url)
+    print(f"RAG 检索使用检索服务：{retrieval_service_url}")
 else:
-    print("警告: 未配置 SILICON_API_KEY。RAG 上下文检索功能将不可用。")
-    vector_store_instance = None
+    rag_store.init_local_retrieval()
+
+
+def rag_enabled():
+    return retrieval_client is not None or bool(
+        rag_store.vector_store_instance and rag_store.embeddings_model_instance
+    )
 
 
 # 基础的智能体类
 class Agent:
-    def __init__(self, name: str, description: str, system_prompt: str):
+    def __init__(self, name: str, description: str, system_prompt: str, call_site: str = "default"):
         self.name = name
         self.description = description
         self.system_prompt = system_prompt
+        # 模型与生成参数的路由键，见 model_routing.py
+        self.call_site = call_site
 
     def process(self, user_input: str, selected_chapter: str = None) -> str:
+        with tracing.span(
+            "agent.process", agent=self.name, chapter=selected_chapter or ""
+        ) as span:
+            print(f"[request {span.request_id}] {self.name}")
+            if ANSWER_CACHE_TTL <= 0:
+                return self._process(user_input, selected_chapter)
+            # 多个工作进程共享的回答缓存：同一智能体、章节和问题直接复用
+            cache = get_shared_cache()
+            key = hash_key(self.name, selected_chapter, user_input)
+            cached = cache.get_json("answer", key)
+            span.set_attribute("cache.hit", cached is not None)
+            if cached is not None:
+                return cached
+            response, ok = self._process(user_input, selected_chapter, with_status=True)
+            if ok:
+                cache.set_json("answer", key, response, ttl=ANSWER_CACHE_TTL)
+            return response
+
+    def _process(self, user_input: str, selected_chapter: str = None, with_status=False):
+        question = user_input
         neo4j_entity = use_neo4j.query_from_neo4j(user_input)
-        if len(neo4j_entity) > 0:
-            for entity in neo4j_entity:
-                user_input += ','
-                user_input += entity
+        user_input = rag_store.build_retrieval_query(question, neo4j_entity)
         print("用户输入：",user_input)
+        retrieved_context_str, actual_retrieved_docs = self._retrieve(
+            user_input, selected_chapter
+        )
+        response, ok = self._generate(
+            question,
+            selected_chapter,
+            neo4j_entity,
+            retrieved_context_str,
+            actual_retrieved_docs,
+        )
+        return (response, ok) if with_status else response
+
+    def _retrieve(self, user_input: str, selected_chapter: str = None, query_vector=None):
+        """
+        从本地知识库检索背景知识
+
+        参数:
+            user_input (str): 检索查询（已附加知识图谱中的相关知识点）
+            selected_chapter (str): 选择的章节
+            query_vector (list): 可选，已经算好的查询向量，提供时不再请求嵌入接口
+
+        返回:
+            tuple: (背景知识文本, RetrievalResult)
+        """
         retrieved_context_str = "本地知识库中没有找到相关信息。"
-        actual_retrieved_docs = []
-        if vector_store_instance and embeddings_model_instance:
+        actual_retrieved_docs = RetrievalResult()
+        if rag_enabled():
+            # 用量接近预算时少取几条，缩短提示词
+            k = usage_ledger.retrieval_k(12)
             try:
-                # 构建查询，如果选择了章节则包含章节信息
-                query = user_input
-                if selected_chapter and selected_chapter != "全部章节":
-                    query = f"第{selected_chapter}章 {user_input}"
-
-                retrieved_docs_from_db = vector_store_instance.similarity_search(
-                    query, k=12
-                )
+                if retrieval_client is not None:
+                    retrieved_docs_from_db = retrieval_client.search(
+                        user_input, k=k, chapter=selected_chapter, vector=query_vector
+                    )
+                else:
+                    retrieved_docs_from_db = rag_store.search_documents(
+                        user_input, k, selected_chapter, query_vector=query_vector
+                    )
+                retrieved_docs_from_db = RetrievalResult(retrieved_docs_from_db)
 
-                # 如果指定了章节，进一步过滤结果
+                # 如果指定了章节，按入库时写入元数据的章节标记过滤；
+                # 过滤后没有结果时，使用原始检索结果但数量减少
                 if (
                     selected_chapter
                     and selected_chapter != "全部章节"
                     and retrieved_docs_from_db
                 ):
-                    filtered_docs = []
-                    for doc in retrieved_docs_from_db:
-                        if hasattr(doc, "metadata") and doc.metadata:
-                            # 假设文档的metadata中包含章节信息
-                            doc_content = doc.page_content.lower()
-                            chapter_keywords = [
-                                f"第{selected_chapter}章",
-                                f"chapter {selected_chapter}",
-                                f"第 {selected_chapter} 章",
-                            ]
-                            if any(
-                                keyword in doc_content for keyword in chapter_keywords
-                            ):
-                                filtered_docs.append(doc)
-
-                    # 如果过滤后没有结果，使用原始检索结果但数量减少
-                    if filtered_docs:
-                        retrieved_docs_from_db = filtered_docs[:8]
-                    else:
-                        retrieved_docs_from_db = retrieved_docs_from_db[:6]
+                    retrieved_docs_from_db = retrieved_docs_from_db.filter_chapter(
+                        selected_chapter, keep=8, fallback=6
+                    )
 
                 if retrieved_docs_from_db:
                     actual_retrieved_docs = retrieved_docs_from_db
-                    retrieved_context_str = "\n\n".join(
-                        [doc.page_content for doc in actual_retrieved_docs]
-                    )
+                    retrieved_context_str = actual_retrieved_docs.context
                     print(
                         f"为查询 '{user_input[:50]}...' 检索到的上下文片段: \n{retrieved_context_str[:200]}..."
                     )
@@ -115,62 +131,105 @@ class Agent:
                 retrieved_context_str = "检索本地知识库信息时发生错误。"
         else:
             print("RAG 组件未初始化，跳过本地知识库检索。")
-
-        # 构建最终传递给 LLM 的用户输入
-        chapter_context = (
-            f"请重点关注第{selected_chapter}章的内容。"
-            if selected_chapter and selected_chapter != "全部章节"
-            else ""
-        )
-
-        final_user_input_for_llm = (
-            f"{chapter_context}\n"
-            f"请参考以下背景知识（如果与问题相关），主要根据背景知识回答：\n"
-            f"--- 背景知识开始 ---\n"
-            f"{retrieved_context_str}\n"
-            f"--- 背景知识结束 ---\n\n"
-            f"现在，请根据你的角色设定，并结合以上背景知识（如果相关），回答用户提出的以下问题：\n"
-            f"{user_input}"
-        )
-
-        llm_response = get_model_response(self.system_prompt, final_user_input_for_llm)
+        return retrieved_context_str, actual_retrieved_docs
+
+    def _generate(
+        self,
+        question: str,
+        selected_chapter,
+        neo4j_entity,
+        retrieved_context_str,
+        actual_retrieved_docs,
+    ):
+        """
+        调用大模型生成回答，并附上参考的上下文片段
+
+        返回:
+            tuple: (回答文本, 大模型是否调用成功)
+        """
+        with tracing.span("llm.generate", agent=self.name):
+            # 构建最终传递给 LLM 的提示词（按前缀稳定程度排列，见 prompt_builder.py）
+            prompt = prompt_builder.build_rag_prompt(
+                self.system_prompt,
+                question,
+                retrieved_context_str,
+                chapter=selected_chapter,
+                related_terms=neo4j_entity,
+            )
+            llm_response = get_model_response(
+                prompt.system, prompt.user, call_site=self.call_site
+            )
 
         # 处理API调用失败的情况
+        ok = llm_response is not None
         if llm_response is None:
             llm_response = f"抱歉，AI服务暂时不可用。但我找到了以下相关资料供您参考：\n\n根据检索到的资料，关于您询问的问题，可以参考以下内容。"
 
         # 在LLM回答后附加RAG检索到的上下文片段和页码
         appendix_header = "\n\n--- 参考的上下文片段 ---"
-        appendix_content = ""
 
         if actual_retrieved_docs:
-            for i, doc in enumerate(actual_retrieved_docs):
-                page_number = "未知页码"
-                if hasattr(doc, "metadata") and doc.metadata:
-                    page_number_val = doc.metadata.get("page")
-                    if page_number_val is not None:
-                        page_number = str(page_number_val)
-
-                page_content_cleaned = doc.page_content
-                page_content_cleaned = (
-                    page_content_cleaned.replace("\r\n", " ")
-                    .replace("\n", " ")
-                    .replace("\r", " ")
-                )
-                page_content_cleaned = " ".join(page_content_cleaned.split())
-                page_content_cleaned = page_content_cleaned.strip()
-
-                appendix_content += (
-                    f"\n\n片段 {i+1} (来自页码: {page_number}):\n{page_content_cleaned}"
-                )
-        elif vector_store_instance and embeddings_model_instance:
+            # 展示文本在入库时已整理好，这里只做一次拼接
+            appendix_content = actual_retrieved_docs.appendix()
+        elif rag_enabled():
             appendix_content = "\n未从本地知识库中检索到与查询直接相关的上下文片段。"
         else:
             appendix_content = "\n本地知识库未启用或初始化失败，未检索上下文。"
 
         #return llm_response
         #回答出参考的上下文片段
-        return llm_response + appendix_header + appendix_content
+        return llm_response + appendix_header + appendix_content, ok
+
+    async def aprocess(self, user_input: str, selected_chapter: str = None, with_status=False):
+        """
+        process 的异步版本，供 Gradio 的异步事件处理函数调用
+
+        with_status 为真时返回 (回答, 大模型是否调用成功)，供批量任务判断是否需要重跑
+        """
+        with tracing.span(
+            "agent.process", agent=self.name, chapter=selected_chapter or "", mode="async"
+        ) as span:
+            print(f"[request {span.request_id}] {self.name}")
+            if ANSWER_CACHE_TTL <= 0:
+                response, ok = await self._aprocess(user_input, selected_chapter)
+                return (response, ok) if with_status else response
+            cache = get_shared_cache()
+            key = hash_key(self.name, selected_chapter, user_input)
+            # SQLite 读写可能等锁，不在事件循环中进行
+            cached = await asyncio.to_thread(cache.get_json, "answer", key)
+            span.set_attribute("cache.hit", cached is not None)
+            if cached is not None:
+                return (cached, True) if with_status else cached
+            response, ok = await self._aprocess(user_input, selected_chapter)
+            if ok:
+                await asyncio.to_thread(
+                    cache.set_json, "answer", key, response, ttl=ANSWER_CACHE_TTL
+                )
+            return (response, ok) if with_status else response
+
+    async def _aprocess(self, user_input: str, selected_chapter: str = None):
+        question = user_input
+        # 检索查询与同步版本一致：问题附加知识图谱中的相关知识点
+        neo4j_entity = await asyncio.to_thread(use_neo4j.query_from_neo4j, question)
+        retrieval_query = rag_store.build_retrieval_query(question, neo4j_entity)
+        print("用户输入：", retrieval_query)
+        query_vector = None
+        if retrieval_client is None and rag_enabled():
+            # 本进程检索时用异步接口取查询向量，不占用线程；使用检索服务时由服务端计算
+            query_vector = await rag_store.embeddings_model_instance.aembed_query(retrieval_query)
+        # 向量检索（含首次章节检索时的章节中心计算）是同步计算，放到线程中执行
+        retrieved_context_str, actual_retrieved_docs = await asyncio.to_thread(
+            self._retrieve, retrieval_query, selected_chapter, query_vector=query_vector
+        )
+        return await asyncio.to_thread(
+            self._generate,
+            question,
+            selected_chapter,
+            neo4j_entity,
+            retrieved_context_str,
+            actual_retrieved_docs,
+        )
+
 
 
 # 示例智能体1: 概念解释智能体
@@ -180,6 +239,7 @@ class ConceptExplanationAgent(Agent):
             "概念解释智能体",
             "提供软件工程中各类概念和术语的解释。",
             "你是一个专业的软件工程助手，专门负责解释软件工程中的各类概念和术语。你将根据用户的提问提供简洁且准确的定义、背景知识以及相关的应用实例。你需要确保回答逻辑清晰，尽量举例帮助用户理解，并且保证所给出的解释符合学术界的标准。",
+            call_site="concept_explanation",
         )
 
 
@@ -190,6 +250,7 @@ class RequirementAnalysisAgent(Agent):
             "需求分析智能体",
             "根据软件系统描述，提供全面的需求分析。",
             "你是一个软件工程领域的需求分析专家。当用户提供一个软件系统的描述时，你需要基于软件工程的理论与实践，进行全面的需求分析。包括但不限于：\n- 功能需求分析\n- 非功能需求分析\n- 用户需求与系统需求的区分\n- 系统的技术、性能和安全需求\n你将结合业务目标、技术限制和用户需求，提出合理的解决方案，确保分析结果准确且可实施。",
+            call_site="requirement_analysis",
         )
 
 
@@ -200,6 +261,7 @@ class SoftwareDesignAgent(Agent):
             "软件设计智能体",
             "为软件系统提供架构方案和设计文档。",
             "你是一个经验丰富的软件设计专家。根据用户提供的系统描述，你需要为系统设计一个全面的架构方案，并提供详细的设计文档。设计过程中需考虑以下内容：\n- 系统架构设计（如微服务架构、客户端-服务器架构等）\n- 模块设计与功能分配\n- 数据库设计（如ER图、数据库表设计）\n- 交互设计与UI原型\n- 系统扩展性和可维护性设计\n你的回答需要详细阐明设计原则，保证设计方案的高效性、可扩展性与稳定性。",
+            call_site="software_design",
         )
 
 
@@ -210,6 +272,7 @@ class SoftwareTestingAgent(Agent):
             "软件测试智能体",
             "根据软件系统描述，提供测试策略和方法。",
             "你是一个软件测试专家，负责根据用户描述的系统来设计和建议相关的测试策略和方法。你需要根据软件的功能、性能要求以及用户需求，设计以下测试活动：\n- 单元测试、集成测试、系统测试和验收测试\n- 性能测试、安全测试、兼容性测试\n- 自动化测试脚本的设计与实现\n你需要确保测试方法的全面性、有效性，并且能够识别潜在的风险点，保证软件质量。",
+            call_site="software_testing",
         )
 
 
@@ -220,6 +283,7 @@ class ExamQuestionAnswerAgent(Agent):
             "题目答疑智能体",
             "解答软件工程课程相关练习题。",
             "你是一个软件工程课程的答疑助手。用户将输入一个具体的练习题或概念问题，你需要基于课本内容和专业知识进行解答。你应提供以下内容：\n- 清晰的答案\n- 解题思路和步骤\n- 相关理论背景或知识点的解释\n确保你的回答详尽、准确并且符合课程教材要求，能够帮助学生掌握相关的知识点。",
+            call_site="exam_answer",
         )
 
 #智能体6: 出题智能体
@@ -233,26 +297,31 @@ class ExerciseGenerationAgent(Agent):
             "【题目】...\n"
             "【答案】...\n"
             "【解析】...\n"
-            "确保题目原创、针对性强、表达清晰，并具有教学价值。"
+            "确保题目原创、针对性强、表达清晰，并具有教学价值。",
+            call_site="exercise_generation",
         )
 
     def process(self, user_input: str,
                 selected_chapter: str = None,
                 selected_topic: str = None,
                 difficulty: str = "中等",
-                question_type: str = None  # 新增题型参数
+                question_type: str = None,  # 新增题型参数
+                variant: int = None  # 批量出题时的序号
                 ) -> str:
-        chapter_info = f"第{selected_chapter}章" if selected_chapter else ""
-        topic_info = f"知识点：{selected_topic}" if selected_topic else ""
-        qtype_info = f"题型：{question_type}" if question_type else ""
-
-        prompt = (
-            f"请基于以下信息出一道题目：\n"
-            f"{chapter_info}\n{topic_info}\n{qtype_info}\n难度：{difficulty}\n"
-            f"要求生成题目+答案+解析，格式如下：\n"
-            f"【题目】...\n【答案】...\n【解析】...\n"
-        )
-        return get_model_response(self.system_prompt, prompt)
+        with tracing.span("agent.process", agent=self.name, chapter=selected_chapter or ""):
+            with tracing.span("llm.generate", agent=self.name):
+                prompt = prompt_builder.build_exercise_prompt(
+                    self.system_prompt,
+                    chapter=selected_chapter,
+                    topic=selected_topic,
+                    difficulty=difficulty,
+                    question_type=question_type,
+                    variant=variant,
+                )
+                return get_model_response(prompt.system, prompt.user, call_site=self.call_site)
+
+    async def aprocess(self, *args, **kwargs):
+        return await asyncio.to_thread(self.process, *args, **kwargs)
 
 
 
@@ -0,0 +1,258 @@
+# 批量运行：从 JSONL 读取任务，以有限并发调用各智能体，结果逐条追加到 JSONL 输出文件。
+# 输出文件同时是检查点：重新运行时跳过已成功的任务，只重跑未完成和失败的任务。
+#
+# 任务格式（每行一个 JSON）:
+#   {"id": "q1", "agent": "概念解释智能体", "input": "什么是软件危机？", "chapter": "第一章：软件工程学概述"}
+#   {"id": "ex-ch3", "agent": "出题智能体", "chapter": "第三章：需求分析", "topic": "用例建模",
+#    "difficulty": "中等", "question_type": "选择题", "count": 20}
+# 出题任务按 count 展开为 id 为 "ex-ch3#1" ... "ex-ch3#20" 的单题任务。
+#
+# 用法:
+#   python batch_cli.py run jobs.jsonl --out results.jsonl --concurrency 8 --prices prices.json
+#   python batch_cli.py plan-exercises --per-chapter 23 --question-types 选择题,简答题 > jobs.jsonl
+import os
+import re
+import sys
+import json
+import time
+import asyncio
+import argparse
+import threading
+import tracing
+from usage_ledger import cost_of, load_prices
+
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4"))
+EXERCISE_AGENT = "出题智能体"
+
+
+def _percentile(values, p):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+
+
+def load_jobs(path):
+    """
+    读取任务文件并展开出题任务
+
+    返回:
+        list: 任务字典，每个都有唯一的 id
+    """
+    jobs = []
+    seen = set()
+    with open(path, "r", encoding="utf-8") as f:
+        for line_no, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            job = json.loads(line)
+            job.setdefault("id", f"line{line_no}")
+            if "agent" not in job:
+                raise ValueError(f"第 {line_no} 行缺少 agent 字段")
+            count = int(job.pop("count", 1)) if job["agent"] == EXERCISE_AGENT else 1
+            expanded = [job] if count == 1 else [
+                dict(job, id=f"{job['id']}#{i}", variant=i) for i in range(1, count + 1)
+            ]
+            for item in expanded:
+                if item["id"] in seen:
+                    raise ValueError(f"任务 id 重复: {item['id']}")
+                seen.add(item["id"])
+                jobs.append(item)
+    return jobs
+
+
+def load_checkpoint(path):
+    """返回输出文件中已成功的任务 id"""
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # 上次中断时写了一半的行
+            if record.get("status") == "ok":
+                done.add(record["id"])
+    return done
+
+
+def usage_of(root):
+    """汇总一个任务的 span 树中各次大模型调用的 token 用量，按模型分开"""
+    usage = {}
+    for s in [root] + (root.children or []):
+        if s.name != "llm.chat":
+            continue
+        model = s.attributes.get("model", "unknown")
+        entry = usage.setdefault(model, {"prompt": 0, "completion": 0, "cached": 0})
+        entry["prompt"] += s.attributes.get("prompt_tokens", 0)
+        entry["completion"] += s.attributes.get("completion_tokens", 0)
+        entry["cached"] += s.attributes.get("cached_tokens", 0)
+    return usage
+
+
+def split_exercise(result):
+    """把出题结果拆成题目、答案、解析（格式见出题智能体的系统提示词）"""
+    parts = re.split(r"【题目】|【答案】|【解析】", result or "")
+    if len(parts) >= 4:
+        return {"question": parts[1].strip(), "answer": parts[2].strip(), "explanation": parts[3].strip()}
+    return None
+
+
+class BatchRunner:
+    """
+    参数:
+        manager (AgentManager): 智能体管理器
+        out_path (str): 结果文件（追加写入）
+        concurrency (int): 同时运行的任务数
+        prices (dict): 价格表，见 load_prices
+    """
+
+    def __init__(self, manager, out_path, concurrency=BATCH_CONCURRENCY, prices=None):
+        self.manager = manager
+        self.out_path = out_path
+        self.concurrency = concurrency
+        self.prices = prices or {}
+        self._write_lock = threading.Lock()
+        self.records = []
+
+    def _write(self, record):
+        with self._write_lock:
+            with open(self.out_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                f.flush()
+            self.records.append(record)
+
+    async def _call(self, agent, job):
+        """
+        返回:
+            tuple: (输出文本, 是否成功)
+        """
+        if job["agent"] == EXERCISE_AGENT:
+            output = await agent.aprocess(
+                job.get("input", "请出一道题"),
+                selected_chapter=job.get("chapter"),
+                selected_topic=job.get("topic"),
+                difficulty=job.get("difficulty", "中等"),
+                question_type=job.get("question_type"),
+                variant=job.get("variant"),
+            )
+            return output, output is not None
+        return await agent.aprocess(job["input"], job.get("chapter"), with_status=True)
+
+    async def _run_job(self, job, semaphore):
+        async with semaphore:
+            agent = self.manager.get_agent(job["agent"])
+            record = {"id": job["id"], "agent": job["agent"]}
+            start = time.perf_counter()
+            with tracing.span("batch.job", job_id=job["id"], agent=job["agent"]) as root:
+                try:
+                    if agent is None:
+                        raise ValueError(f"没有找到名为 {job['agent']} 的智能体")
+                    output, ok = await self._call(agent, job)
+                    record["status"] = "ok" if ok else "error"
+                    record["output"] = output
+                    if output and job["agent"] == EXERCISE_AGENT:
+                        record["exercise"] = split_exercise(output)
+                except Exception as e:
+                    record["status"] = "error"
+                    record["error"] = f"{type(e).__name__}: {e}"
+            record["latency"] = round(time.perf_counter() - start, 3)
+            record["usage"] = usage_of(root)
+            record["cost"] = round(cost_of(record["usage"], self.prices), 6)
+            self._write(record)
+            print(f"[{len(self.records)}] {job['id']} {record['status']} {record['latency']:.1f}s")
+
+    async def run(self, jobs):
+        semaphore = asyncio.Semaphore(max(1, self.concurrency))
+        await asyncio.gather(*(self._run_job(job, semaphore) for job in jobs))
+        return self.records
+
+
+def print_summary(records, elapsed, skipped):
+    ok = [r for r in records if r["status"] == "ok"]
+    latencies = [r["latency"] for r in records]
+    tokens = {"prompt": 0, "completion": 0, "cached": 0}
+    for r in records:
+        for usage in r["usage"].values():
+            for kind in tokens:
+                tokens[kind] += usage[kind]
+    print(f"\n完成 {len(records)} 个任务（成功 {len(ok)}，失败 {len(records) - len(ok)}），跳过已完成 {skipped} 个")
+    if not records:
+        return
+    print(f"总耗时 {elapsed:.1f}s，吞吐 {len(records) / elapsed:.2f} 任务/秒（{len(records) / elapsed * 60:.1f} 任务/分钟）")
+    print(f"单任务耗时 p50 {_percentile(latencies, 50):.1f}s，p95 {_percentile(latencies, 95):.1f}s")
+    print(
+        f"token：prompt {tokens['prompt']}（其中缓存命中 {tokens['cached']}），completion {tokens['completion']}"
+    )
+    cost = sum(r["cost"] for r in records)
+    if cost:
+        print(f"费用 {cost:.4f}，平均每个成功任务 {cost / max(1, len(ok)):.4f}")
+
+
+def plan_exercises(per_chapter, question_types, difficulty):
+    """为每一章生成出题任务，题数在各题型间平均分配"""
+    import chapter_vectors
+
+    jobs = []
+    for number, chapter in enumerate(chapter_vectors.CHAPTERS, start=1):
+        share, extra = divmod(per_chapter, len(question_types))
+        for i, qtype in enumerate(question_types):
+            count = share + (1 if i < extra else 0)
+            if count:
+                jobs.append(
+                    {
+                        "id": f"ex-ch{number}-{qtype}",
+                        "agent": EXERCISE_AGENT,
+                        "chapter": chapter,
+                        "difficulty": difficulty,
+                        "question_type": qtype,
+                        "count": count,
+                    }
+                )
+    return jobs
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="批量运行智能体任务")
+    sub = parser.add_subparsers(dest="command", required=True)
+    run_parser = sub.add_parser("run", help="运行任务文件")
+    run_parser.add_argument("jobs", help="任务 JSONL 文件")
+    run_parser.add_argument("--out", default="batch_results.jsonl", help="结果 JSONL 文件，也是检查点")
+    run_parser.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY)
+    run_parser.add_argument("--prices", help="价格表 JSON 文件（每百万 token）")
+    run_parser.add_argument("--limit", type=int, help="本次最多运行的任务数")
+    plan_parser = sub.add_parser("plan-exercises", help="生成覆盖全部章节的出题任务")
+    plan_parser.add_argument("--per-chapter", type=int, default=10)
+    plan_parser.add_argument("--question-types", default="选择题,简答题")
+    plan_parser.add_argument("--difficulty", default="中等")
+    args = parser.parse_args(argv)
+
+    if args.command == "plan-exercises":
+        types = [t.strip() for t in args.question_types.split(",") if t.strip()]
+        for job in plan_exercises(args.per_chapter, types, args.difficulty):
+            print(json.dumps(job, ensure_ascii=False))
+        return 0
+
+    jobs = load_jobs(args.jobs)
+    done = load_checkpoint(args.out)
+    pending = [job for job in jobs if job["id"] not in done]
+    skipped = len(jobs) - len(pending)
+    if args.limit:
+        pending = pending[: args.limit]
+    print(f"共 {len(jobs)} 个任务，已完成 {skipped} 个，本次运行 {len(pending)} 个")
+    if not pending:
+        return 0
+
+    from agents import AgentManager
+
+    runner = BatchRunner(AgentManager(), args.out, args.concurrency, load_prices(args.prices))
+    start = time.perf_counter()
+    records = asyncio.run(runner.run(pending))
+    print_summary(records, time.perf_counter() - start, skipped)
+    return 0 if all(r["status"] == "ok" for r in records) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,271 @@
+# 离线基准测试：用 mock_backends 中的本地替身代替华为 MaaS、SiliconFlow 和 Neo4j，
+# 并发驱动 Agent.process、generate_exercise、generate_flowchart_from_code 和 parse_file，
+# 输出 p50/p95/p99 延迟与吞吐量。
+#
+# 用法:
+#   python benchmark.py --concurrency 8 --requests 64
+#   python benchmark.py --save bench_baseline.json
+#   python benchmark.py --compare bench_baseline.json --tolerance 0.2
+import os
+import sys
+import json
+import time
+import argparse
+import math
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import mock_backends
+
+SAMPLE_QUESTIONS = [
+    "什么是软件工程？",
+    "需求分析阶段的主要任务是什么？",
+    "用例图和类图有什么区别？",
+    "简述单元测试与集成测试的关系。",
+    "总体设计中层次图的作用是什么？",
+]
+SAMPLE_CODE = """
+def fib(n):
+    if n < 2:
+        return n
+    return fib(n - 1) + fib(n - 2)
+
+for i in range(10):
+    print(fib(i))
+"""
+
+
+def percentile(sorted_values, p):
+    """最近秩法求分位数"""
+    if not sorted_values:
+        return 0.0
+    idx = max(0, math.ceil(p / 100 * len(sorted_values)) - 1)
+    return sorted_values[min(idx, len(sorted_values) - 1)]
+
+
+def setup_backends(args):
+    """启动本地替身，并在导入业务模块前把各服务地址指向它"""
+    config = mock_backends.MockConfig(
+        llm_latency=args.llm_latency,
+        llm_jitter=args.llm_jitter,
+        token_latency=args.token_latency,
+        embed_latency=args.embed_latency,
+    )
+    server, base_url = mock_backends.start_mock_server(config)
+    os.environ["MAAS_API_URL"] = f"{base_url}/chat/completions"
+    os.environ["SILICON_API_BASE"] = base_url
+    os.environ.setdefault("HUAWEI_API_KEY", "offline-benchmark")
+    os.environ.setdefault("SILICON_API_KEY", "offline-benchmark")
+    os.environ.setdefault("TRACE_EXPORT_FILE", "")
+
+    import use_neo4j
+
+    graph = mock_backends.InMemoryGraph(latency=args.graph_latency)
+    use_neo4j.connect_neo4j = lambda: graph
+    print(f"本地替身服务: {base_url}")
+    return server
+
+
+def make_sample_image(directory):
+    """生成一张带文字的示例图片，供 parse_file 的 OCR 基准使用"""
+    from PIL import Image, ImageDraw
+
+    img = Image.new("RGB", (1200, 400), "white")
+    draw = ImageDraw.Draw(img)
+    for i, line in enumerate(SAMPLE_QUESTIONS):
+        draw.text((40, 40 + i * 60), f"{i + 1}. {line}", fill="black")
+    path = os.path.join(directory, "sample.png")
+    img.save(path)
+    return path
+
+
+class _Upload:
+    """模拟 Gradio 上传对象，只需要 name 属性"""
+
+    def __init__(self, name):
+        self.name = name
+
+
+def build_scenarios(args, tmp_dir):
+    scenarios = {}
+
+    def agent_call(i):
+        from agents import AgentManager
+
+        manager = _cached("agent_manager", AgentManager)
+        agent = manager.get_agent(args.agent)
+        chapter = None if i % 2 == 0 else "三"
+        return agent.process(SAMPLE_QUESTIONS[i % len(SAMPLE_QUESTIONS)], chapter)
+
+    def exercise_call(i):
+        import gradio_app
+
+        return gradio_app.generate_exercise("第三章：需求分析", "用例建模", "中等", 1, "选择题")
+
+    def flowchart_call(i):
+        from flowchart_generator import generate_flowchart_from_code
+
+        return generate_flowchart_from_code(SAMPLE_CODE, "python")
+
+    def embed_call(i):
+        from langchain_embed_siliconflow import SiliconFlowEmbeddings
+
+        embeddings = _cached(
+            "embeddings",
+            lambda: SiliconFlowEmbeddings(
+                api_key=os.environ["SILICON_API_KEY"],
+                api_base_url=os.environ["SILICON_API_BASE"],
+            ),
+        )
+        # 每次使用不同的文本，避免被合并请求掩盖攒批的效果
+        return embeddings.embed_query(f"{SAMPLE_QUESTIONS[i % len(SAMPLE_QUESTIONS)]} #{i}")
+
+    def parse_call(i):
+        from file_parser import parse_file
+
+        files = args.files or [_cached("sample_image", lambda: make_sample_image(tmp_dir))]
+        return parse_file(_Upload(files[i % len(files)]))
+
+    scenarios["agent"] = agent_call
+    scenarios["exercise"] = exercise_call
+    scenarios["flowchart"] = flowchart_call
+    scenarios["parse_file"] = parse_call
+    scenarios["embed_query"] = embed_call
+    return scenarios
+
+
+_cache = {}
+
+
+def _cached(key, factory):
+    if key not in _cache:
+        _cache[key] = factory()
+    return _cache[key]
+
+
+def run_scenario(fn, total, concurrency):
+    """
+    以给定并发度调用 fn 共 total 次
+
+    返回:
+        dict: 延迟分位数（毫秒）、吞吐量和错误数
+    """
+    latencies = []
+    errors = {}
+    lock = threading.Lock()
+
+    def one(i):
+        start = time.perf_counter()
+        try:
+            fn(i)
+        except Exception as e:
+            kind = type(e).__name__
+            with lock:
+                errors[kind] = errors.get(kind, 0) + 1
+            return None
+        return time.perf_counter() - start
+
+    # 预热一次，避免把模块导入和首次连接计入统计
+    one(0)
+    wall_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for elapsed in pool.map(one, range(total)):
+            if elapsed is not None:
+                latencies.append(elapsed)
+    wall = time.perf_counter() - wall_start
+
+    latencies.sort()
+    return {
+        "requests": total,
+        "ok": len(latencies),
+        "errors": errors,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "throughput_rps": len(latencies) / wall if wall > 0 else 0.0,
+    }
+
+
+def print_report(results):
+    header = f"{'场景':<12}{'成功/总数':>10}{'p50(ms)':>10}{'p95(ms)':>10}{'p99(ms)':>10}{'吞吐(req/s)':>14}  错误"
+    print(header)
+    print("-" * 80)
+    for name, r in results.items():
+        print(
+            f"{name:<12}{str(r['ok']) + '/' + str(r['requests']):>10}"
+            f"{r['p50_ms']:>10.1f}{r['p95_ms']:>10.1f}{r['p99_ms']:>10.1f}"
+            f"{r['throughput_rps']:>14.2f}  {r['errors'] or ''}"
+        )
+
+
+def compare(results, baseline, tolerance):
+    """与基线比较 p95 和吞吐量，返回退化项列表"""
+    regressions = []
+    for name, r in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        if base["p95_ms"] and r["p95_ms"] > base["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {base['p95_ms']:.1f}ms -> {r['p95_ms']:.1f}ms")
+        if base["throughput_rps"] and r["throughput_rps"] < base["throughput_rps"] * (1 - tolerance):
+            regressions.append(
+                f"{name}: 吞吐 {base['throughput_rps']:.2f} -> {r['throughput_rps']:.2f} req/s"
+            )
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="离线基准测试（本地替身后端）")
+    parser.add_argument(
+        "--scenarios",
+        default="agent,exercise,flowchart,parse_file",
+        help="逗号分隔：agent,exercise,flowchart,parse_file,embed_query",
+    )
+    parser.add_argument("--agent", default="概念解释智能体", help="agent 场景使用的智能体")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=32, help="每个场景的请求数")
+    parser.add_argument("--llm-latency", type=float, default=0.8, help="LLM 首 token 延迟（秒）")
+    parser.add_argument("--llm-jitter", type=float, default=0.2)
+    parser.add_argument("--token-latency", type=float, default=0.002, help="每个输出 token 的延迟（秒）")
+    parser.add_argument("--embed-latency", type=float, default=0.05)
+    parser.add_argument("--graph-latency", type=float, default=0.005, help="每次 Cypher 查询的延迟（秒）")
+    parser.add_argument("--files", nargs="*", help="parse_file 场景使用的文件，默认生成一张示例图片")
+    parser.add_argument("--save", help="把结果保存为 JSON 基线")
+    parser.add_argument("--compare", help="与 JSON 基线比较，退化时以非零状态退出")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="允许的相对退化比例")
+    args = parser.parse_args(argv)
+
+    server = setup_backends(args)
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        scenarios = build_scenarios(args, tmp_dir)
+        for name in args.scenarios.split(","):
+            name = name.strip()
+            if name not in scenarios:
+                print(f"未知场景: {name}")
+                continue
+            print(f"运行场景 {name}（并发 {args.concurrency}，共 {args.requests} 次）...")
+            results[name] = run_scenario(scenarios[name], args.requests, args.concurrency)
+    server.shutdown()
+    print(f"嵌入接口共收到 {server.embedding_requests} 次请求，{server.embedding_inputs} 条输入")
+
+    print_report(results)
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print("检测到性能退化:")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print("未检测到性能退化。")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,10 @@
+import hashlib
+
+
+def hash_key(*parts):
+    """把若干字段拼接后取 sha256，作为缓存键"""
+    h = hashlib.sha256()
+    for part in parts:
+        h.update(str(part).encode("utf-8"))
+        h.update(b"\x00")
+    return h.hexdigest()
@@ -0,0 +1,262 @@
+import os
+import re
+import sys
+import argparse
+import numpy as np
+from dotenv import load_dotenv
+import tracing
+
+load_dotenv()
+
+# 章节检索时，查询向量向章节中心向量偏移的比例，0 表示沿用“第X章 + 问题”的拼接查询
+CHAPTER_BIAS = float(os.getenv("CHAPTER_BIAS", "0.3"))
+CHAPTER_CENTROIDS_PATH = os.getenv("CHAPTER_CENTROIDS_PATH", "./cache/chapter_centroids.npz")
+
+# 与 gradio_app 中章节下拉框的选项一致
+CHAPTERS = [
+    "第一章：软件工程学概述",
+    "第二章：可行性研究",
+    "第三章：需求分析",
+    "第四章：形式化说明技术",
+    "第五章：总体设计",
+    "第六章：详细设计",
+    "第七章：实现",
+    "第八章：维护",
+    "第九章：面向对象方法学引论",
+    "第十章：面向对象分析",
+    "第十一章：面向对象设计",
+    "第十二章：面向对象实现",
+    "第十三章：软件项目管理",
+]
+_NUMERALS = ["一", "二", "三", "四", "五", "六", "七", "八", "九", "十", "十一", "十二", "十三"]
+_LABEL_RE = re.compile(r"^第\s*([一二三四五六七八九十\d]+)\s*章\s*[：:]?\s*(.*)$")
+
+
+def parse_chapter(selected_chapter):
+    """
+    解析章节选项，兼容“第三章：需求分析”、“三”、“3”等写法
+
+    返回:
+        tuple: (章节序号 1~13, 章节标题)，无法识别时返回 (None, 原文)
+    """
+    text = (selected_chapter or "").strip()
+    match = _LABEL_RE.match(text)
+    numeral, title = (match.group(1), match.group(2)) if match else (text, "")
+    if numeral.isdigit():
+        number = int(numeral)
+    elif numeral in _NUMERALS:
+        number = _NUMERALS.index(numeral) + 1
+    else:
+        return None, text
+    if not 1 <= number <= len(CHAPTERS):
+        return None, text
+    return number, title or CHAPTERS[number - 1].split("：", 1)[1]
+
+
+def _chapter_pattern(number):
+    numeral = _NUMERALS[number - 1]
+    # 序号后紧跟“章”，因此“第一章”不会匹配到“第十一章”；英文写法需排除“chapter 11”
+    return re.compile(
+        rf"第\s*(?:{numeral}|{number})\s*章|chapter\s+{number}(?!\d)",
+        re.IGNORECASE,
+    )
+
+
+def tag_chapters(texts):
+    """
+    按分块文本中出现的章节标记为分块打上章节序号
+
+    返回:
+        list: 每个分块对应的章节序号集合
+    """
+    patterns = [_chapter_pattern(n) for n in range(1, len(CHAPTERS) + 1)]
+    return [
+        {n for n, pattern in enumerate(patterns, start=1) if pattern.search(text or "")}
+        for text in texts
+    ]
+
+
+def _normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (matrix / norms).astype(np.float32)
+
+
+def load_chunks(vector_store):
+    """
+    读出向量库中全部分块的向量和文本
+
+    返回:
+        tuple: (np.ndarray 向量矩阵, 文本列表)
+    """
+    if hasattr(vector_store, "matrix"):  # vector_index.NumpyVectorIndex
+        matrix = np.asarray(vector_store.matrix, dtype=np.float32)
+        if vector_store.scales is not None:
+            matrix = matrix * np.asarray(vector_store.scales)[:, None]
+        return matrix, vector_store.texts
+    data = vector_store._collection.get(include=["embeddings", "documents"])
+    return np.asarray(data["embeddings"], dtype=np.float32), data["documents"]
+
+
+class ChapterVectors:
+    """
+    各章节的中心向量
+
+    章节中心为该章所有分块向量（归一化后）的均值；没有分块带章节标记时，
+    用章节标题的嵌入向量代替。检索时把问题向量与章节中心按比例合成，
+    不必再为“第X章 + 问题”的拼接串单独请求一次嵌入。
+
+    参数:
+        vectors (np.ndarray): (章节数, 维度) 的归一化矩阵
+        counts (list): 每章参与计算的分块数，0 表示来自标题嵌入
+    """
+
+    def __init__(self, vectors, counts):
+        self.vectors = _normalize_rows(np.asarray(vectors, dtype=np.float32))
+        self.counts = list(counts)
+
+    @classmethod
+    def build(cls, vector_store, embeddings):
+        """从向量库中的分块计算章节中心"""
+        with tracing.span("chapter_vectors.build") as span:
+            matrix, texts = load_chunks(vector_store)
+            matrix = _normalize_rows(matrix)
+            tags = tag_chapters(texts)
+            vectors, counts, missing = [], [], []
+            for number in range(1, len(CHAPTERS) + 1):
+                rows = [i for i, chapters in enumerate(tags) if number in chapters]
+                counts.append(len(rows))
+                if rows:
+                    vectors.append(matrix[rows].mean(axis=0))
+                else:
+                    vectors.append(None)
+                    missing.append(number)
+            if missing:
+                # 只在构建时请求一次，运行时不再为章节标签调用嵌入接口
+                titles = [CHAPTERS[n - 1].replace("：", " ") for n in missing]
+                for number, vector in zip(missing, embeddings.embed_documents(titles)):
+                    vectors[number - 1] = np.asarray(vector, dtype=np.float32)
+            span.set_attribute("chunks", len(texts))
+            span.set_attribute("title_fallbacks", len(missing))
+            return cls(np.vstack(vectors), counts)
+
+    def save(self, path=CHAPTER_CENTROIDS_PATH, chunk_count=None):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp = path + ".tmp.npz"
+        np.savez(
+            tmp,
+            vectors=self.vectors,
+            counts=np.asarray(self.counts),
+            chunk_count=np.asarray(-1 if chunk_count is None else chunk_count),
+        )
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path=CHAPTER_CENTROIDS_PATH):
+        """
+        返回:
+            tuple: (ChapterVectors, 构建时向量库中的分块数)
+        """
+        with np.load(path) as data:
+            return cls(data["vectors"], data["counts"].tolist()), int(data["chunk_count"])
+
+    def get(self, selected_chapter):
+        number, _ = parse_chapter(selected_chapter)
+        return None if number is None else self.vectors[number - 1]
+
+    def bias(self, query_vector, selected_chapter, weight=CHAPTER_BIAS):
+        """
+        把查询向量向章节中心偏移：normalize((1 - w) * q + w * c)
+
+        返回:
+            list | None: 合成后的查询向量，章节无法识别时返回 None
+        """
+        centroid = self.get(selected_chapter)
+        if centroid is None:
+            return None
+        q = np.asarray(query_vector, dtype=np.float32)
+        norm = np.linalg.norm(q)
+        if norm > 0:
+            q = q / norm
+        combined = (1.0 - weight) * q + weight * centroid
+        norm = np.linalg.norm(combined)
+        return (combined / norm if norm > 0 else combined).tolist()
+
+    def overlap(self):
+        """
+        章节中心两两之间的余弦相似度
+
+        返回:
+            list: [(相似度, 章节A, 章节B), ...]，按相似度降序
+        """
+        sims = self.vectors @ self.vectors.T
+        pairs = []
+        for i in range(len(CHAPTERS)):
+            for j in range(i + 1, len(CHAPTERS)):
+                pairs.append((float(sims[i, j]), CHAPTERS[i], CHAPTERS[j]))
+        pairs.sort(reverse=True)
+        return pairs
+
+
+def load_or_build(vector_store, embeddings, path=CHAPTER_CENTROIDS_PATH, rebuild=False):
+    """
+    加载章节中心；文件不存在、向量库分块数有变化或 rebuild 为 True 时重新计算并保存
+
+    返回:
+        ChapterVectors | None: 失败时返回 None，检索退回拼接查询
+    """
+    try:
+        if hasattr(vector_store, "matrix"):
+            chunk_count = len(vector_store)
+        else:
+            chunk_count = vector_store._collection.count()
+        if not rebuild and os.path.exists(path):
+            chapter_vectors, saved_count = ChapterVectors.load(path)
+            if saved_count == chunk_count:
+                return chapter_vectors
+        chapter_vectors = ChapterVectors.build(vector_store, embeddings)
+        chapter_vectors.save(path, chunk_count=chunk_count)
+        print(f"章节中心向量已计算：{sum(1 for c in chapter_vectors.counts if c)} 章来自分块，已保存到 {path}")
+        return chapter_vectors
+    except Exception as e:
+        print(f"计算章节中心向量失败: {e}，章节检索将使用拼接查询。")
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="计算章节中心向量并报告章节之间的重叠程度")
+    parser.add_argument("command", choices=["build", "overlap"])
+    parser.add_argument("--path", default=CHAPTER_CENTROIDS_PATH)
+    parser.add_argument("--threshold", type=float, default=0.9, help="相似度不低于该值的章节对标记为重叠")
+    parser.add_argument("--top", type=int, default=15, help="overlap 最多显示的章节对数")
+    args = parser.parse_args(argv)
+
+    if args.command == "build" or not os.path.exists(args.path):
+        # 只加载向量库，不导入 agents（大模型客户端、知识图谱等与此无关）
+        from rag_store import load_vector_store
+
+        embeddings, vector_store = load_vector_store()
+        if vector_store is None:
+            print("向量库未加载，无法计算章节中心向量。")
+            return 1
+        chapter_vectors = load_or_build(vector_store, embeddings, args.path, rebuild=True)
+        if chapter_vectors is None:
+            return 1
+    else:
+        chapter_vectors, _ = ChapterVectors.load(args.path)
+
+    print(f"{'章节':<16}{'分块数':>8}")
+    for label, count in zip(CHAPTERS, chapter_vectors.counts):
+        print(f"{label:<16}{count if count else '标题':>8}")
+    if args.command == "overlap":
+        print(f"\n{'相似度':>8}  章节对")
+        for sim, a, b in chapter_vectors.overlap()[: args.top]:
+            flag = "  <- 重叠" if sim >= args.threshold else ""
+            print(f"{sim:>8.3f}  {a} / {b}{flag}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
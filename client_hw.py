@@ -2,40 +2,170 @@ import requests
 import json
 from dotenv import load_dotenv
 import os
+import time
+import tracing
+import model_routing
+import usage_ledger
+from singleflight import SingleFlight
+from llm_resilience import (
+    CircuitBreaker,
+    CircuitOpenError,
+    LatencyTracker,
+    NonRetryableError,
+    RetryableError,
+    hedged_call,
+    retry_call,
+)
 
 load_dotenv()
 
 huawei_api_key = os.getenv("HUAWEI_API_KEY")
+# 可通过环境变量指向本地的 OpenAI 兼容服务（如 mock_backends.py）
+maas_api_url = os.getenv(
+    "MAAS_API_URL", "https://api.modelarts-maas.com/v1/chat/completions"
+)
+# 备用端点/模型，按顺序尝试，JSON 列表：
+# [{"url": "https://...", "model": "DeepSeek-R1", "api_key_env": "BACKUP_API_KEY"}]
+llm_fallbacks = json.loads(os.getenv("LLM_FALLBACKS", "[]"))
+llm_timeout = float(os.getenv("LLM_TIMEOUT", "60"))  # 单次请求超时（秒）
+llm_max_retries = int(os.getenv("LLM_MAX_RETRIES", "2"))  # 每个端点的重试次数
+# 对冲请求：超过该端点最近 p95 延迟仍未返回时再发一份，取先返回的结果
+llm_hedge = os.getenv("LLM_HEDGE", "0") == "1"
+llm_hedge_min_delay = float(os.getenv("LLM_HEDGE_MIN_DELAY", "2"))
 
+# 合并并发的相同请求（同一提示词和参数只向上游发一次）
+_chat_flight = SingleFlight("chat")
 
-def get_model_response(system_content, user_content):
-    url = "https://api.modelarts-maas.com/v1/chat/completions"
-    api_key = huawei_api_key  # 请替换为你的API密钥
 
-    # 设置请求头
-    headers = {"Content-Type": "application/json", "Authorization": f"Bearer {api_key}"}
+class _Endpoint:
+    def __init__(self, url, model, api_key):
+        self.url = url
+        self.model = model  # None 表示使用调用点路由的模型
+        self.api_key = api_key
+        self.breaker = CircuitBreaker(
+            failure_threshold=int(os.getenv("LLM_BREAKER_FAILURES", "5")),
+            reset_timeout=float(os.getenv("LLM_BREAKER_RESET", "30")),
+        )
+        self.latency = LatencyTracker()
+
+    def hedge_delay(self):
+        if not llm_hedge:
+            return None
+        p95 = self.latency.percentile(95)
+        return max(llm_hedge_min_delay, p95) if p95 is not None else None
+
+
+_endpoints = [_Endpoint(maas_api_url, None, huawei_api_key)] + [
+    _Endpoint(
+        fb.get("url", maas_api_url),
+        fb["model"],
+        os.getenv(fb["api_key_env"]) if fb.get("api_key_env") else huawei_api_key,
+    )
+    for fb in llm_fallbacks
+]
+
+
+def get_model_response(system_content, user_content, call_site="default"):
+    # 模型和生成参数（temperature、max_tokens 等）按调用点路由，见 model_routing.py；
+    # 用量接近预算时改用降级路由，用完时不再调用（见 usage_ledger.py）
+    level = usage_ledger.current_level()
+    if level == usage_ledger.EXHAUSTED:
+        print(f"用量额度已用完，跳过 {call_site} 的大模型调用")
+        return None
+    route = model_routing.get_route(call_site, degraded=level == usage_ledger.DEGRADED)
 
     # 准备请求数据
     data = {
-        "model": "DeepSeek-V3",  # 模型名称
+        "model": route["model"],  # 模型名称
         "messages": [
             {"role": "system", "content": system_content},  # 系统角色内容
             {"role": "user", "content": user_content},  # 用户角色内容
         ],
         "stream": False,  # 是否开启流式推理
-        "temperature": 0.6,  # 采样随机性控制
     }
+    for param in model_routing.GENERATION_PARAMS:
+        if param in route:
+            data[param] = route[param]
+
+    with tracing.span("llm.chat", model=data["model"], call_site=call_site, budget=level):
+        key = _chat_flight.key(json.dumps(data))
+        reply, position, callers = _chat_flight.do_shared(key, _chat_with_fallback, data)
+        if reply is None:
+            return None
+        content, usage, model, hedged = reply
+        # 模型和用量记在每个调用方自己的 span 上；合并的请求只发了一次，用量按调用方分摊
+        tracing.set_attribute("model", model)
+        if hedged:
+            tracing.set_attribute("hedged", True)
+        tracing.record_usage(usage, share=(position, callers))
+        return content
 
-    # 发送POST请求
-    response = requests.post(url, headers=headers, data=json.dumps(data), verify=False)
+
+def _chat_with_fallback(data):
+    """
+    依次尝试各端点（跳过熔断中的端点）
+
+    返回:
+        tuple | None: (回答, 用量, 实际使用的模型, 是否触发了对冲)，全部失败时返回 None
+    """
+    for endpoint in _endpoints:
+        model = endpoint.model or data["model"]
+        if not endpoint.breaker.allow():
+            print(f"模型端点 {model} 熔断中，跳过")
+            continue
+        body = json.dumps(dict(data, model=model))
+        try:
+            (content, usage), hedged = retry_call(
+                lambda: hedged_call(
+                    lambda: _post_chat(endpoint, body), endpoint.hedge_delay()
+                ),
+                max_retries=llm_max_retries,
+                breaker=endpoint.breaker,
+            )
+        except (RetryableError, NonRetryableError, CircuitOpenError) as e:
+            print(f"模型端点 {model} 调用失败: {e}")
+            tracing.record_error(type(e).__name__)
+            continue
+        return content, usage, model, hedged
+    return None
+
+
+def _post_chat(endpoint, body):
+    # 设置请求头
+    headers = {
+        "Content-Type": "application/json",
+        "Authorization": f"Bearer {endpoint.api_key}",
+    }
+    start = time.monotonic()
+    try:
+        # 发送POST请求
+        response = requests.post(
+            endpoint.url, headers=headers, data=body, verify=False, timeout=llm_timeout
+        )
+    except requests.exceptions.RequestException as e:
+        endpoint.breaker.record_failure()
+        raise RetryableError(f"{type(e).__name__}: {e}") from e
 
     # 返回模型的回答
     if response.status_code == 200:
-        result = response.json()  # 将返回的JSON数据转换为字典
-        return result["choices"][0]["message"]["content"]  # 提取模型回答的内容
-    else:
-        print(f"Error: {response.status_code}")
-        return None
+        try:
+            result = response.json()  # 将返回的JSON数据转换为字典
+            content = result["choices"][0]["message"]["content"]  # 提取模型回答的内容
+        except (ValueError, KeyError, IndexError) as e:
+            endpoint.breaker.record_failure()
+            raise NonRetryableError(f"响应格式异常: {e}") from e
+        endpoint.breaker.record_success()
+        endpoint.latency.add(time.monotonic() - start)
+        return content, result.get("usage")
+
+    print(f"Error: {response.status_code}")
+    tracing.record_error(f"http_{response.status_code}")
+    if response.status_code == 429 or response.status_code >= 500:
+        endpoint.breaker.record_failure()
+        raise RetryableError(f"HTTP {response.status_code}")
+    # 其他 4xx 说明端点可达，按成功处理，也让半开状态的试探请求结束
+    endpoint.breaker.record_success()
+    raise NonRetryableError(f"HTTP {response.status_code}")
 
 
 # 示例用法
@@ -0,0 +1,588 @@
+# 大模型生成的 Graphviz DOT 代码的本地校验、自动修复与受限渲染。
+#
+# 生成的流程图代码常见的问题是标签中未转义的引号、缺少结尾引号或括号、属性值里有
+# 括号等需要加引号的字符，以及中文标签使用了不含中文字形的字体。prepare() 先按 DOT
+# 语法解析，解析失败时做确定性的修复后再解析，并检查节点数和边数上限、统一设置中文字体；
+# 修复不了时直接报告出错位置，不必重新调用大模型。render() 在子进程中调用 dot，
+# 限制耗时和内存，超时或超限时尽快失败，不长时间占用工作线程。
+import os
+import re
+import shutil
+import subprocess
+import threading
+from collections import namedtuple
+
+try:  # 仅 Linux 支持给已启动的子进程设置资源限制
+    import resource
+except ImportError:
+    resource = None
+
+DOT_BINARY = os.getenv("DOT_BINARY", "dot")
+DOT_MAX_CHARS = int(os.getenv("DOT_MAX_CHARS", "100000"))
+DOT_MAX_NODES = int(os.getenv("DOT_MAX_NODES", "200"))
+DOT_MAX_EDGES = int(os.getenv("DOT_MAX_EDGES", "600"))
+DOT_RENDER_TIMEOUT = float(os.getenv("DOT_RENDER_TIMEOUT", "15"))  # 秒
+DOT_RENDER_MEMORY_MB = int(os.getenv("DOT_RENDER_MEMORY_MB", "1024"))
+DOT_RENDER_CONCURRENCY = int(os.getenv("DOT_RENDER_CONCURRENCY", "2"))
+# 中文标签使用的字体，不设置时用 fc-list 查找已安装的中文字体
+DOT_FONT = os.getenv("DOT_FONT")
+
+OUTPUT_FORMATS = ("png", "svg", "pdf", "jpg")
+KEYWORDS = ("strict", "graph", "digraph", "node", "edge", "subgraph")
+
+Token = namedtuple("Token", "kind text line")
+
+_WS_RE = re.compile(r"[ \t\r\n\f\v\ufeff]+")
+_ID_RE = re.compile(r"[A-Za-z_\u0080-\U0010ffff][A-Za-z_0-9\u0080-\U0010ffff]*")
+_NUMBER_RE = re.compile(r"-?(?:\.[0-9]+|[0-9]+(?:\.[0-9]*)?)")
+_PUNCT = "{}[];,=:+"
+# 属性值可能被截断的位置：引号没有闭合时在这些字符之前补上引号
+_STRING_TAIL_RE = re.compile(r"[\s\];,}]*$")
+_NEXT_ATTR_RE = re.compile(r"\s+[A-Za-z_][A-Za-z_0-9]*\s*=")
+
+
+class DotError(ValueError):
+    """DOT 代码无法解析（自动修复后仍然无法解析）或超出规模上限"""
+
+
+class DotRenderError(RuntimeError):
+    """dot 渲染失败、超时或超出内存限制"""
+
+
+class DotGraph:
+    """
+    解析结果的概要
+
+    参数:
+        directed (bool): 是否为有向图
+        nodes (set): 节点名（去掉引号）
+        edges (int): 边数
+    """
+
+    def __init__(self, directed, nodes, edges):
+        self.directed = directed
+        self.nodes = nodes
+        self.edges = edges
+
+
+#=========词法分析========#
+def _is_id(text):
+    return bool(_ID_RE.fullmatch(text) or _NUMBER_RE.fullmatch(text))
+
+
+def _string_closes(src, k, eol):
+    """修复模式下判断 src[k-1] 处的引号是否是字符串的结尾，而不是标签中未转义的引号"""
+    rest = src[k:eol]
+    stripped = rest.lstrip(" \t")
+    if not stripped:
+        return True
+    spaced = len(stripped) != len(rest)
+    if stripped[0] == '"':
+        return spaced  # "" 紧挨着时是标签中的引号，隔着空白时是下一个字符串
+    if stripped[0] in "];,}+=[:{" or stripped.startswith(("->", "--", "//", "/*")):
+        return True
+    if not spaced:
+        return False  # 引号后紧跟文字，如 "He said "hi""
+    # 引号后隔着空白的文字只有是下一个属性名（后面跟 =）时才算字符串结束
+    match = _ID_RE.match(stripped)
+    return bool(match) and stripped[match.end():].lstrip(" \t").startswith("=")
+
+
+def _repair_string(src, i, repairs, line):
+    """修复模式下读取从 src[i] 开始的字符串：不跨行，转义内部引号，缺少结尾引号时补上"""
+    eol = src.find("\n", i)
+    if eol == -1:
+        eol = len(src)
+    body = []
+    j = i + 1
+    while j < eol:
+        c = src[j]
+        if c == "\\" and j + 1 < eol:
+            body.append(src[j : j + 2])
+            j += 2
+            continue
+        if c == '"':
+            if _string_closes(src, j + 1, eol):
+                return '"' + "".join(body) + '"', j + 1
+            body.append('\\"')
+            repairs.append(f"第 {line} 行：转义字符串中的引号")
+        else:
+            body.append(c)
+        j += 1
+    text = "".join(body)
+    tail = _STRING_TAIL_RE.search(text).group()
+    text = text[: len(text) - len(tail)]
+    if text.endswith("\\") and not text.endswith("\\\\"):
+        text = text[:-1]
+    repairs.append(f"第 {line} 行：补上缺少的结尾引号")
+    return '"' + text + '"', eol - len(tail)
+
+
+def lex(src, repairs=None):
+    """
+    把 DOT 代码切分为 Token，空白和注释也保留为 Token，拼接后与输入一致
+
+    参数:
+        src (str): DOT 代码
+        repairs (list): 提供时按修复模式切分，修复说明追加到该列表
+
+    返回:
+        list: Token(kind, text, line)，kind 为 ws、comment、id、string、html、punct、edgeop、bad
+    """
+    tokens = []
+    line = 1
+    i = 0
+    n = len(src)
+    last = None  # 上一个有意义的 Token
+    while i < n:
+        c = src[i]
+        kind = None
+        match = _WS_RE.match(src, i)
+        if match:
+            kind, end = "ws", match.end()
+        elif src.startswith("//", i) or (c == "#" and (i == 0 or src[i - 1] == "\n")):
+            end = src.find("\n", i)
+            kind, end = "comment", n if end == -1 else end
+        elif src.startswith("/*", i):
+            end = src.find("*/", i + 2)
+            kind, end = "comment", n if end == -1 else end + 2
+        elif repairs is not None and last is not None and last.text == "=" and c not in "\"<":
+            # 属性值中有括号、空格等字符时整体加上引号
+            end = i
+            while end < n and src[end] not in ",;]}\n":
+                end += 1
+            # 空格分隔的下一个属性（如 color=red fontcolor=blue）不算在内
+            next_attr = _NEXT_ATTR_RE.search(src, i, end)
+            raw = src[i : next_attr.start() if next_attr else end].rstrip(" \t\r")
+            if raw and not _is_id(raw):
+                escaped = raw.replace("\\", "\\\\").replace('"', '\\"')
+                tokens.append(Token("string", f'"{escaped}"', line))
+                repairs.append(f"第 {line} 行：属性值 {raw} 加上引号")
+                last = tokens[-1]
+                i += len(raw)
+                continue
+        if kind is None:
+            if c == '"':
+                if repairs is not None:
+                    text, end = _repair_string(src, i, repairs, line)
+                    tokens.append(Token("string", text, line))
+                    line += src.count("\n", i, end)
+                    last = tokens[-1]
+                    i = end
+                    continue
+                end = i + 1
+                while end < n and src[end] != '"':
+                    end += 2 if src[end] == "\\" else 1
+                kind, end = "string", min(end + 1, n + 1)
+                if end > n:
+                    kind, end = "bad", n  # 没有结尾引号
+            elif c == "<":
+                depth, end = 0, i
+                while end < n:
+                    depth += {"<": 1, ">": -1}.get(src[end], 0)
+                    end += 1
+                    if depth == 0:
+                        break
+                kind = "html" if depth == 0 else "bad"
+            elif src.startswith(("->", "--"), i):
+                kind, end = "edgeop", i + 2
+            elif c in _PUNCT:
+                kind, end = "punct", i + 1
+            else:
+                match = _ID_RE.match(src, i) or _NUMBER_RE.match(src, i)
+                kind, end = ("id", match.end()) if match else ("bad", i + 1)
+        token = Token(kind, src[i:end], line)
+        tokens.append(token)
+        if kind not in ("ws", "comment"):
+            last = token
+        line += token.text.count("\n")
+        i = end
+    return tokens
+
+
+def _significant(tokens):
+    return [t for t in tokens if t.kind not in ("ws", "comment")]
+
+
+#=========语法分析========#
+class _Parser:
+    def __init__(self, tokens):
+        self.tokens = _significant(tokens)
+        self.i = 0
+        self.directed = False
+        self.nodes = set()
+        self.edges = 0
+
+    def peek(self):
+        return self.tokens[self.i] if self.i < len(self.tokens) else None
+
+    def error(self, message):
+        token = self.peek() or (self.tokens[-1] if self.tokens else Token("", "", 1))
+        raise DotError(f"第 {token.line} 行附近{message}")
+
+    def is_punct(self, text):
+        token = self.peek()
+        return token is not None and token.kind in ("punct", "edgeop") and token.text == text
+
+    def accept(self, text):
+        if self.is_punct(text):
+            self.i += 1
+            return True
+        return False
+
+    def expect(self, text):
+        if not self.accept(text):
+            found = self.peek()
+            self.error(f"缺少 '{text}'" + (f"，遇到 '{found.text}'" if found else ""))
+
+    def is_keyword(self, *words):
+        token = self.peek()
+        return token is not None and token.kind == "id" and token.text.lower() in words
+
+    def id(self):
+        token = self.peek()
+        if token is None or token.kind not in ("id", "string", "html"):
+            self.error("缺少名称或属性值" + (f"，遇到 '{token.text}'" if token else ""))
+        if token.kind == "id" and token.text.lower() in KEYWORDS:
+            self.error(f"关键字 '{token.text}' 不能直接用作名称，需要加引号")
+        self.i += 1
+        if token.kind != "string":
+            return token.text
+        value = token.text[1:-1]
+        while self.accept("+"):
+            value += self.id()
+        return value
+
+    def graph(self):
+        if not self.tokens:
+            raise DotError("DOT 代码为空")
+        if self.is_keyword("strict"):
+            self.i += 1
+        if not self.is_keyword("graph", "digraph"):
+            self.error("缺少 graph/digraph 声明")
+        self.directed = self.peek().text.lower() == "digraph"
+        self.i += 1
+        if not self.is_punct("{"):
+            self.id()
+        self.expect("{")
+        self.stmt_list()
+        self.expect("}")
+        if self.peek() is not None:
+            self.error("图定义结束后还有多余内容")
+
+    def stmt_list(self):
+        while self.peek() is not None and not self.is_punct("}"):
+            self.stmt()
+            self.accept(";")
+
+    def stmt(self):
+        if self.is_keyword("graph", "node", "edge"):
+            self.i += 1
+            if not self.is_punct("["):
+                self.error("属性语句缺少 '['")
+            self.attr_list()
+            return
+        if self.is_keyword("subgraph") or self.is_punct("{"):
+            self.subgraph()
+        else:
+            name = self.id()
+            if self.accept("="):
+                self.id()
+                return
+            self.port()
+            self.nodes.add(name)
+        while self.peek() is not None and self.peek().kind == "edgeop":
+            if self.peek().text != ("->" if self.directed else "--"):
+                self.error(f"{'有向图' if self.directed else '无向图'}中不能使用 '{self.peek().text}'")
+            self.i += 1
+            self.edges += 1
+            if self.is_keyword("subgraph") or self.is_punct("{"):
+                self.subgraph()
+            else:
+                self.nodes.add(self.id())
+                self.port()
+        if self.is_punct("["):
+            self.attr_list()
+
+    def port(self):
+        while self.accept(":"):
+            self.id()
+
+    def subgraph(self):
+        if self.is_keyword("subgraph"):
+            self.i += 1
+            if not self.is_punct("{"):
+                self.id()
+        self.expect("{")
+        self.stmt_list()
+        self.expect("}")
+
+    def attr_list(self):
+        while self.accept("["):
+            while not self.is_punct("]"):
+                if self.peek() is None:
+                    self.error("属性列表缺少 ']'")
+                self.id()
+                self.expect("=")
+                self.id()
+                if not self.accept(","):
+                    self.accept(";")
+            self.expect("]")
+
+
+def parse(code):
+    """
+    按 DOT 语法解析，不做修复
+
+    返回:
+        DotGraph: 解析结果概要；语法错误时抛出 DotError，信息中带行号
+    """
+    tokens = lex(code)
+    bad = next((t for t in tokens if t.kind == "bad"), None)
+    if bad is not None:
+        raise DotError(f"第 {bad.line} 行附近有无法识别的内容 '{bad.text[:20]}'")
+    parser = _Parser(tokens)
+    parser.graph()
+    return DotGraph(parser.directed, parser.nodes, parser.edges)
+
+
+#=========自动修复========#
+def _close_bracket(result, opener, line, repairs):
+    """在属性列表开始后的最后一个换行处补上 ]，没有换行时补在末尾"""
+    at = len(result)
+    for k in range(len(result) - 1, opener, -1):
+        if result[k].kind == "ws" and "\n" in result[k].text:
+            at = k
+            break
+    result.insert(at, Token("punct", "]", line))
+    repairs.append(f"第 {line} 行附近：补上缺少的 ']'")
+
+
+def _balance(tokens, repairs):
+    """补齐缺少的 ] 和 }，删除多余的 ] 和 }"""
+    result = []
+    stack = []  # (括号, 在 result 中的位置)
+    for token in tokens:
+        is_punct = token.kind in ("punct", "edgeop")
+        # 属性列表中不会出现边、{ 和 [，遇到时说明前面的 [ 没有闭合
+        if stack and stack[-1][0] == "[" and is_punct and token.text in ("->", "--", "{", "[", "}"):
+            _close_bracket(result, stack.pop()[1], token.line, repairs)
+        if is_punct and token.text in "{[":
+            stack.append((token.text, len(result)))
+        elif is_punct and token.text == "]":
+            if not stack or stack[-1][0] != "[":
+                repairs.append(f"第 {token.line} 行：删除多余的 ']'")
+                continue
+            stack.pop()
+        elif is_punct and token.text == "}":
+            if not stack:
+                repairs.append(f"第 {token.line} 行：删除多余的 '}}'")
+                continue
+            stack.pop()
+        result.append(token)
+    line = tokens[-1].line if tokens else 1
+    while stack:
+        opener, position = stack.pop()
+        if opener == "[":
+            _close_bracket(result, position, line, repairs)
+        else:
+            result.append(Token("punct", "\n}", line))
+            repairs.append("结尾：补上缺少的 '}'")
+    return result
+
+
+def _quote_keywords(tokens, repairs):
+    """用作节点名的 node、edge、graph 加上引号"""
+    significant = _significant(tokens)
+    quote = set()
+    for k, token in enumerate(significant):
+        if token.kind != "id" or token.text.lower() not in ("node", "edge", "graph"):
+            continue
+        before = significant[k - 1] if k > 0 else None
+        after = significant[k + 1] if k + 1 < len(significant) else None
+        if (before is not None and before.kind == "edgeop") or (after is not None and after.kind == "edgeop"):
+            quote.add(id(token))
+            repairs.append(f"第 {token.line} 行：节点名 {token.text} 加上引号")
+    return [Token("string", f'"{t.text}"', t.line) if id(t) in quote else t for t in tokens]
+
+
+def _fix_header(tokens, repairs):
+    """补上缺少的 digraph 声明，并让边的写法与图的类型一致"""
+    significant = _significant(tokens)
+    first = significant[0] if significant else None
+    if first is None or first.kind != "id" or first.text.lower() not in ("strict", "graph", "digraph"):
+        repairs.append("开头：补上 digraph 声明")
+        if first is not None and first.text == "{":
+            tokens = [Token("id", "digraph G ", 1)] + tokens
+        else:
+            tokens = [Token("id", "digraph G {\n", 1)] + tokens + [Token("punct", "\n}", 1)]
+        significant = _significant(tokens)
+    header = significant[1] if significant[0].text.lower() == "strict" else significant[0]
+    directed = header.text.split()[0].lower() == "digraph"
+    ops = {t.text for t in tokens if t.kind == "edgeop"}
+    if not directed and "->" in ops:
+        repairs.append("开头：图中使用了 '->'，改为 digraph")
+        tokens = [Token("id", "digraph", t.line) if t is header else t for t in tokens]
+        directed = True
+    if directed and "--" in ops:
+        repairs.append("有向图中的 '--' 改为 '->'")
+        tokens = [Token("edgeop", "->", t.line) if t.kind == "edgeop" else t for t in tokens]
+    return tokens
+
+
+def repair(code):
+    """
+    对 DOT 代码做确定性的修复：字符串中未转义的引号、缺少的结尾引号、属性值加引号、
+    括号配对、缺少的 digraph 声明、边的写法与图类型不一致、用作节点名的关键字
+
+    返回:
+        tuple: (修复后的代码, 修复说明列表)
+    """
+    repairs = []
+    tokens = lex(code, repairs)
+    tokens = _balance(tokens, repairs)
+    tokens = _fix_header(tokens, repairs)
+    tokens = _quote_keywords(tokens, repairs)
+    return "".join(t.text for t in tokens), list(dict.fromkeys(repairs))
+
+
+_font = None
+
+
+def cjk_font():
+    """中文字体：DOT_FONT，或 fc-list 找到的第一个中文字体，都没有时按系统给出常见字体名"""
+    global _font
+    if _font is None:
+        _font = DOT_FONT
+        if not _font and shutil.which("fc-list"):
+            try:
+                result = subprocess.run(
+                    ["fc-list", ":lang=zh", "family"], capture_output=True, text=True, timeout=5
+                )
+                families = sorted(line.split(",")[0].strip() for line in result.stdout.splitlines() if line.strip())
+                _font = families[0] if families else None
+            except (OSError, subprocess.SubprocessError):
+                pass
+        if not _font:
+            _font = "Microsoft YaHei" if os.name == "nt" else "Noto Sans CJK SC"
+    return _font
+
+
+def set_font(code, font=None):
+    """
+    含中文时统一使用中文字体：替换已有的 fontname，并在图的开头设置图、节点、边的默认字体
+
+    返回:
+        tuple: (新的代码, 是否做了修改)
+    """
+    tokens = lex(code)
+    if not any(t.kind in ("id", "string", "html") and not t.text.isascii() for t in tokens):
+        return code, False
+    value = '"' + (font or cjk_font()) + '"'
+    significant = _significant(tokens)
+    replace = set()
+    for k, token in enumerate(significant[:-2]):
+        if token.text.strip('"').lower() == "fontname" and significant[k + 1].text == "=":
+            replace.add(id(significant[k + 2]))
+    result = []
+    injected = False
+    for token in tokens:
+        if id(token) in replace:
+            token = token._replace(text=value)
+        result.append(token)
+        if not injected and token.text == "{":
+            result.append(
+                Token("id", f"\n    graph [fontname={value}];\n    node [fontname={value}];\n"
+                            f"    edge [fontname={value}];", token.line)
+            )
+            injected = True
+    return "".join(t.text for t in result), True
+
+
+def prepare(code, font=None):
+    """
+    校验并在需要时修复 DOT 代码，检查规模上限，统一中文字体
+
+    返回:
+        tuple: (可以渲染的代码, DotGraph, 修复说明列表)；修复后仍无法解析或超出上限时抛出 DotError
+    """
+    if len(code) > DOT_MAX_CHARS:
+        raise DotError(f"DOT 代码长度 {len(code)} 超过上限 {DOT_MAX_CHARS}")
+    repairs = []
+    try:
+        graph = parse(code)
+    except DotError as e:
+        code, repairs = repair(code)
+        try:
+            graph = parse(code)
+        except DotError as again:
+            if str(again) == str(e):
+                raise
+            raise DotError(f"{again}（原始错误：{e}）") from again
+    if len(graph.nodes) > DOT_MAX_NODES:
+        raise DotError(f"流程图有 {len(graph.nodes)} 个节点，超过上限 {DOT_MAX_NODES}")
+    if graph.edges > DOT_MAX_EDGES:
+        raise DotError(f"流程图有 {graph.edges} 条边，超过上限 {DOT_MAX_EDGES}")
+    code, changed = set_font(code, font)
+    if changed:
+        repairs.append("设置中文字体")
+    return code, graph, repairs
+
+
+#=========受限渲染========#
+_render_slots = threading.BoundedSemaphore(max(1, DOT_RENDER_CONCURRENCY))
+
+
+def _limit_memory(pid, memory_mb):
+    if resource is None or not hasattr(resource, "prlimit") or memory_mb <= 0:
+        return
+    limit = memory_mb * 1024 * 1024
+    try:
+        resource.prlimit(pid, resource.RLIMIT_AS, (limit, limit))
+    except (OSError, ValueError) as e:
+        print(f"设置 dot 进程内存上限失败: {e}")
+
+
+def render(code, output_file, output_format="png", timeout=DOT_RENDER_TIMEOUT, memory_mb=DOT_RENDER_MEMORY_MB):
+    """
+    在子进程中用 dot 渲染，DOT 代码从标准输入传入
+
+    同时进行的渲染数不超过 DOT_RENDER_CONCURRENCY，排队超过 timeout 秒直接失败；
+    子进程超过 timeout 秒被终止，在 Linux 上虚拟内存限制为 memory_mb。
+
+    返回:
+        str: 输出文件的绝对路径；失败时抛出 DotRenderError
+    """
+    if output_format not in OUTPUT_FORMATS:
+        raise DotRenderError(f"不支持的输出格式: {output_format}")
+    binary = shutil.which(DOT_BINARY)
+    if binary is None:
+        raise DotRenderError("未找到 Graphviz 的 dot 命令，请安装 Graphviz 并加入 PATH")
+    output_file = os.path.abspath(output_file)
+    os.makedirs(os.path.dirname(output_file), exist_ok=True)
+    if not _render_slots.acquire(timeout=timeout):
+        raise DotRenderError("当前渲染任务过多，请稍后重试")
+    try:
+        proc = subprocess.Popen(
+            [binary, f"-T{output_format}", "-o", output_file],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+        )
+        _limit_memory(proc.pid, memory_mb)
+        try:
+            _, stderr = proc.communicate(code.encode("utf-8"), timeout=timeout)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.communicate()
+            raise DotRenderError(f"渲染超过 {timeout:g} 秒，已终止")
+    finally:
+        _render_slots.release()
+    message = stderr.decode("utf-8", "replace").strip()
+    if proc.returncode != 0 or not os.path.exists(output_file):
+        if os.path.exists(output_file):
+            os.remove(output_file)
+        if proc.returncode is not None and proc.returncode < 0:
+            message = message or f"dot 进程被信号 {-proc.returncode} 终止（可能超出内存上限 {memory_mb}MB）"
+        raise DotRenderError(message.splitlines()[-1] if message else f"dot 退出码 {proc.returncode}")
+    return output_file
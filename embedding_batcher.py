@@ -0,0 +1,132 @@
+import time
+import queue
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+import tracing
+
+# 批次 span 上记录的用量属性，按输入长度分摊给各个调用方
+USAGE_ATTRIBUTES = ("prompt_tokens", "completion_tokens", "cached_tokens")
+
+
+class MicroBatcher:
+    """
+    把并发的单条请求攒成批次处理
+
+    调度线程取到第一条请求后，最多再等 window 秒或攒满 max_batch 条，
+    然后把整批交给线程池中的 batch_fn 处理，再把结果按顺序分发给各个等待的调用方。
+    同一批次中重复的输入只处理一次。
+
+    batch_fn 在线程池中运行，拿不到调用方的 contextvars（请求、用户）。它记在批次 span 上的
+    token 用量会从批次 span 移到各个 Future 上（按输入长度分摊），调用方拿到结果后用
+    annotate() 记到自己的 span 上，用量账本因此能按调用方的用户和请求记账。
+
+    参数:
+        batch_fn (callable): 接收输入列表、返回等长结果列表的函数
+        window (float): 攒批等待时间（秒）
+        max_batch (int): 单批最多条数
+        workers (int): 同时处理的批次数
+        name (str): 名称，用于 span 和线程名
+    """
+
+    def __init__(self, batch_fn, window=0.005, max_batch=32, workers=1, name="embedding"):
+        self.batch_fn = batch_fn
+        self.window = window
+        self.max_batch = max_batch
+        self.name = name
+        self._queue = queue.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"{name}-batch")
+        self._dispatcher = threading.Thread(
+            target=self._dispatch_loop, daemon=True, name=f"{name}-batcher"
+        )
+        self._dispatcher.start()
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.batches = 0
+
+    def submit(self, item):
+        """
+        提交一条输入，返回 Future；完成后 Future.batch_size 为其所在批次的大小，
+        Future.usage 为分摊到这条输入的用量（{属性名: token 数}）
+        """
+        future = Future()
+        self._queue.put((item, future))
+        return future
+
+    @staticmethod
+    def annotate(future):
+        """把已完成 Future 的批次大小和分摊用量记到当前 span 上（在调用方的上下文中调用）"""
+        tracing.set_attribute("batch.size", getattr(future, "batch_size", 1))
+        for key, value in getattr(future, "usage", {}).items():
+            if value:
+                tracing.set_attribute(key, value)
+
+    def __call__(self, item):
+        future = self.submit(item)
+        result = future.result()
+        self.annotate(future)
+        return result
+
+    def _dispatch_loop(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._executor.submit(self._run_batch, batch)
+
+    def _run_batch(self, batch):
+        unique = list(dict.fromkeys(item for item, _ in batch))
+        with self._lock:
+            self.requests += len(batch)
+            self.batches += 1
+        try:
+            with tracing.span(f"{self.name}.batch", batch_size=len(unique), waiters=len(batch)) as span:
+                results = self.batch_fn(unique)
+                # 用量不留在批次 span 上（这里没有调用方的上下文），改由各调用方记账
+                usage = {
+                    key: span.attributes.pop(key) for key in USAGE_ATTRIBUTES if key in span.attributes
+                }
+            by_item = dict(zip(unique, results))
+            shares = _split_usage(usage, [len(str(item)) or 1 for item, _ in batch])
+            for (item, future), share in zip(batch, shares):
+                future.batch_size = len(batch)
+                future.usage = share
+                future.set_result(by_item[item])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "batches": self.batches,
+                "avg_batch": self.requests / self.batches if self.batches else 0.0,
+            }
+
+
+def _split_usage(usage, weights):
+    """
+    按权重把各项 token 数分成整数份，每项的份额之和等于原值
+
+    返回:
+        list: 每个权重对应一个 {属性名: token 数}
+    """
+    shares = [{} for _ in weights]
+    total_weight = sum(weights)
+    for key, value in usage.items():
+        value = int(value or 0)
+        assigned = 0
+        for share, weight in zip(shares, weights):
+            share[key] = value * weight // total_weight
+            assigned += share[key]
+        if shares:
+            shares[-1][key] += value - assigned
+    return shares
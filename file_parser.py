@@ -0,0 +1,92 @@
+import os
+import textract
+from PIL import Image
+import ocr_engine
+
+# 上传文件的限制：超出文件大小或页数时直接拒绝，单页文本超长时截断
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(20 * 1024 * 1024)))
+UPLOAD_MAX_PAGES = int(os.getenv("UPLOAD_MAX_PAGES", "50"))
+UPLOAD_MAX_PAGE_CHARS = int(os.getenv("UPLOAD_MAX_PAGE_CHARS", "6000"))
+# 图片超过该像素数时先缩小再识别，避免 OCR 占用过多内存
+UPLOAD_MAX_IMAGE_PIXELS = int(os.getenv("UPLOAD_MAX_IMAGE_PIXELS", str(4000 * 4000)))
+# 设为 0 时不做预处理，把整张图直接交给 Tesseract（见 ocr_preprocess.py）
+OCR_PREPROCESS = os.getenv("OCR_PREPROCESS", "1") == "1"
+
+SUPPORTED_EXTENSIONS = [".docx", ".pdf", ".png", ".jpg", ".jpeg"]
+
+
+class UploadRejected(ValueError):
+    """上传文件不符合限制，在解析前拒绝"""
+
+
+def check_upload(fname):
+    """解析前检查文件类型和大小，不符合时抛出 UploadRejected"""
+    ext = os.path.splitext(fname)[-1].lower()
+    if ext not in SUPPORTED_EXTENSIONS:
+        raise UploadRejected("暂不支持该文件类型")
+    size = os.path.getsize(fname)
+    if size > UPLOAD_MAX_BYTES:
+        raise UploadRejected(
+            f"文件大小 {size / 1024 / 1024:.1f}MB 超过上限 {UPLOAD_MAX_BYTES / 1024 / 1024:.0f}MB"
+        )
+    return ext
+
+
+def _ocr_image(img):
+    if img.width * img.height > UPLOAD_MAX_IMAGE_PIXELS:
+        scale = (UPLOAD_MAX_IMAGE_PIXELS / (img.width * img.height)) ** 0.5
+        img.thumbnail((int(img.width * scale), int(img.height * scale)))
+    if OCR_PREPROCESS:
+        import ocr_preprocess
+
+        return ocr_preprocess.ocr_image(img)
+    return ocr_engine.image_to_string(img)
+
+
+#=========上传文件转为文本========#
+def iter_pages(file_obj):
+    """
+    逐页解析上传文件，每次只在内存中保留一页文本
+
+    PDF 用 pypdf 按页提取；docx 没有页的概念，按段落拼成不超过单页长度的块；
+    图片整张识别为一页。
+
+    参数:
+        file_obj: Gradio 上传的文件对象（有 name 属性）或文件路径
+
+    返回:
+        generator: 逐页产出 (页码, 文本)，页码从 1 开始
+    """
+    fname = getattr(file_obj, "name", file_obj)
+    ext = check_upload(fname)
+    if ext == ".pdf":
+        from pypdf import PdfReader
+
+        reader = PdfReader(fname)
+        if len(reader.pages) > UPLOAD_MAX_PAGES:
+            raise UploadRejected(f"PDF 共 {len(reader.pages)} 页，超过上限 {UPLOAD_MAX_PAGES} 页")
+        for number, page in enumerate(reader.pages, start=1):
+            yield number, (page.extract_text() or "").strip()[:UPLOAD_MAX_PAGE_CHARS]
+    elif ext == ".docx":
+        text = textract.process(fname).decode("utf-8")
+        number, block = 1, []
+        size = 0
+        for paragraph in text.splitlines():
+            if block and size + len(paragraph) > UPLOAD_MAX_PAGE_CHARS:
+                yield number, "\n".join(block).strip()
+                number += 1
+                if number > UPLOAD_MAX_PAGES:
+                    raise UploadRejected(f"文档超过上限 {UPLOAD_MAX_PAGES} 页")
+                block, size = [], 0
+            block.append(paragraph[:UPLOAD_MAX_PAGE_CHARS])
+            size += len(paragraph) + 1
+        if block:
+            yield number, "\n".join(block).strip()
+    else:
+        with Image.open(fname) as img:
+            yield 1, _ocr_image(img).strip()[:UPLOAD_MAX_PAGE_CHARS]
+
+
+# 解析文件的函数（根据文件类型使用textract和OCR进行解析）
+def parse_file(file_obj):
+    return "\n".join(text for _, text in iter_pages(file_obj)).strip()
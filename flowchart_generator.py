@@ -1,7 +1,8 @@
-import requests
-import json
 import os
 import time
+import tracing
+import client_hw
+import dot_tools
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -10,30 +11,8 @@ HUAWEI_API_KEY = os.getenv("HUAWEI_API_KEY")
 
 
 def get_model_response(system_content, user_content):
-    """调用华为云API获取模型回应"""
-    url = "https://api.modelarts-maas.com/v1/chat/completions"
-    api_key = HUAWEI_API_KEY
-
-    headers = {"Content-Type": "application/json", "Authorization": f"Bearer {api_key}"}
-
-    data = {
-        "model": "DeepSeek-V3",
-        "messages": [
-            {"role": "system", "content": system_content},
-            {"role": "user", "content": user_content},
-        ],
-        "stream": False,
-        "temperature": 0.6,
-    }
-
-    response = requests.post(url, headers=headers, data=json.dumps(data), verify=False)
-
-    if response.status_code == 200:
-        result = response.json()
-        return result["choices"][0]["message"]["content"]
-    else:
-        print(f"Error: {response.status_code}")
-        return None
+    """调用华为云API获取模型回应（使用 flowchart 调用点的模型路由）"""
+    return client_hw.get_model_response(system_content, user_content, call_site="flowchart")
 
 
 def code_to_flowchart(code, language="python"):
@@ -72,6 +51,8 @@ def code_to_flowchart(code, language="python"):
     """
 
     response = get_model_response(system_content, user_content)
+    if not response:
+        return ""
     graphviz_code = extract_graphviz_code(response)
     return graphviz_code
 
@@ -121,7 +102,7 @@ def save_graphviz_to_file(graphviz_code, output_file="flowchart.dot"):
 
 def render_graphviz(graphviz_code, output_format="png", output_file="flowchart.png"):
     """
-    渲染Graphviz代码为图像
+    渲染Graphviz代码为图像（在子进程中调用 dot，限制耗时和内存，见 dot_tools.render）
 
     参数:
         graphviz_code (str): Graphviz DOT格式代码
@@ -132,64 +113,9 @@ def render_graphviz(graphviz_code, output_format="png", output_file="flowchart.p
         tuple: (是否成功, 输出文件路径或错误信息)
     """
     try:
-        # 创建输出目录（如果不存在）
-        output_dir = os.path.dirname(output_file)
-        if output_dir and not os.path.exists(output_dir):
-            os.makedirs(output_dir)
-
-        # 使用绝对路径创建临时文件
-        current_dir = os.path.dirname(os.path.abspath(__file__))
-        temp_file = os.path.join(current_dir, "temp_flowchart.dot")
-
-        with open(temp_file, "w", encoding="utf-8") as f:
-            f.write(graphviz_code)
-
-        # 使用绝对路径进行渲染
-        abs_output_file = os.path.abspath(output_file)
-
-        # 尝试使用不同的Graphviz命令
-        commands = [
-            f'dot -T{output_format} "{temp_file}" -o "{abs_output_file}"',
-            f'graphviz -T{output_format} "{temp_file}" -o "{abs_output_file}"',
-        ]
-
-        success = False
-        for cmd in commands:
-            result = os.system(cmd)
-            if result == 0:
-                success = True
-                break
-
-        if not success:
-            # 如果系统命令失败，尝试使用Python的graphviz库
-            try:
-                import graphviz
-
-                source = graphviz.Source(graphviz_code)
-                source.render(
-                    abs_output_file.replace(f".{output_format}", ""),
-                    format=output_format,
-                    cleanup=True,
-                )
-                success = True
-            except ImportError:
-                return (
-                    False,
-                    "Graphviz渲染失败。请安装Graphviz软件或Python graphviz库：pip install graphviz",
-                )
-            except Exception as e:
-                return False, f"使用Python graphviz库渲染失败: {str(e)}"
-
-        # 检查文件是否成功创建
-        if not os.path.exists(abs_output_file):
-            return False, f"无法找到生成的图像文件: {abs_output_file}"
-
-        # 删除临时文件
-        if os.path.exists(temp_file):
-            os.remove(temp_file)
-
-        return True, abs_output_file
-
+        return True, dot_tools.render(graphviz_code, output_file, output_format)
+    except dot_tools.DotRenderError as e:
+        return False, str(e)
     except Exception as e:
         return False, f"渲染图像时发生错误: {str(e)}"
 
@@ -213,11 +139,24 @@ def generate_flowchart_from_code(code, language="python"):
 
     try:
         # 生成Graphviz代码
-        graphviz_code = code_to_flowchart(code, language)
+        with tracing.span("flowchart.generate", language=language):
+            graphviz_code = code_to_flowchart(code, language)
 
         if not graphviz_code:
             return "", None, "生成流程图失败，请稍后重试"
 
+        # 本地校验 DOT 语法，能修复的直接修复，不再为语法错误重新调用大模型
+        with tracing.span("flowchart.validate") as span:
+            try:
+                graphviz_code, graph, repairs = dot_tools.prepare(graphviz_code)
+            except dot_tools.DotError as e:
+                tracing.record_error("invalid_dot")
+                return graphviz_code, None, f"流程图代码有误，无法自动修复：{e}"
+            span.set_attribute("nodes", len(graph.nodes))
+            span.set_attribute("repairs", len(repairs))
+        if repairs:
+            print("DOT 自动修复：", "；".join(repairs))
+
         # 创建输出目录 - 使用新的static/flowcharts目录
         current_dir = os.path.dirname(os.path.abspath(__file__))
         output_dir = os.path.join(current_dir, "static", "flowcharts")
@@ -229,15 +168,19 @@ def generate_flowchart_from_code(code, language="python"):
         output_file = os.path.join(output_dir, f"flowchart_{timestamp}.png")
 
         # 渲染图像
-        success, result = render_graphviz(
-            graphviz_code, output_format="png", output_file=output_file
-        )
+        with tracing.span("flowchart.render"):
+            success, result = render_graphviz(
+                graphviz_code, output_format="png", output_file=output_file
+            )
+            if not success:
+                tracing.record_error("render_failed")
 
         if success:
             return (
                 graphviz_code,
                 result,
-                f"流程图生成成功！图像已保存至: {os.path.basename(result)}",
+                f"流程图生成成功！图像已保存至: {os.path.basename(result)}"
+                + (f"（已自动修复 {len(repairs)} 处 DOT 问题）" if repairs else ""),
             )
         else:
             # 如果渲染失败，至少保存DOT文件
@@ -5,25 +5,29 @@ from agents import AgentManager, AGENT_CLASSES ,ExerciseGenerationAgent  # 导
 from flowchart_generator import generate_flowchart_from_code  # 导入流程图生成功能
 
 import json
-import textract, mimetypes
-from PIL import Image
-import pytesseract
+import asyncio
+import tracing
+import usage_ledger
+from file_parser import iter_pages
+from upload_pipeline import split_exercises, answer_exercises
+from shared_cache import HistoryStore
+from session_state import SESSION_IDLE_TTL, get_session_store
 
 # 创建智能体管理器实例
 agent_manager = AgentManager()
+# 聊天记录保存在共享缓存中，多个工作进程看到的是同一份
+history_store = HistoryStore()
+# 各浏览器会话的聊天状态：gr.State 中只有消息 id，正文在共享缓存中
+sessions = get_session_store()
 # 一次最多生成题目数
 qcountmax = 5
 
 #======历史记录相关======#
 def switch_agent(bot_type, history):
-    current_history = load_history(bot_type)    # 加载对应智能体的历史记录
-    formatted_history = current_history    # 格式化历史记录
-    # 更新状态
-    if not isinstance(history, dict):
-        history = {}
-    history[bot_type] = current_history
+    history = sessions.ensure(history)
+    sessions.replace(history, bot_type, load_history(bot_type))    # 加载对应智能体的历史记录
     return (
-        formatted_history,  # 更新 Chatbot 内容
+        sessions.messages(history, bot_type),  # 更新 Chatbot 内容
         history  # 更新全局历史状态
     )
 # 动态生成历史文件路径
@@ -31,6 +35,10 @@ def get_history_file(bot_type):
     return f"chat_history_{bot_type}.json"
 
 def load_history(bot_type):
+    stored = history_store.load(bot_type)
+    if stored is not None:
+        return stored
+    # 兼容旧版本保存的 JSON 文件
     history_file = get_history_file(bot_type)
     if os.path.exists(history_file):
         try:
@@ -41,58 +49,51 @@ def load_history(bot_type):
     return []
 
 def save_history(history, bot_type):
-    history_file = get_history_file(bot_type)
-    with open(history_file, "w", encoding="utf-8") as file:
-        json.dump(history, file, ensure_ascii=False, indent=4)
+    history_store.save(bot_type, history)
+
+def record_exchange(history, bot_type, user_message, response, save=False):
+    """写入一问一答并返回 Chatbot 内容；读写共享缓存（SQLite），异步处理函数中用 asyncio.to_thread 调用"""
+    sessions.append(history, bot_type, "user", user_message)
+    sessions.append(history, bot_type, "assistant", response)
+    messages = sessions.messages(history, bot_type)
+    if save:
+        save_history(messages, bot_type)
+    return messages
 
 
 #========聊天回应逻辑========#
 #智能出题
-def chatbot_response(user_message, bot_type, history):
+async def chatbot_response(user_message, bot_type, history, request: gr.Request = None):
+    history = await asyncio.to_thread(sessions.ensure, history)
     try:
-        # 确保针对当前智能体的历史记录
-        if not isinstance(history, dict):
-            history = {}
-        if bot_type not in history:
-            history[bot_type] = []  # 初始化当前智能体的历史记录
         agent = agent_manager.get_agent(bot_type)
-        if agent:
-            response = agent.process(user_message)
-        else:
-            response = f"没有找到名为 {bot_type} 的智能体。"
+        with usage_ledger.budget(usage_ledger.user_of(request)) as level:
+            if not agent:
+                response = f"没有找到名为 {bot_type} 的智能体。"
+            elif level == usage_ledger.EXHAUSTED:
+                response = usage_ledger.EXHAUSTED_MESSAGE
+            else:
+                # 异步处理：查询向量与知识图谱查询并行，等待期间不占用工作线程
+                response = await agent.aprocess(user_message)
     except Exception as e:
         response = f"发生错误：{str(e)}"
-    history[bot_type].append({"role": "user", "content": user_message})
-    history[bot_type].append({"role": "assistant", "content": response})
-    save_history(history[bot_type], bot_type)
-    return history[bot_type], history
+    messages = await asyncio.to_thread(
+        record_exchange, history, bot_type, user_message, response, save=True
+    )
+    return messages, history
 # 章节选择RAG聊天回应逻辑
-def chapter_rag_response(user_message, bot_type, selected_chapter, history):
+async def chapter_rag_response(user_message, bot_type, selected_chapter, history, request: gr.Request = None):
+    history = await asyncio.to_thread(sessions.ensure, history)
     agent = agent_manager.get_agent(bot_type)
-    if agent:
-        response = agent.process(user_message, selected_chapter)
-    else:
-        response = f"没有找到名为 {bot_type} 的智能体。"
-    # 初始化该智能体的历史记录列表（如果没有）
-    if bot_type not in history:
-        history[bot_type] = []
-    history[bot_type].append({"role": "user", "content": user_message})
-    history[bot_type].append({"role": "assistant", "content": response})
-    return history[bot_type], history
-
-#=========上传文件转为文本========#
-# 解析文件的函数（根据文件类型使用textract和OCR进行解析）
-def parse_file(file_obj):
-    fname = file_obj.name
-    ext = os.path.splitext(fname)[-1].lower()
-    if ext in [".docx", ".pdf"]:
-        text = textract.process(fname).decode("utf-8")
-        return text.strip()
-    if ext in [".png", ".jpg", ".jpeg"]:
-        img = Image.open(fname)
-        text = pytesseract.image_to_string(img, lang="eng+chi_sim")
-        return text.strip()
-    raise ValueError("暂不支持该文件类型")
+    with usage_ledger.budget(usage_ledger.user_of(request)) as level:
+        if not agent:
+            response = f"没有找到名为 {bot_type} 的智能体。"
+        elif level == usage_ledger.EXHAUSTED:
+            response = usage_ledger.EXHAUSTED_MESSAGE
+        else:
+            response = await agent.aprocess(user_message, selected_chapter)
+    messages = await asyncio.to_thread(record_exchange, history, bot_type, user_message, response)
+    return messages, history
 
 #========UI设计========#
 # HTML 内容列表（功能2,4,5）
@@ -227,7 +228,8 @@ with gr.Blocks(css=css) as demo:
                     )
                     send_button = gr.Button("发送", scale=2)
 
-                history = gr.State({})
+                # Gradio 回收会话状态时一并删除缓存中的正文
+                history = gr.State({}, time_to_live=SESSION_IDLE_TTL, delete_callback=sessions.release)
 
                 bot_dropdown.change(# Dropdown 的事件绑定,当用户选择不同智能体时，调用 switch_agent 函数加载其历史记录
                     fn=switch_agent,
@@ -239,6 +241,7 @@ with gr.Blocks(css=css) as demo:
                     chatbot_response,
                     inputs=[user_input, bot_dropdown, history],
                     outputs=[chat_display, history],
+                    api_name="chat",
                 )
                 send_button.click(lambda: "", None, user_input)
 
@@ -277,9 +280,9 @@ with gr.Blocks(css=css) as demo:
                     )
                     chapter_send_button = gr.Button("发送", scale=2)
 
-                chapter_history = gr.State({})
+                chapter_history = gr.State({}, time_to_live=SESSION_IDLE_TTL, delete_callback=sessions.release)
                 chapter_bot_dropdown.change(
-                    lambda bot_type, history_dict: history_dict.get(bot_type, []),
+                    lambda bot_type, history_dict: sessions.messages(history_dict, bot_type),
                     inputs=[chapter_bot_dropdown, chapter_history],
                     outputs=[chapter_chat_display]
                 )
@@ -292,6 +295,7 @@ with gr.Blocks(css=css) as demo:
                         chapter_history,#所有bot的历史
                     ],
                     outputs=[chapter_chat_display, chapter_history],
+                    api_name="chapter_chat",
                 )
                 chapter_send_button.click(
                     lambda: "", None, chapter_user_input
@@ -346,10 +350,15 @@ with gr.Blocks(css=css) as demo:
                     interactive=False,
                 )
                 # 处理生成流程图的函数
-                def handle_generate_flowchart(code, language):
-                    dot_code, img_path, status = generate_flowchart_from_code(
-                        code, language
-                    )
+                def handle_generate_flowchart(code, language, request: gr.Request = None):
+                    with usage_ledger.budget(usage_ledger.user_of(request)) as level:
+                        if level == usage_ledger.EXHAUSTED:
+                            dot_code, img_path, status = "", None, usage_ledger.EXHAUSTED_MESSAGE
+                        else:
+                            with tracing.span("flowchart.request", language=language):
+                                dot_code, img_path, status = generate_flowchart_from_code(
+                                    code, language
+                                )
                     # 创建临时DOT文件用于下载
                     dot_file_path = None
                     if dot_code:
@@ -391,6 +400,7 @@ with gr.Blocks(css=css) as demo:
                         download_dot_btn,
                         download_img_btn,
                     ],
+                    api_name="flowchart",
                 )
                 clear_btn.click(
                     lambda: (
@@ -501,6 +511,9 @@ with gr.Blocks(css=css) as demo:
 
 
         def split_result(result):
+            # 模型服务不可用时返回 None
+            if not result:
+                return "抱歉，AI服务暂时不可用，题目生成失败，请稍后重试。", "未提供答案", "未提供解析"
             # 使用正则分段
             parts = re.split(r"【题目】|【答案】|【解析】", result)
             if len(parts) >= 4:
@@ -510,13 +523,27 @@ with gr.Blocks(css=css) as demo:
                 return result.strip(), "未提供答案", "未提供解析"
 
 
-        def generate_exercise(chapter, topic, difficulty, count, qtype):
+        def generate_exercise(chapter, topic, difficulty, count, qtype, request: gr.Request = None):
+            with usage_ledger.budget(usage_ledger.user_of(request)) as level:
+                if level == usage_ledger.EXHAUSTED:
+                    # 第一张卡片只显示提示，其余卡片隐藏
+                    notice = (
+                        [gr.update(value=f"### {usage_ledger.EXHAUSTED_MESSAGE}", visible=True)]
+                        + [gr.update(visible=False)] * 6
+                        + [gr.update(visible=True)]
+                    )
+                    return notice + [gr.update(visible=False)] * 8 * (qcountmax - 1)
+                with tracing.span("exercise.generate", count=int(count), question_type=qtype):
+                    return _generate_exercise(chapter, topic, difficulty, count, qtype)
+
+
+        def _generate_exercise(chapter, topic, difficulty, count, qtype):
             agent = agent_manager.get_agent("出题智能体")
             updates = []
 
             for i in range(qcountmax):
                 if i < int(count):
-                    print("调用出题：", chapter, topic, difficulty, count)
+                    print(f"[request {tracing.current_request_id()}] 调用出题：", chapter, topic, difficulty, count)
                     result = agent.process("请出一道题", selected_chapter=chapter, selected_topic=topic,
                                            difficulty=difficulty, question_type=qtype)
                     print("返回结果：", result)
@@ -569,7 +596,8 @@ with gr.Blocks(css=css) as demo:
                     blk["e_box"],
                     blk["column"]
                 )])
-            ]
+            ],
+            api_name="exercise",
         ).then(
             fn=lambda: gr.update(value="✅ 题目已生成，请查看下方内容。", visible=True),
             outputs=status_text
@@ -692,36 +720,61 @@ with gr.Blocks(css=css) as demo:
             ],
         )
     # 文件上传按钮点击触发文件处理，结果显示在右侧其实就是功能1
-    # 上传文件
-    def handle_uploaded_file(file,  history, username="用户"):
-        if not isinstance(history, dict):
-            history = {}
+    # 上传文件：逐页解析，按题号切分后以有限并发逐题解答，每答完一题刷新一次聊天窗口
+    async def handle_uploaded_file(file,  history, username="用户", request: gr.Request = None):
+        history = await asyncio.to_thread(sessions.ensure, history)
         bot_type="题目答疑智能体"
-        # ✅ 确保 bot_type 在 history 中有 key
-        if bot_type not in history:
-            history[bot_type] = []
+
+        async def view():
+            messages = await asyncio.to_thread(sessions.messages, history, bot_type)
+            return (
+                gr.update(visible=True),
+                gr.update(visible=False),
+                gr.update(visible=False),
+                gr.update(visible=False),
+                gr.update(visible=False),
+                "",
+                gr.update(value="题目答疑智能体"),  # ✅ 下拉框选中“题目答疑智能体”
+                messages, history
+            )
+
         if file is None:
-            return history[bot_type], history
+            yield await view()
+            return
         try:
-            content = parse_file(file)
-            if not content:
-                content = "（文件解析成功，但未检测到文本内容）"
+            with tracing.span("upload.parse") as span:
+                # 解析在线程中进行，页面逐页读取，只保留切分出的题目
+                exercises = await asyncio.to_thread(
+                    lambda: list(split_exercises(iter_pages(file)))
+                )
+                span.set_attribute("exercises", len(exercises))
         except Exception as e:
-            content = f"文件解析失败：{e}"
-        history[bot_type].append({"role": "user", "content": content})
-        agent = agent_manager.get_agent("题目答疑智能体")
-        response = agent.process(content)
-        history[bot_type].append({"role": "assistant", "content": response})
-        return (
-            gr.update(visible=True),
-            gr.update(visible=False),
-            gr.update(visible=False),
-            gr.update(visible=False),
-            gr.update(visible=False),
-            "",
-            gr.update(value="题目答疑智能体"),  # ✅ 下拉框选中“题目答疑智能体”
-            history[bot_type], history
-        )
+            await asyncio.to_thread(
+                record_exchange, history, bot_type, os.path.basename(file.name), f"文件解析失败：{e}"
+            )
+            yield await view()
+            return
+        if not exercises:
+            await asyncio.to_thread(
+                record_exchange, history, bot_type, os.path.basename(file.name), "（文件解析成功，但未检测到文本内容）"
+            )
+            yield await view()
+            return
+
+        # 先为每道题放一个占位回答，答完后原位替换
+        def add_placeholders():
+            slots = []
+            for text in exercises:
+                sessions.append(history, bot_type, "user", text)
+                slots.append(sessions.append(history, bot_type, "assistant", "解答中……"))
+            return slots
+
+        slots = await asyncio.to_thread(add_placeholders)
+        yield await view()
+        agent = agent_manager.get_agent(bot_type)
+        async for index, response in answer_exercises(agent, exercises, user=usage_ledger.user_of(request)):
+            await asyncio.to_thread(sessions.update, history, bot_type, slots[index], response)
+            yield await view()
     upload_btn.click(
         fn=handle_uploaded_file,
         inputs=[file_upload, history, user_input],  # 或传一个默认 username 占位
@@ -735,7 +788,10 @@ with gr.Blocks(css=css) as demo:
             bot_dropdown,
             chat_display,
             history
-        ]
+        ],
+        api_name="upload",
     )
 # 启动服务
-demo.launch()
+if __name__ == "__main__":
+    tracing.start_metrics_server()
+    demo.launch()
@@ -0,0 +1,306 @@
+import os
+import sys
+import json
+import time
+import array
+import argparse
+import threading
+from dotenv import load_dotenv
+import tracing
+
+load_dotenv()
+
+# GRAPH_MODE=snapshot 时，一跳邻居查询改用本地快照，Neo4j 只作为离线数据源
+GRAPH_MODE = os.getenv("GRAPH_MODE", "live")
+GRAPH_SNAPSHOT_PATH = os.getenv("GRAPH_SNAPSHOT_PATH", "./cache/graph_snapshot.json")
+# 后台检查 Neo4j 变化的间隔（秒），0 表示不自动刷新
+GRAPH_REFRESH_INTERVAL = int(os.getenv("GRAPH_REFRESH_INTERVAL", "0"))
+
+EXPORT_BATCH = 5000
+EXPORT_QUERY = """
+    MATCH (start)-[r]->(end)
+    WHERE id(r) > $after AND start.name IS NOT NULL AND end.name IS NOT NULL
+    RETURN id(r) AS rid, start.name AS start, type(r) AS rel, end.name AS end
+    ORDER BY rid
+    LIMIT $limit
+"""
+# 变更计数：关系总数与最大关系 id，二者都不变则认为图没有变化。
+# 与 EXPORT_QUERY 使用同样的过滤条件，端点没有 name 的关系不进快照，也不参与计数，
+# 否则计数永远对不上，每次刷新都会退化为全量导出
+COUNTER_QUERY = """
+    MATCH (start)-[r]->(end)
+    WHERE start.name IS NOT NULL AND end.name IS NOT NULL
+    RETURN count(r) AS n, max(id(r)) AS m
+"""
+
+
+class GraphSnapshot:
+    """
+    课程知识图谱的内存快照
+
+    节点名与关系类型都驻留为整数 id，边以并列的 array 存储（起点、关系、终点），
+    每个节点维护一个关联边下标的 array，一跳邻居查询只需一次字典查找和一次遍历。
+    """
+
+    def __init__(self):
+        self.names = []  # 节点 id -> 名称
+        self.name_ids = {}  # 名称 -> 节点 id
+        self.rel_types = []  # 关系 id -> 类型
+        self.rel_ids = {}
+        self.src = array.array("I")
+        self.rel = array.array("H")
+        self.dst = array.array("I")
+        self.adjacency = []  # 节点 id -> array('I') 关联边下标
+        self.edge_count = 0
+        self.max_rid = -1
+        self.built_at = 0.0
+
+    def _intern_name(self, name):
+        node_id = self.name_ids.get(name)
+        if node_id is None:
+            node_id = self.name_ids[name] = len(self.names)
+            self.names.append(sys.intern(name))
+            self.adjacency.append(array.array("I"))
+        return node_id
+
+    def _intern_rel(self, rel_type):
+        rel_id = self.rel_ids.get(rel_type)
+        if rel_id is None:
+            rel_id = self.rel_ids[rel_type] = len(self.rel_types)
+            self.rel_types.append(sys.intern(rel_type))
+        return rel_id
+
+    def add_edge(self, start, rel_type, end, rid=None):
+        if start is None or end is None:
+            return
+        s = self._intern_name(start)
+        e = self._intern_name(end)
+        edge = len(self.src)
+        self.src.append(s)
+        self.rel.append(self._intern_rel(rel_type or ""))
+        self.dst.append(e)
+        self.adjacency[s].append(edge)
+        if e != s:
+            self.adjacency[e].append(edge)
+        self.edge_count += 1
+        if rid is not None and rid > self.max_rid:
+            self.max_rid = rid
+
+    def neighbors(self, name):
+        """
+        与 use_neo4j 中 Cypher 查询等价的一跳邻居：实体作为起点或终点的所有关系两端节点
+
+        返回:
+            set: 节点名集合（实体存在时包含实体本身）
+        """
+        node_id = self.name_ids.get(name)
+        if node_id is None:
+            return set()
+        names = self.names
+        result = set()
+        for edge in self.adjacency[node_id]:
+            result.add(names[self.src[edge]])
+            result.add(names[self.dst[edge]])
+        return result
+
+    def edges_of(self, name):
+        """返回实体的关联边 [(起点, 关系, 终点), ...]"""
+        node_id = self.name_ids.get(name)
+        if node_id is None:
+            return []
+        return [
+            (self.names[self.src[e]], self.rel_types[self.rel[e]], self.names[self.dst[e]])
+            for e in self.adjacency[node_id]
+        ]
+
+    def degree(self, name):
+        node_id = self.name_ids.get(name)
+        return 0 if node_id is None else len(self.adjacency[node_id])
+
+    def copy(self):
+        """复制一份快照，用于增量刷新后整体替换，避免读写并发"""
+        other = GraphSnapshot()
+        other.names = list(self.names)
+        other.name_ids = dict(self.name_ids)
+        other.rel_types = list(self.rel_types)
+        other.rel_ids = dict(self.rel_ids)
+        other.src = array.array("I", self.src)
+        other.rel = array.array("H", self.rel)
+        other.dst = array.array("I", self.dst)
+        other.adjacency = [array.array("I", a) for a in self.adjacency]
+        other.edge_count = self.edge_count
+        other.max_rid = self.max_rid
+        other.built_at = self.built_at
+        return other
+
+    def save(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        data = {
+            "names": self.names,
+            "rel_types": self.rel_types,
+            "src": self.src.tolist(),
+            "rel": self.rel.tolist(),
+            "dst": self.dst.tolist(),
+            "edge_count": self.edge_count,
+            "max_rid": self.max_rid,
+            "built_at": self.built_at,
+        }
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        snapshot = cls()
+        snapshot.names = [sys.intern(n) for n in data["names"]]
+        snapshot.name_ids = {n: i for i, n in enumerate(snapshot.names)}
+        snapshot.rel_types = [sys.intern(r) for r in data["rel_types"]]
+        snapshot.rel_ids = {r: i for i, r in enumerate(snapshot.rel_types)}
+        snapshot.src = array.array("I", data["src"])
+        snapshot.rel = array.array("H", data["rel"])
+        snapshot.dst = array.array("I", data["dst"])
+        snapshot.adjacency = [array.array("I") for _ in snapshot.names]
+        for edge, (s, e) in enumerate(zip(snapshot.src, snapshot.dst)):
+            snapshot.adjacency[s].append(edge)
+            if e != s:
+                snapshot.adjacency[e].append(edge)
+        snapshot.edge_count = data["edge_count"]
+        snapshot.max_rid = data["max_rid"]
+        snapshot.built_at = data["built_at"]
+        return snapshot
+
+
+def _fetch_edges(graph, snapshot, after):
+    """从 Neo4j 分页拉取 id 大于 after 的关系并加入快照"""
+    fetched = 0
+    while True:
+        records = graph.run(
+            EXPORT_QUERY, parameters={"after": after, "limit": EXPORT_BATCH}
+        ).data()
+        for record in records:
+            snapshot.add_edge(record["start"], record["rel"], record["end"], record["rid"])
+        fetched += len(records)
+        if len(records) < EXPORT_BATCH:
+            return fetched
+        after = records[-1]["rid"]
+
+
+def export_snapshot(graph):
+    """从 Neo4j 全量导出快照"""
+    with tracing.span("graph.export"):
+        snapshot = GraphSnapshot()
+        _fetch_edges(graph, snapshot, -1)
+        snapshot.built_at = time.time()
+        return snapshot
+
+
+def refresh_snapshot(graph, snapshot):
+    """
+    按变更计数刷新快照
+
+    关系数和最大 id 都没变则直接返回原快照；只有新增关系时增量拉取；
+    有删除或 id 复用时全量重建。
+
+    返回:
+        tuple: (快照, 刷新方式 'unchanged' | 'incremental' | 'full')
+    """
+    with tracing.span("graph.refresh") as span:
+        counter = graph.run(COUNTER_QUERY).data()[0]
+        count, max_rid = counter["n"], counter["m"] if counter["m"] is not None else -1
+        if count == snapshot.edge_count and max_rid == snapshot.max_rid:
+            span.set_attribute("mode", "unchanged")
+            return snapshot, "unchanged"
+        if max_rid > snapshot.max_rid and count > snapshot.edge_count:
+            updated = snapshot.copy()
+            _fetch_edges(graph, updated, snapshot.max_rid)
+            if updated.edge_count == count:
+                updated.built_at = time.time()
+                span.set_attribute("mode", "incremental")
+                return updated, "incremental"
+        span.set_attribute("mode", "full")
+        return export_snapshot(graph), "full"
+
+
+_snapshot = None
+_snapshot_lock = threading.Lock()
+_refresher = None
+
+
+def get_snapshot(connect, path=GRAPH_SNAPSHOT_PATH):
+    """
+    返回当前快照（GRAPH_MODE 不是 snapshot 时返回 None）
+
+    首次调用时从磁盘加载；磁盘上没有时用 connect() 连接 Neo4j 导出并保存。
+
+    参数:
+        connect (callable): 返回 py2neo.Graph 的函数
+    """
+    global _snapshot
+    if GRAPH_MODE != "snapshot":
+        return None
+    if _snapshot is None:
+        with _snapshot_lock:
+            if _snapshot is None:
+                try:
+                    if os.path.exists(path):
+                        _snapshot = GraphSnapshot.load(path)
+                    else:
+                        _snapshot = export_snapshot(connect())
+                        _snapshot.save(path)
+                    print(f"知识图谱快照已加载：{len(_snapshot.names)} 个节点，{_snapshot.edge_count} 条关系")
+                except Exception as e:
+                    print(f"加载知识图谱快照失败: {e}，改为实时查询 Neo4j")
+                    return None
+                if GRAPH_REFRESH_INTERVAL > 0:
+                    start_refresher(connect, GRAPH_REFRESH_INTERVAL, path)
+    return _snapshot
+
+
+def start_refresher(connect, interval, path=GRAPH_SNAPSHOT_PATH):
+    """启动后台线程，定期按变更计数刷新快照并写回磁盘"""
+    global _refresher
+
+    def loop():
+        global _snapshot
+        while True:
+            time.sleep(interval)
+            try:
+                updated, mode = refresh_snapshot(connect(), _snapshot)
+                if mode != "unchanged":
+                    _snapshot = updated
+                    updated.save(path)
+                    print(f"知识图谱快照已刷新（{mode}）：{updated.edge_count} 条关系")
+            except Exception as e:
+                print(f"刷新知识图谱快照失败: {e}")
+
+    if _refresher is None:
+        _refresher = threading.Thread(target=loop, daemon=True, name="graph-refresher")
+        _refresher.start()
+    return _refresher
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="导出或刷新知识图谱本地快照")
+    parser.add_argument("command", choices=["export", "refresh"])
+    parser.add_argument("--path", default=GRAPH_SNAPSHOT_PATH)
+    args = parser.parse_args(argv)
+
+    import use_neo4j
+
+    graph = use_neo4j.connect_neo4j()
+    if args.command == "refresh" and os.path.exists(args.path):
+        snapshot, mode = refresh_snapshot(graph, GraphSnapshot.load(args.path))
+    else:
+        snapshot, mode = export_snapshot(graph), "full"
+    snapshot.save(args.path)
+    print(f"快照已保存到 {args.path}（{mode}）：{len(snapshot.names)} 个节点，{snapshot.edge_count} 条关系")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,173 @@
+import os
+import json
+import math
+from dotenv import load_dotenv
+import tracing
+
+load_dotenv()
+
+# 关系类型权重，未配置的类型使用默认权重 1.0，JSON 格式，例如 {"包含": 1.0, "相关": 0.5}
+GRAPH_REL_WEIGHTS = json.loads(os.getenv("GRAPH_REL_WEIGHTS", "{}"))
+GRAPH_EXPANSION_TOP_N = int(os.getenv("GRAPH_EXPANSION_TOP_N", "8"))
+GRAPH_EXPANSION_MAX_CHARS = int(os.getenv("GRAPH_EXPANSION_MAX_CHARS", "80"))
+GRAPH_EXPANSION_HOPS = int(os.getenv("GRAPH_EXPANSION_HOPS", "1"))
+
+EDGES_QUERY = """
+    MATCH (start)-[r]->(end)
+    WHERE start.name = $entity OR end.name = $entity
+    RETURN start.name AS 起始节点,
+           type(r) AS 关系,
+           end.name AS 终止节点
+"""
+# 与 graph_cache.GraphSnapshot.degree 口径一致：只统计两端都有 name 的关系
+DEGREE_QUERY = """
+    MATCH (n) WHERE n.name IN $names
+    OPTIONAL MATCH (n)-[r]-(other) WHERE other.name IS NOT NULL
+    RETURN n.name AS name, count(DISTINCT r) AS degree
+"""
+
+
+class RemoteGraphSource:
+    """
+    通过 Cypher 查询 Neo4j 的图数据源，接口与 graph_cache.GraphSnapshot 一致
+
+    同一次扩展内的查询结果会缓存在实例上。
+    """
+
+    def __init__(self, graph):
+        self.graph = graph
+        self._edges = {}
+        self._degrees = {}
+
+    def edges_of(self, name):
+        if name not in self._edges:
+            try:
+                with tracing.span("neo4j.cypher"):
+                    records = self.graph.run(EDGES_QUERY, parameters={"entity": name}).data()
+            except Exception as e:
+                tracing.record_error(type(e).__name__)
+                print(f"查询实体 '{name}' 时发生错误: {str(e)}")
+                records = []
+            self._edges[name] = [
+                (r["起始节点"], r.get("关系", ""), r["终止节点"]) for r in records
+            ]
+        return self._edges[name]
+
+    def prefetch_degrees(self, names):
+        missing = [n for n in names if n not in self._degrees]
+        if not missing:
+            return
+        try:
+            with tracing.span("neo4j.cypher", nodes=len(missing)):
+                records = self.graph.run(DEGREE_QUERY, parameters={"names": missing}).data()
+            for r in records:
+                self._degrees[r["name"]] = r["degree"]
+        except Exception as e:
+            print(f"查询节点度数时发生错误: {str(e)}")
+
+    def degree(self, name):
+        if name not in self._degrees:
+            self.prefetch_degrees([name])
+        # 查询失败时按本次看到的关联边数估计
+        edges = [e for e in self._edges.get(name, []) if e[0] is not None and e[2] is not None]
+        return self._degrees.setdefault(name, len(edges))
+
+
+class GraphExpander:
+    """
+    加权的图扩展：为实体的邻居打分，只返回预算内最相关的若干个
+
+    得分 = Σ 关系权重 / log2(2 + 邻居度数)，求和覆盖种子与该邻居之间的所有关系；开启两跳时，经由一跳邻居 m 到达的节点 n
+    额外得到 hop_decay × 一跳权重 × 关系权重 / (log2(2 + deg m) × log2(2 + deg n))。
+    度数归一化用于压低“软件工程”这类与大量节点相连的枢纽节点。
+
+    参数:
+        rel_weights (dict): 关系类型 -> 权重
+        max_hops (int): 1 或 2
+        top_n (int): 最多返回的节点数
+        max_chars (int): 返回节点名的总字符数上限
+        hop_decay (float): 两跳路径的衰减系数
+        fanout (int): 两跳扩展时最多展开的一跳邻居数
+    """
+
+    def __init__(
+        self,
+        rel_weights=None,
+        default_weight=1.0,
+        max_hops=GRAPH_EXPANSION_HOPS,
+        top_n=GRAPH_EXPANSION_TOP_N,
+        max_chars=GRAPH_EXPANSION_MAX_CHARS,
+        hop_decay=0.5,
+        fanout=10,
+    ):
+        self.rel_weights = GRAPH_REL_WEIGHTS if rel_weights is None else rel_weights
+        self.default_weight = default_weight
+        self.max_hops = max_hops
+        self.top_n = top_n
+        self.max_chars = max_chars
+        self.hop_decay = hop_decay
+        self.fanout = fanout
+
+    def weight(self, rel_type):
+        return self.rel_weights.get(rel_type, self.default_weight)
+
+    def score(self, source, seeds):
+        """
+        返回:
+            dict: 节点名 -> 得分（不含种子实体本身）
+        """
+        seeds = {s for s in seeds if s}
+        scores = {}
+        first_hop = {}
+        for seed in seeds:
+            for start, rel, end in source.edges_of(seed):
+                other = end if start == seed else start
+                if other is None or other in seeds:
+                    continue
+                w = self.weight(rel)
+                first_hop[other] = first_hop.get(other, 0.0) + w
+        if hasattr(source, "prefetch_degrees"):
+            source.prefetch_degrees(list(first_hop))
+        norms = {n: math.log2(2 + source.degree(n)) for n in first_hop}
+        for n, w in first_hop.items():
+            scores[n] = scores.get(n, 0.0) + w / norms[n]
+
+        if self.max_hops >= 2 and first_hop:
+            frontier = sorted(first_hop, key=lambda n: scores[n], reverse=True)[: self.fanout]
+            second_hop = {}
+            for m in frontier:
+                for start, rel, end in source.edges_of(m):
+                    other = end if start == m else start
+                    if other is None or other in seeds or other == m:
+                        continue
+                    contribution = self.hop_decay * first_hop[m] * self.weight(rel) / norms[m]
+                    second_hop[other] = second_hop.get(other, 0.0) + contribution
+            if hasattr(source, "prefetch_degrees"):
+                source.prefetch_degrees([n for n in second_hop if n not in norms])
+            for n, contribution in second_hop.items():
+                norm = norms.get(n) or math.log2(2 + source.degree(n))
+                scores[n] = scores.get(n, 0.0) + contribution / norm
+        return scores
+
+    def expand(self, source, seeds):
+        """
+        返回预算内得分最高的节点
+
+        返回:
+            list: [(节点名, 得分), ...]，按得分降序
+        """
+        with tracing.span("graph.expand", seeds=len(seeds), hops=self.max_hops) as span:
+            scores = self.score(source, seeds)
+            ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+            selected = []
+            chars = 0
+            for name, score in ranked:
+                if len(selected) >= self.top_n:
+                    break
+                if chars + len(name) > self.max_chars:
+                    continue
+                selected.append((name, score))
+                chars += len(name)
+            span.set_attribute("candidates", len(scores))
+            span.set_attribute("selected", len(selected))
+            return selected
@@ -1,5 +1,7 @@
 import os
 import time  # For potential rate limiting
+import asyncio
+import threading
 from dotenv import load_dotenv
 from langchain.vectorstores import Chroma
 from langchain_community.document_loaders import DirectoryLoader, PyPDFLoader
@@ -8,6 +10,35 @@ from langchain_core.embeddings import Embeddings
 from typing import List
 import requests
 import json
+import tracing
+import usage_ledger  # noqa: F401  导入即登记：嵌入调用的用量记入用量账本
+from singleflight import SingleFlight
+from embedding_batcher import MicroBatcher
+
+try:  # Optional: async query embeddings on a pooled httpx client
+    import httpx
+except ImportError:
+    httpx = None
+try:  # HTTP/2 needs the h2 package (pip install "httpx[http2]")
+    import h2  # noqa: F401
+
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+# Query embeddings sit on the critical path of every answer, so they get a much
+# tighter timeout than bulk ingest batches (request_timeout).
+EMBED_QUERY_TIMEOUT = float(os.getenv("EMBED_QUERY_TIMEOUT", "5"))
+EMBED_CONNECT_TIMEOUT = float(os.getenv("EMBED_CONNECT_TIMEOUT", "3"))
+# Max concurrent batches in aembed_documents
+EMBED_ASYNC_CONCURRENCY = int(os.getenv("EMBED_ASYNC_CONCURRENCY", "4"))
+# Micro-batching of concurrent query embeddings: wait up to this many ms (or
+# until EMBED_BATCH_MAX queries) and send them as one request. Off (0) by default
+# so scripts and tests don't start batcher threads; serve.py turns it on for the
+# multi-worker deployment.
+EMBED_BATCH_WINDOW_MS = float(os.getenv("EMBED_BATCH_WINDOW_MS", "0"))
+EMBED_BATCH_MAX = int(os.getenv("EMBED_BATCH_MAX", "32"))
+EMBED_BATCH_WORKERS = int(os.getenv("EMBED_BATCH_WORKERS", "4"))
 
 
 # --- Custom SiliconFlow Embeddings Class ---
@@ -19,18 +50,38 @@ class SiliconFlowEmbeddings(Embeddings):
         api_base_url: str = "https://api.siliconflow.cn/v1",
         batch_size: int = 32,  # Adjust based on API limits or performance
         request_timeout: int = 60,  # Timeout for API requests in seconds
+        query_timeout: float = EMBED_QUERY_TIMEOUT,  # Timeout for single query embeddings
     ):
         self.api_key = api_key
         self.model_name = model_name
         self.api_url = f"{api_base_url}/embeddings"
         self.batch_size = batch_size
         self.request_timeout = request_timeout
+        self.query_timeout = query_timeout
         self.headers = {
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json",
         }
+        # Coalesce concurrent identical query embeddings into one request
+        self._query_flight = SingleFlight("embed_query")
+        # Keep-alive connections for the blocking path
+        self._session = requests.Session()
+        # Async clients and in-flight futures are bound to the event loop they were
+        # created on, so they are kept per loop (Gradio's loop, asyncio.run in batch jobs)
+        self._async_clients = {}  # loop -> httpx.AsyncClient
+        self._async_inflight = {}  # loop -> {singleflight key: future}
+        self._async_lock = threading.Lock()
+        self._batcher = None
+        if EMBED_BATCH_WINDOW_MS > 0:
+            self._batcher = MicroBatcher(
+                lambda texts: self._embed_batch(texts, timeout=self.query_timeout),
+                window=EMBED_BATCH_WINDOW_MS / 1000,
+                max_batch=EMBED_BATCH_MAX,
+                workers=EMBED_BATCH_WORKERS,
+                name="embedding.query",
+            )
 
-    def _embed_batch(self, texts: List[str]) -> List[List[float]]:
+    def _embed_batch(self, texts: List[str], timeout=None) -> List[List[float]]:
         """Embeds a single batch of texts."""
         payload = {
             "model": self.model_name,
@@ -39,14 +90,16 @@ class SiliconFlowEmbeddings(Embeddings):
         }
 
         try:
-            response = requests.post(
+            response = self._session.post(
                 self.api_url,
                 json=payload,
                 headers=self.headers,
-                timeout=self.request_timeout,
+                timeout=(EMBED_CONNECT_TIMEOUT, timeout or self.request_timeout),
             )
             response.raise_for_status()  # Raise an exception for HTTP errors
             response_data = response.json()
+            tracing.set_attribute("model", self.model_name)
+            tracing.record_usage(response_data.get("usage"))
 
             if "data" in response_data and isinstance(response_data["data"], list):
                 embeddings = [item["embedding"] for item in response_data["data"]]
@@ -83,11 +136,19 @@ class SiliconFlowEmbeddings(Embeddings):
             print(
                 f"Embedding batch {i // self.batch_size + 1}/{(len(texts) -1) // self.batch_size + 1}, size: {len(batch)}"
             )
-            batch_embeddings = self._embed_batch(batch)
+            with tracing.span("embedding.documents", batch_size=len(batch)):
+                batch_embeddings = self._embed_batch(batch)
             all_embeddings.extend(batch_embeddings)
         return all_embeddings
 
     def embed_query(self, text: str) -> List[float]:
+        with tracing.span("embedding.query", model=self.model_name):
+            key = self._query_flight.key(self.model_name, text)
+            return self._query_flight.do(key, self._embed_query, text)
+
+    def _embed_query(self, text: str) -> List[float]:
+        if self._batcher is not None:
+            return self._batched_result(self._batcher(text))
         # For a single query, the API expects 'input' to be a string, not a list.
         payload = {
             "model": self.model_name,
@@ -95,30 +156,182 @@ class SiliconFlowEmbeddings(Embeddings):
             "encoding_format": "float",
         }
         try:
-            response = requests.post(
+            response = self._session.post(
                 self.api_url,
                 json=payload,
                 headers=self.headers,
-                timeout=self.request_timeout,
+                timeout=(EMBED_CONNECT_TIMEOUT, self.query_timeout),
             )
             response.raise_for_status()
-            response_data = response.json()
-            if (
-                "data" in response_data
-                and isinstance(response_data["data"], list)
-                and len(response_data["data"]) > 0
-            ):
-                return response_data["data"][0]["embedding"]
-            else:
-                print(f"Error: Unexpected response format for query: {response_data}")
-                return [0.0] * 1024  # Placeholder, adjust dimension
+            return self._query_vector(response.json())
         except requests.exceptions.HTTPError as http_err:
+            tracing.record_error(f"http_{response.status_code}")
             print(f"HTTP error occurred while embedding query: {http_err}")
             print(f"Response content: {response.content.decode()}")
             return [0.0] * 1024  # Placeholder
         except requests.exceptions.Timeout:
+            tracing.record_error("Timeout")
             print(f"Request timed out while embedding query.")
             return [0.0] * 1024  # Placeholder
         except Exception as e:
+            tracing.record_error(type(e).__name__)
             print(f"An error occurred while embedding query: {e}")
             return [0.0] * 1024  # Placeholder
+
+    @staticmethod
+    def _batched_result(vector: List[float]) -> List[float]:
+        # _embed_batch logs its own errors and returns zero placeholders
+        if not any(vector):
+            tracing.record_error("batch_failed")
+        return vector
+
+    def _query_vector(self, response_data) -> List[float]:
+        usage = response_data.get("usage") or {}
+        tracing.set_attribute("prompt_tokens", usage.get("prompt_tokens", 0))
+        if (
+            "data" in response_data
+            and isinstance(response_data["data"], list)
+            and len(response_data["data"]) > 0
+        ):
+            return response_data["data"][0]["embedding"]
+        tracing.record_error("bad_response")
+        print(f"Error: Unexpected response format for query: {response_data}")
+        return [0.0] * 1024  # Placeholder, adjust dimension
+
+    def _prune_closed_loops(self):
+        # A closed loop can no longer run aclose(); dropping the client lets its
+        # sockets be released instead of accumulating one pool per finished loop
+        for loop in [l for l in self._async_clients if l.is_closed()]:
+            del self._async_clients[loop]
+        for loop in [l for l in self._async_inflight if l.is_closed()]:
+            del self._async_inflight[loop]
+
+    def _get_async_client(self):
+        loop = asyncio.get_running_loop()
+        client = self._async_clients.get(loop)
+        if client is None:
+            with self._async_lock:
+                self._prune_closed_loops()
+                client = self._async_clients[loop] = httpx.AsyncClient(
+                    http2=HTTP2_AVAILABLE,
+                    headers=self.headers,
+                    limits=httpx.Limits(max_connections=20, max_keepalive_connections=10),
+                    timeout=httpx.Timeout(self.request_timeout, connect=EMBED_CONNECT_TIMEOUT),
+                )
+        return client
+
+    def _get_async_inflight(self):
+        loop = asyncio.get_running_loop()
+        inflight = self._async_inflight.get(loop)
+        if inflight is None:
+            with self._async_lock:
+                self._prune_closed_loops()
+                inflight = self._async_inflight[loop] = {}
+        return inflight
+
+    async def aclose(self):
+        """Close the async client of the running loop (call before the loop ends)"""
+        with self._async_lock:
+            client = self._async_clients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.aclose()
+
+    async def aembed_query(self, text: str) -> List[float]:
+        if httpx is None:
+            # Falls back to LangChain's default: embed_query in an executor thread
+            return await super().aembed_query(text)
+        # Two paths, chosen by EMBED_BATCH_WINDOW_MS:
+        # - batching on (serve.py deployment): the query joins the MicroBatcher shared with the
+        #   blocking callers; one request per window, one worker thread per batch,
+        #   at most EMBED_BATCH_WINDOW_MS extra latency. Fewer requests under bursts.
+        # - batching off (default): one request per query on the pooled (HTTP/2) httpx client,
+        #   no threads at all. Lowest latency when traffic is light.
+        transport = "batch" if self._batcher is not None else "async"
+        with tracing.span("embedding.query", model=self.model_name, transport=transport):
+            inflight = self._get_async_inflight()
+            key = self._query_flight.key(self.model_name, text)
+            task = inflight.get(key)
+            submitted = None
+            if task is None:
+                if self._batcher is not None:
+                    # Batched with the blocking callers; the event loop only waits on the future
+                    submitted = self._batcher.submit(text)
+                    task = asyncio.wrap_future(submitted)
+                else:
+                    task = asyncio.ensure_future(self._aembed_query(self._get_async_client(), text))
+                inflight[key] = task
+                task.add_done_callback(lambda _: inflight.pop(key, None))
+            else:
+                tracing.set_attribute(f"singleflight.{self._query_flight.name}", "shared")
+            # shield: a cancelled caller must not cancel the request other callers share
+            vector = await asyncio.shield(task)
+            if submitted is not None:
+                # The batch ran in a worker thread; book this query's share of the
+                # usage on our span so the ledger sees the caller's user and request
+                self._batcher.annotate(submitted)
+            return self._batched_result(vector) if self._batcher is not None else vector
+
+    async def _aembed_query(self, client, text: str) -> List[float]:
+        payload = {
+            "model": self.model_name,
+            "input": text,
+            "encoding_format": "float",
+        }
+        try:
+            response = await client.post(
+                self.api_url,
+                json=payload,
+                timeout=httpx.Timeout(self.query_timeout, connect=EMBED_CONNECT_TIMEOUT),
+            )
+            response.raise_for_status()
+            return self._query_vector(response.json())
+        except httpx.HTTPStatusError as http_err:
+            tracing.record_error(f"http_{http_err.response.status_code}")
+            print(f"HTTP error occurred while embedding query: {http_err}")
+            print(f"Response content: {http_err.response.text}")
+            return [0.0] * 1024  # Placeholder
+        except httpx.TimeoutException:
+            tracing.record_error("Timeout")
+            print("Request timed out while embedding query.")
+            return [0.0] * 1024  # Placeholder
+        except Exception as e:
+            tracing.record_error(type(e).__name__)
+            print(f"An error occurred while embedding query: {e}")
+            return [0.0] * 1024  # Placeholder
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        if httpx is None:
+            return await super().aembed_documents(texts)
+        client = self._get_async_client()
+        semaphore = asyncio.Semaphore(EMBED_ASYNC_CONCURRENCY)
+
+        async def embed_batch(batch):
+            async with semaphore:
+                with tracing.span("embedding.documents", batch_size=len(batch), transport="async"):
+                    return await self._aembed_batch(client, batch)
+
+        batches = [texts[i : i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        results = await asyncio.gather(*(embed_batch(b) for b in batches))
+        return [vector for batch in results for vector in batch]
+
+    async def _aembed_batch(self, client, texts: List[str]) -> List[List[float]]:
+        payload = {
+            "model": self.model_name,
+            "input": texts,
+            "encoding_format": "float",
+        }
+        try:
+            response = await client.post(self.api_url, json=payload)
+            response.raise_for_status()
+            response_data = response.json()
+            tracing.set_attribute("model", self.model_name)
+            tracing.record_usage(response_data.get("usage"))
+            embeddings = [item["embedding"] for item in response_data.get("data", [])]
+            if len(embeddings) == len(texts):
+                return embeddings
+            print(
+                f"Warning: Mismatch in number of embeddings received ({len(embeddings)}) vs texts sent ({len(texts)})."
+            )
+        except Exception as e:
+            print(f"An error occurred while embedding batch: {e}")
+        return [[0.0] * 1024 for _ in texts]  # Placeholder
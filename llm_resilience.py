@@ -0,0 +1,154 @@
+import time
+import random
+import threading
+import contextvars
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+
+class RetryableError(Exception):
+    """可以重试的错误：网络异常、超时、429 和 5xx"""
+
+
+class NonRetryableError(Exception):
+    """重试也不会成功的错误，例如 400/401"""
+
+
+class CircuitOpenError(Exception):
+    """熔断器处于打开状态，暂时不向该端点发请求"""
+
+
+class CircuitBreaker:
+    """
+    按端点的熔断器
+
+    连续失败 failure_threshold 次后打开，reset_timeout 秒后进入半开状态，
+    只放行一个试探请求：成功则关闭，失败则重新打开。
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state()
+
+    def _state(self):
+        if self._opened_at is None:
+            return "closed"
+        if time.monotonic() - self._opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def allow(self):
+        with self._lock:
+            state = self._state()
+            if state == "closed":
+                return True
+            if state == "half_open" and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._probing or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+            self._probing = False
+
+
+class LatencyTracker:
+    """记录最近若干次成功调用的耗时，用于估计对冲请求的触发时间"""
+
+    def __init__(self, window=200):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def add(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, p, min_samples=20):
+        with self._lock:
+            if len(self._samples) < min_samples:
+                return None
+            ordered = sorted(self._samples)
+        idx = min(len(ordered) - 1, int(p / 100 * len(ordered)))
+        return ordered[idx]
+
+
+def retry_call(fn, max_retries=2, base_delay=0.5, max_delay=8.0, breaker=None):
+    """
+    调用 fn，遇到 RetryableError 时按指数退避加随机抖动重试
+
+    参数:
+        fn (callable): 无参函数
+        max_retries (int): 最多重试次数（不含第一次）
+        base_delay (float): 退避基数（秒）
+        max_delay (float): 单次等待上限（秒）
+        breaker (CircuitBreaker): 提供时每次重试前检查，熔断器已打开则抛出 CircuitOpenError，不再重试
+    """
+    attempt = 0
+    while True:
+        try:
+            return fn()
+        except RetryableError:
+            if attempt >= max_retries:
+                raise
+            # full jitter：在 [0, base * 2^attempt] 内随机等待
+            time.sleep(random.uniform(0, min(max_delay, base_delay * (2 ** attempt))))
+            attempt += 1
+            if breaker is not None and not breaker.allow():
+                raise CircuitOpenError("重试期间熔断器已打开")
+
+
+_hedge_executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="llm-hedge")
+
+
+def hedged_call(fn, hedge_delay):
+    """
+    对冲请求：先发一次，hedge_delay 秒内没有返回就再发一次，取先成功的结果
+
+    参数:
+        fn (callable): 无参函数
+        hedge_delay (float | None): 触发对冲的等待时间，None 表示不对冲
+
+    返回:
+        tuple: (结果, 是否触发了对冲)
+    """
+    if hedge_delay is None:
+        return fn(), False
+
+    def submit():
+        # 复制上下文，使追踪信息在线程池中延续
+        ctx = contextvars.copy_context()
+        return _hedge_executor.submit(ctx.run, fn)
+
+    first = submit()
+    done, _ = wait([first], timeout=hedge_delay)
+    if done:
+        return first.result(), False
+
+    pending = {first, submit()}
+    error = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                # 另一个请求继续在后台完成，结果丢弃
+                return future.result(), True
+            error = future.exception()
+    raise error
@@ -0,0 +1,253 @@
+# 课堂负载测试：模拟一个班的学生通过 Gradio 的 HTTP 队列接口并发使用助手，
+# 按脚本回放聊天、章节问答、上传、流程图和批量出题，统计各接口的排队等待与服务时间。
+#
+# 先用本地替身启动应用（或直接启动连接真实后端的应用）:
+#   python load_test.py --serve-mock            # 启动替身后端 + gradio_app，并打印地址
+#   python load_test.py --url http://127.0.0.1:7860 --students 200 --arrival-rate 5
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import argparse
+import threading
+
+import requests
+
+from benchmark import percentile, SAMPLE_CODE
+
+# 默认的学生会话脚本：每一步为 (接口 api_name, 输入数据, 思考时间秒)
+# gr.State 输入由服务端按 session_hash 维护，客户端传 None
+DEFAULT_SESSIONS = {
+    "chat": [
+        {"endpoint": "chat", "data": ["什么是软件工程？", "概念解释智能体", None], "think": 5},
+        {"endpoint": "chat", "data": ["需求分析的主要任务是什么？", "概念解释智能体", None], "think": 8},
+    ],
+    "chapter": [
+        {"endpoint": "chapter_chat", "data": ["用例图的作用是什么？", "概念解释智能体", "第三章：需求分析", None], "think": 6},
+        {"endpoint": "chapter_chat", "data": ["层次图和结构图的区别？", "题目答疑智能体", "第五章：总体设计", None], "think": 6},
+    ],
+    "flowchart": [
+        {"endpoint": "flowchart", "data": [SAMPLE_CODE, "python"], "think": 10},
+    ],
+    "exercise": [
+        {"endpoint": "exercise", "data": ["第三章：需求分析", "用例建模", "中等", 3, "选择题"], "think": 15},
+    ],
+    "upload": [
+        {"endpoint": "upload", "upload": None, "data": [None, None, ""], "think": 10},
+    ],
+}
+# 各类会话在班级中的占比
+DEFAULT_MIX = {"chat": 0.4, "chapter": 0.25, "flowchart": 0.1, "exercise": 0.15, "upload": 0.1}
+
+
+class GradioQueueClient:
+    """直接使用 Gradio 队列协议（queue/join + queue/data SSE）的最小客户端"""
+
+    def __init__(self, base_url, timeout=600):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        config = requests.get(f"{self.base_url}/config", timeout=10).json()
+        # Gradio 5 的接口带 /gradio_api 前缀，Gradio 4 没有
+        self.api_prefix = config.get("api_prefix", "")
+        self.fn_index = {}
+        for i, dep in enumerate(config.get("dependencies", [])):
+            api_name = dep.get("api_name")
+            if api_name:
+                self.fn_index[api_name] = dep.get("id", i)
+
+    def _url(self, path):
+        return f"{self.base_url}{self.api_prefix}{path}"
+
+    def upload(self, path, http=requests):
+        with open(path, "rb") as f:
+            resp = http.post(self._url("/upload"), files={"files": f}, timeout=60)
+        resp.raise_for_status()
+        server_path = resp.json()[0]
+        return {
+            "path": server_path,
+            "orig_name": os.path.basename(path),
+            "meta": {"_type": "gradio.FileData"},
+        }
+
+    def call(self, api_name, data, session_hash, http=requests):
+        """
+        提交一次调用并等待完成
+
+        参数:
+            http: 发请求用的 requests.Session；同一学生复用一个，保持 serve.py 的会话 Cookie
+
+        返回:
+            dict: queue_wait、service_time（秒）和 success
+        """
+        if api_name not in self.fn_index:
+            raise KeyError(f"应用中没有 api_name={api_name} 的接口")
+        joined_at = time.perf_counter()
+        resp = http.post(
+            self._url("/queue/join"),
+            json={
+                "data": data,
+                "fn_index": self.fn_index[api_name],
+                "session_hash": session_hash,
+                "event_data": None,
+            },
+            timeout=30,
+        )
+        resp.raise_for_status()
+        event_id = resp.json().get("event_id")
+
+        started_at = None
+        with http.get(
+            self._url("/queue/data"),
+            params={"session_hash": session_hash},
+            stream=True,
+            timeout=self.timeout,
+        ) as stream:
+            for line in stream.iter_lines(decode_unicode=True):
+                if not line or not line.startswith("data:"):
+                    continue
+                msg = json.loads(line[5:])
+                if msg.get("event_id") not in (None, event_id):
+                    continue
+                kind = msg.get("msg")
+                if kind == "process_starts":
+                    started_at = time.perf_counter()
+                elif kind == "process_completed":
+                    done_at = time.perf_counter()
+                    started_at = started_at or joined_at
+                    return {
+                        "queue_wait": started_at - joined_at,
+                        "service_time": done_at - started_at,
+                        "success": bool(msg.get("success", True)),
+                    }
+                elif kind in ("unexpected_error", "close_stream"):
+                    break
+        raise RuntimeError(f"{api_name} 的事件流在完成前关闭")
+
+
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = {}  # endpoint -> [(queue_wait, service_time)]
+        self.errors = {}
+
+    def add(self, endpoint, result):
+        with self.lock:
+            if result.get("success"):
+                self.samples.setdefault(endpoint, []).append(
+                    (result["queue_wait"], result["service_time"])
+                )
+            else:
+                self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+
+    def error(self, endpoint):
+        with self.lock:
+            self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+
+
+def run_student(client, script, recorder, upload_file, think_scale):
+    session_hash = uuid.uuid4().hex[:11]
+    # 每个学生一个 Session，像浏览器一样带上负载均衡的会话 Cookie
+    http = requests.Session()
+    for step in script:
+        endpoint = step["endpoint"]
+        data = list(step["data"])
+        try:
+            if "upload" in step:
+                if not upload_file:
+                    continue
+                data[0] = client.upload(upload_file, http)
+            recorder.add(endpoint, client.call(endpoint, data, session_hash, http))
+        except Exception as e:
+            print(f"[{endpoint}] 调用失败: {e}")
+            recorder.error(endpoint)
+        time.sleep(random.expovariate(1.0 / step.get("think", 5)) * think_scale)
+    http.close()
+
+
+def print_report(recorder, wall):
+    print(f"{'接口':<14}{'次数':>6}{'错误':>6}{'排队p50':>10}{'排队p95':>10}{'服务p50':>10}{'服务p95':>10}{'总p95':>10}")
+    print("-" * 80)
+    total = 0
+    for endpoint in sorted(set(recorder.samples) | set(recorder.errors)):
+        samples = recorder.samples.get(endpoint, [])
+        waits = sorted(s[0] for s in samples)
+        services = sorted(s[1] for s in samples)
+        totals = sorted(s[0] + s[1] for s in samples)
+        total += len(samples)
+        print(
+            f"{endpoint:<14}{len(samples):>6}{recorder.errors.get(endpoint, 0):>6}"
+            f"{percentile(waits, 50):>10.2f}{percentile(waits, 95):>10.2f}"
+            f"{percentile(services, 50):>10.2f}{percentile(services, 95):>10.2f}"
+            f"{percentile(totals, 95):>10.2f}"
+        )
+    print(f"\n时间单位：秒。总耗时 {wall:.1f}s，完成 {total} 次调用，吞吐 {total / wall:.2f} 次/秒")
+
+
+def serve_mock(args):
+    """启动本地替身后端并在同一进程里启动 gradio_app"""
+    from benchmark import setup_backends
+
+    setup_backends(args)
+    import gradio_app
+
+    gradio_app.demo.queue(default_concurrency_limit=args.concurrency_limit)
+    gradio_app.demo.launch(server_port=args.port)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="模拟一个班的学生并发使用 Gradio 应用")
+    parser.add_argument("--url", default="http://127.0.0.1:7860", help="Gradio 应用地址")
+    parser.add_argument("--students", type=int, default=200)
+    parser.add_argument("--arrival-rate", type=float, default=5.0, help="每秒到达的学生数（泊松到达）")
+    parser.add_argument("--sessions", help="JSON 格式的会话脚本文件，结构同 DEFAULT_SESSIONS")
+    parser.add_argument("--mix", help='会话占比 JSON，如 {"chat": 0.5, "exercise": 0.5}')
+    parser.add_argument("--upload-file", help="upload 会话上传的文件，不指定则跳过上传步骤")
+    parser.add_argument("--think-scale", type=float, default=1.0, help="思考时间缩放，0 表示不停顿")
+    parser.add_argument("--seed", type=int, default=0)
+    # --serve-mock 模式下使用的参数
+    parser.add_argument("--serve-mock", action="store_true", help="启动替身后端和应用，不发起负载")
+    parser.add_argument("--port", type=int, default=7860)
+    parser.add_argument("--concurrency-limit", type=int, default=1, help="每个事件的并发处理数")
+    parser.add_argument("--llm-latency", type=float, default=0.8)
+    parser.add_argument("--llm-jitter", type=float, default=0.2)
+    parser.add_argument("--token-latency", type=float, default=0.002)
+    parser.add_argument("--embed-latency", type=float, default=0.05)
+    parser.add_argument("--graph-latency", type=float, default=0.005)
+    args = parser.parse_args(argv)
+
+    if args.serve_mock:
+        serve_mock(args)
+        return 0
+
+    random.seed(args.seed)
+    sessions = DEFAULT_SESSIONS
+    if args.sessions:
+        with open(args.sessions, "r", encoding="utf-8") as f:
+            sessions = json.load(f)
+    mix = json.loads(args.mix) if args.mix else {k: v for k, v in DEFAULT_MIX.items() if k in sessions}
+
+    client = GradioQueueClient(args.url)
+    recorder = Recorder()
+    names, weights = zip(*mix.items())
+    threads = []
+    start = time.perf_counter()
+    for _ in range(args.students):
+        script = sessions[random.choices(names, weights)[0]]
+        t = threading.Thread(
+            target=run_student,
+            args=(client, script, recorder, args.upload_file, args.think_scale),
+            daemon=True,
+        )
+        t.start()
+        threads.append(t)
+        time.sleep(random.expovariate(args.arrival_rate))
+    for t in threads:
+        t.join()
+    print_report(recorder, time.perf_counter() - start)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
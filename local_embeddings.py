@@ -0,0 +1,162 @@
+import os
+import sys
+import argparse
+from typing import List
+import numpy as np
+from dotenv import load_dotenv
+from langchain_core.embeddings import Embeddings
+import tracing
+from embedding_batcher import MicroBatcher
+
+load_dotenv()
+
+try:  # 可选依赖：pip install onnxruntime tokenizers
+    import onnxruntime as ort
+    from tokenizers import Tokenizer
+except ImportError:
+    ort = None
+    Tokenizer = None
+
+# 目录中需包含 ONNX 模型和 tokenizer.json，导出方法见 README
+LOCAL_EMBEDDING_MODEL_DIR = os.getenv("LOCAL_EMBEDDING_MODEL_DIR", "./models/bge-large-zh-v1.5")
+# 设为 1 时加载 model_int8.onnx（由本文件的 quantize 命令生成）
+LOCAL_EMBEDDING_INT8 = os.getenv("LOCAL_EMBEDDING_INT8", "0") == "1"
+LOCAL_EMBEDDING_THREADS = int(os.getenv("LOCAL_EMBEDDING_THREADS", "0"))  # 0 表示由 ONNX Runtime 决定
+LOCAL_EMBEDDING_WORKERS = int(os.getenv("LOCAL_EMBEDDING_WORKERS", "2"))
+LOCAL_EMBEDDING_WINDOW_MS = float(os.getenv("LOCAL_EMBEDDING_WINDOW_MS", "5"))
+LOCAL_EMBEDDING_MAX_BATCH = int(os.getenv("LOCAL_EMBEDDING_MAX_BATCH", "16"))
+
+MODEL_FILE = "model.onnx"
+INT8_MODEL_FILE = "model_int8.onnx"
+TOKENIZER_FILE = "tokenizer.json"
+MAX_LENGTH = 512
+
+
+class LocalBgeEmbeddings(Embeddings):
+    """
+    在本机 CPU 上用 ONNX Runtime 运行 bge-large-zh-v1.5
+
+    与 SiliconFlow 接口一致：取 [CLS] 向量并做 L2 归一化，输出 1024 维，
+    可直接检索已有的 Chroma 集合。并发的 embed_query 由 MicroBatcher 攒批后
+    在线程池中推理。model_name 与接口版相同，CachedEmbeddings 的缓存可以共用。
+
+    参数:
+        model_dir (str): 模型目录
+        int8 (bool): 是否使用 int8 量化模型
+        batch_size (int): embed_documents 每批条数
+    """
+
+    def __init__(
+        self,
+        model_dir: str = LOCAL_EMBEDDING_MODEL_DIR,
+        model_name: str = "BAAI/bge-large-zh-v1.5",
+        int8: bool = LOCAL_EMBEDDING_INT8,
+        batch_size: int = 32,
+    ):
+        if ort is None:
+            raise ImportError("本地向量模型需要 onnxruntime 和 tokenizers：pip install onnxruntime tokenizers")
+        self.model_name = model_name
+        self.batch_size = batch_size
+        model_path = os.path.join(model_dir, INT8_MODEL_FILE if int8 else MODEL_FILE)
+        options = ort.SessionOptions()
+        if LOCAL_EMBEDDING_THREADS > 0:
+            options.intra_op_num_threads = LOCAL_EMBEDDING_THREADS
+        self.session = ort.InferenceSession(
+            model_path, sess_options=options, providers=["CPUExecutionProvider"]
+        )
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, TOKENIZER_FILE))
+        self.tokenizer.enable_truncation(max_length=MAX_LENGTH)
+        self.tokenizer.enable_padding()
+        self._batcher = MicroBatcher(
+            self._encode,
+            window=LOCAL_EMBEDDING_WINDOW_MS / 1000,
+            max_batch=LOCAL_EMBEDDING_MAX_BATCH,
+            workers=LOCAL_EMBEDDING_WORKERS,
+            name="embedding.local",
+        )
+
+    def _encode(self, texts: List[str]) -> List[List[float]]:
+        encodings = self.tokenizer.encode_batch(texts)
+        feeds = {
+            "input_ids": np.array([e.ids for e in encodings], dtype=np.int64),
+            "attention_mask": np.array([e.attention_mask for e in encodings], dtype=np.int64),
+        }
+        if "token_type_ids" in self.input_names:
+            feeds["token_type_ids"] = np.array([e.type_ids for e in encodings], dtype=np.int64)
+        last_hidden_state = self.session.run(None, feeds)[0]
+        cls = last_hidden_state[:, 0]
+        norms = np.linalg.norm(cls, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return (cls / norms).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        all_embeddings: List[List[float]] = []
+        for i in range(0, len(texts), self.batch_size):
+            batch = texts[i : i + self.batch_size]
+            with tracing.span("embedding.documents", batch_size=len(batch), backend="local"):
+                all_embeddings.extend(self._encode(batch))
+        return all_embeddings
+
+    def embed_query(self, text: str) -> List[float]:
+        with tracing.span("embedding.query", model=self.model_name, backend="local"):
+            return self._batcher(text)
+
+
+def quantize(model_dir=LOCAL_EMBEDDING_MODEL_DIR):
+    """把 model.onnx 动态量化为 int8 权重的 model_int8.onnx"""
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    source = os.path.join(model_dir, MODEL_FILE)
+    target = os.path.join(model_dir, INT8_MODEL_FILE)
+    quantize_dynamic(source, target, weight_type=QuantType.QInt8)
+    return target
+
+
+def compare_with_api(local, texts):
+    """
+    与 SiliconFlow 接口生成的向量逐条比较余弦相似度，确认可以检索已有集合
+
+    返回:
+        list: 每条文本的余弦相似度
+    """
+    from langchain_embed_siliconflow import SiliconFlowEmbeddings
+
+    remote = SiliconFlowEmbeddings(
+        api_key=os.getenv("SILICON_API_KEY"),
+        model_name=local.model_name,
+        api_base_url=os.getenv("SILICON_API_BASE", "https://api.siliconflow.cn/v1"),
+    )
+    a = np.asarray(local.embed_documents(texts))
+    b = np.asarray(remote.embed_documents(texts))
+    b = b / np.maximum(np.linalg.norm(b, axis=1, keepdims=True), 1e-12)
+    return (a * b).sum(axis=1).tolist()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="本地 bge-large-zh 向量模型工具")
+    parser.add_argument("command", choices=["quantize", "check"])
+    parser.add_argument("--model-dir", default=LOCAL_EMBEDDING_MODEL_DIR)
+    parser.add_argument("--int8", action="store_true", help="check 时使用 int8 模型")
+    parser.add_argument(
+        "--text",
+        action="append",
+        default=None,
+        help="check 使用的文本，可重复指定",
+    )
+    args = parser.parse_args(argv)
+
+    if args.command == "quantize":
+        print(f"已生成 {quantize(args.model_dir)}")
+        return 0
+    texts = args.text or ["什么是需求分析？", "软件测试的目的是发现程序中的错误。"]
+    local = LocalBgeEmbeddings(args.model_dir, int8=args.int8)
+    sims = compare_with_api(local, texts)
+    for text, sim in zip(texts, sims):
+        print(f"{sim:.4f}  {text}")
+    # bge 在 fp32 下与接口结果几乎一致；int8 量化一般仍在 0.99 以上
+    return 0 if min(sims) >= 0.98 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,259 @@
+# 本地离线替身：OpenAI 兼容的对话/向量接口和内存图数据库
+# 用于基准测试和离线调试，不依赖华为 MaaS、SiliconFlow 和远程 Neo4j
+import json
+import math
+import time
+import random
+import hashlib
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+EMBEDDING_DIM = 1024
+
+# 按系统提示词中的关键字返回符合各调用点格式的固定回答
+_CANNED_REPLIES = [
+    ("提取实体", "软件工程,需求分析,用例图"),
+    ("出题", "【题目】简述瀑布模型的主要阶段。\n【答案】可行性研究、需求分析、设计、实现、测试、维护。\n【解析】瀑布模型按阶段顺序进行，每个阶段产出文档并评审后进入下一阶段。"),
+    ("Graphviz", 'digraph G {\n    node [shape=box, fontname="SimHei"]\n    start [label="开始"]\n    end [label="结束"]\n    start -> end\n}'),
+]
+_DEFAULT_REPLY = "软件工程是应用系统化、规范化、可度量的方法来开发、运行和维护软件的学科。" * 4
+
+
+class MockConfig:
+    """替身服务的延迟配置（秒）"""
+
+    def __init__(
+        self,
+        llm_latency=0.8,
+        llm_jitter=0.2,
+        token_latency=0.01,
+        embed_latency=0.05,
+        embed_jitter=0.01,
+    ):
+        self.llm_latency = llm_latency
+        self.llm_jitter = llm_jitter
+        self.token_latency = token_latency
+        self.embed_latency = embed_latency
+        self.embed_jitter = embed_jitter
+
+
+def fake_embedding(text, dim=EMBEDDING_DIM):
+    """根据文本哈希生成确定性的单位向量，同样的文本总是得到同样的向量"""
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "big")
+    rng = random.Random(seed)
+    vec = [rng.gauss(0.0, 1.0) for _ in range(dim)]
+    norm = math.sqrt(sum(v * v for v in vec)) or 1.0
+    return [v / norm for v in vec]
+
+
+def canned_reply(system_content):
+    for keyword, reply in _CANNED_REPLIES:
+        if keyword in (system_content or ""):
+            return reply
+    return _DEFAULT_REPLY
+
+
+def _sleep(base, jitter):
+    delay = base + random.uniform(-jitter, jitter)
+    if delay > 0:
+        time.sleep(delay)
+
+
+class _MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        payload = json.loads(self.rfile.read(length) or b"{}")
+        path = self.path.split("?")[0]
+        if path.endswith("/chat/completions"):
+            self._chat(payload)
+        elif path.endswith("/embeddings"):
+            self._embeddings(payload)
+        else:
+            self.send_error(404)
+
+    def _send_json(self, body):
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _chat(self, payload):
+        config = self.server.config
+        messages = payload.get("messages", [])
+        system = next((m["content"] for m in messages if m["role"] == "system"), "")
+        prompt_chars = sum(len(m.get("content", "")) for m in messages)
+        reply = canned_reply(system)
+        usage = {
+            "prompt_tokens": prompt_chars,
+            "completion_tokens": len(reply),
+            "total_tokens": prompt_chars + len(reply),
+        }
+        # 首 token 延迟
+        _sleep(config.llm_latency, config.llm_jitter)
+        if not payload.get("stream"):
+            time.sleep(config.token_latency * len(reply))
+            self._send_json(
+                {
+                    "id": "mock-chat",
+                    "object": "chat.completion",
+                    "model": payload.get("model"),
+                    "choices": [
+                        {
+                            "index": 0,
+                            "message": {"role": "assistant", "content": reply},
+                            "finish_reason": "stop",
+                        }
+                    ],
+                    "usage": usage,
+                }
+            )
+            return
+
+        # 流式输出：按 SSE 逐字返回
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        for ch in reply:
+            chunk = {
+                "id": "mock-chat",
+                "object": "chat.completion.chunk",
+                "choices": [{"index": 0, "delta": {"content": ch}}],
+            }
+            self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+            time.sleep(config.token_latency)
+        final = {
+            "id": "mock-chat",
+            "object": "chat.completion.chunk",
+            "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+            "usage": usage,
+        }
+        self.wfile.write(f"data: {json.dumps(final)}\n\ndata: [DONE]\n\n".encode("utf-8"))
+        self.close_connection = True
+
+    def _embeddings(self, payload):
+        config = self.server.config
+        texts = payload.get("input", [])
+        if isinstance(texts, str):
+            texts = [texts]
+        with self.server.stats_lock:
+            self.server.embedding_requests += 1
+            self.server.embedding_inputs += len(texts)
+        _sleep(config.embed_latency, config.embed_jitter)
+        self._send_json(
+            {
+                "object": "list",
+                "model": payload.get("model"),
+                "data": [
+                    {"object": "embedding", "index": i, "embedding": fake_embedding(t)}
+                    for i, t in enumerate(texts)
+                ],
+                "usage": {"prompt_tokens": sum(len(t) for t in texts)},
+            }
+        )
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_mock_server(config=None, host="127.0.0.1", port=0):
+    """
+    在后台线程启动替身服务
+
+    参数:
+        config (MockConfig): 延迟配置
+        port (int): 端口，0 表示随机空闲端口
+
+    返回:
+        tuple: (server, base_url)，base_url 形如 http://127.0.0.1:12345/v1
+    """
+    server = ThreadingHTTPServer((host, port), _MockHandler)
+    server.daemon_threads = True
+    server.config = config or MockConfig()
+    # 嵌入接口收到的请求数和输入条数，用于观察攒批效果
+    server.stats_lock = threading.Lock()
+    server.embedding_requests = 0
+    server.embedding_inputs = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/v1"
+
+
+class _Result:
+    def __init__(self, records):
+        self._records = records
+
+    def data(self):
+        return self._records
+
+
+class InMemoryGraph:
+    """
+    py2neo.Graph 的内存替身，只支持 use_neo4j、graph_expansion 和 graph_cache 中用到的查询
+
+    参数:
+        edges (list): [(起始节点, 关系, 终止节点), ...]
+        latency (float): 每次查询附加的延迟（秒），模拟网络往返
+    """
+
+    def __init__(self, edges=None, latency=0.0):
+        self.latency = latency
+        self._by_name = {}
+        self._edges = list(edges or DEFAULT_EDGES)
+        for start, rel, end in self._edges:
+            record = {"起始节点": start, "关系": rel, "终止节点": end}
+            self._by_name.setdefault(start, []).append(record)
+            if end != start:
+                self._by_name.setdefault(end, []).append(record)
+
+    def run(self, query, parameters=None):
+        if self.latency:
+            time.sleep(self.latency)
+        if "LIMIT 1" in query:
+            return _Result([{"1": 1}])
+        # graph_expansion 的度数查询，只统计两端都有名字的关系
+        if "AS degree" in query:
+            return _Result([
+                {
+                    "name": n,
+                    "degree": sum(
+                        1 for r in self._by_name[n]
+                        if r["起始节点"] is not None and r["终止节点"] is not None
+                    ),
+                }
+                for n in parameters["names"]
+                if n in self._by_name
+            ])
+        # graph_cache 的导出和变更计数查询，关系 id 即边的下标；端点名为 None 的关系被过滤
+        named = [
+            (i, s, r, e) for i, (s, r, e) in enumerate(self._edges) if s is not None and e is not None
+        ]
+        if "count(r)" in query:
+            return _Result([{"n": len(named), "m": named[-1][0] if named else None}])
+        if "id(r) AS rid" in query:
+            after = parameters["after"]
+            rows = [{"rid": i, "start": s, "rel": r, "end": e} for i, s, r, e in named if i > after]
+            return _Result(rows[: parameters["limit"]])
+        entity = (parameters or {}).get("entity")
+        return _Result(list(self._by_name.get(entity, [])))
+
+
+DEFAULT_EDGES = [
+    ("软件工程", "包含", "需求分析"),
+    ("软件工程", "包含", "总体设计"),
+    ("软件工程", "包含", "软件测试"),
+    ("软件工程", "包含", "软件维护"),
+    ("需求分析", "使用", "用例图"),
+    ("需求分析", "使用", "数据流图"),
+    ("需求分析", "产出", "需求规格说明书"),
+    ("总体设计", "使用", "层次图"),
+    ("详细设计", "使用", "程序流程图"),
+    ("软件测试", "包含", "单元测试"),
+    ("软件测试", "包含", "集成测试"),
+    ("用例图", "属于", "UML"),
+    ("类图", "属于", "UML"),
+]
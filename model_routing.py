@@ -0,0 +1,65 @@
+import os
+import json
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# 各调用点使用的模型和生成参数。未列出的字段使用 default 中的值。
+# 可通过 MODEL_ROUTES_FILE 指定 JSON 文件按调用点覆盖，例如把实体提取交给更小更快的模型：
+#   {"extraction": {"model": "<小模型名称>", "max_tokens": 64}}
+DEFAULT_ROUTES = {
+    "default": {"model": "DeepSeek-V3", "temperature": 0.6},
+    # use_neo4j 中的实体提取：输出只是逗号分隔的几个词
+    "extraction": {"temperature": 0.0, "max_tokens": 64},
+    "concept_explanation": {"max_tokens": 1200},
+    "requirement_analysis": {"max_tokens": 2000},
+    "software_design": {"max_tokens": 2500},
+    "software_testing": {"max_tokens": 2000},
+    "exam_answer": {"max_tokens": 1500},
+    "exercise_generation": {"temperature": 0.8, "max_tokens": 800},
+    "flowchart": {"temperature": 0.2, "max_tokens": 1500},
+    # 用量接近预算时（见 usage_ledger.py）叠加在各调用点之上的降级配置，
+    # 可在配置文件中指定更便宜的模型，如 {"degraded": {"model": "<小模型名称>"}}；
+    # max_tokens 取两者中较小的一个
+    "degraded": {"max_tokens": 800},
+}
+# 请求体中允许透传的生成参数
+GENERATION_PARAMS = ("temperature", "top_p", "max_tokens", "presence_penalty", "frequency_penalty")
+
+MODEL_ROUTES_FILE = os.getenv("MODEL_ROUTES_FILE")
+
+
+def load_routes(path=MODEL_ROUTES_FILE):
+    """合并默认路由和配置文件中的覆盖项"""
+    routes = {site: dict(params) for site, params in DEFAULT_ROUTES.items()}
+    if path and os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            for site, params in json.load(f).items():
+                routes.setdefault(site, {}).update(params)
+    elif path:
+        print(f"警告: 模型路由配置文件 '{path}' 未找到，使用默认配置。")
+    return routes
+
+
+ROUTES = load_routes()
+
+
+def get_route(call_site, degraded=False):
+    """
+    返回调用点的模型和生成参数
+
+    参数:
+        call_site (str): 调用点名称，如 'extraction'、'flowchart'
+        degraded (bool): 是否叠加 degraded 降级配置
+
+    返回:
+        dict: 至少包含 model，以及该调用点配置的生成参数
+    """
+    route = dict(ROUTES["default"])
+    route.update(ROUTES.get(call_site, {}))
+    if degraded:
+        for param, value in ROUTES.get("degraded", {}).items():
+            if param == "max_tokens" and param in route:
+                value = min(value, route[param])
+            route[param] = value
+    return route
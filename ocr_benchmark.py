@@ -0,0 +1,126 @@
+# OCR 基准测试：在一组习题图片上比较直接识别与预处理后识别、以及不同 OCR 引擎的
+# 耗时和字符准确率。
+#
+# 样本目录中每张图片（.png/.jpg/.jpeg）旁放一个同名 .txt 作为人工校对的正确文本。
+#
+# 用法:
+#   python ocr_benchmark.py ./samples/worksheets
+#   python ocr_benchmark.py ./samples/worksheets --modes raw,preprocess --repeat 3
+#   python ocr_benchmark.py ./samples/worksheets --engines pytesseract,tesserocr
+import os
+import sys
+import time
+import argparse
+from PIL import Image
+import ocr_engine
+import ocr_preprocess
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg")
+
+
+MODES = {
+    "raw": ocr_engine.image_to_string,
+    "preprocess": ocr_preprocess.ocr_image,
+}
+
+
+def edit_distance(a, b):
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, start=1):
+        current = [i]
+        for j, cb in enumerate(b, start=1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        previous = current
+    return previous[-1]
+
+
+def char_accuracy(expected, actual):
+    """忽略空白后的字符准确率：1 - 编辑距离 / 正确文本长度，最低为 0"""
+    expected = "".join(expected.split())
+    actual = "".join(actual.split())
+    if not expected:
+        return 1.0 if not actual else 0.0
+    return max(0.0, 1.0 - edit_distance(expected, actual) / len(expected))
+
+
+def load_samples(directory):
+    samples = []
+    for name in sorted(os.listdir(directory)):
+        stem, ext = os.path.splitext(name)
+        truth = os.path.join(directory, stem + ".txt")
+        if ext.lower() in IMAGE_EXTENSIONS and os.path.exists(truth):
+            with open(truth, "r", encoding="utf-8") as f:
+                samples.append((os.path.join(directory, name), f.read()))
+    return samples
+
+
+def run(samples, modes, repeat=1):
+    """
+    返回:
+        dict: {模式: [(文件名, 平均耗时秒, 字符准确率), ...]}
+    """
+    results = {mode: [] for mode in modes}
+    for path, truth in samples:
+        for mode in modes:
+            elapsed = 0.0
+            text = ""
+            for _ in range(repeat):
+                with Image.open(path) as img:
+                    img.load()
+                    start = time.perf_counter()
+                    text = MODES[mode](img)
+                    elapsed += time.perf_counter() - start
+            results[mode].append((os.path.basename(path), elapsed / repeat, char_accuracy(truth, text)))
+    return results
+
+
+def print_report(results):
+    modes = list(results)
+    print(f"{'图片':<32}" + "".join(f"{mode + ' 秒':>16}{mode + ' 准确率':>18}" for mode in modes))
+    rows = zip(*(results[mode] for mode in modes))
+    for row in rows:
+        line = f"{row[0][0]:<32}"
+        for _, seconds, accuracy in row:
+            line += f"{seconds:>16.2f}{accuracy:>18.3f}"
+        print(line)
+    print("-" * (32 + 34 * len(modes)))
+    summary = f"{'平均':<32}"
+    for mode in modes:
+        items = results[mode]
+        summary += f"{sum(i[1] for i in items) / len(items):>16.2f}{sum(i[2] for i in items) / len(items):>18.3f}"
+    print(summary)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="OCR 耗时与字符准确率基准测试")
+    parser.add_argument("directory", help="样本目录：图片及同名 .txt 正确文本")
+    parser.add_argument("--modes", default=",".join(MODES), help="逗号分隔：" + ",".join(MODES))
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--engines", default=ocr_engine.OCR_ENGINE, help="逗号分隔：auto," + ",".join(ocr_engine.ENGINES))
+    args = parser.parse_args(argv)
+
+    modes = [m.strip() for m in args.modes.split(",") if m.strip()]
+    unknown = [m for m in modes if m not in MODES]
+    if unknown:
+        print(f"未知模式: {', '.join(unknown)}")
+        return 1
+    samples = load_samples(args.directory)
+    if not samples:
+        print(f"目录 {args.directory} 中没有带 .txt 正确文本的图片")
+        return 1
+    for engine in [e.strip() for e in args.engines.split(",") if e.strip()]:
+        ocr_engine.use(engine)
+        warm_up = getattr(ocr_engine.get_engine(), "warm_up", None)
+        if warm_up is not None:
+            warm_up()
+        print(f"\n引擎 {ocr_engine.get_engine().name}，{len(samples)} 张图片")
+        started = time.perf_counter()
+        print_report(run(samples, modes, args.repeat))
+        elapsed = time.perf_counter() - started
+        print(f"吞吐 {len(samples) * len(modes) * args.repeat / elapsed:.2f} 次识别/秒")
+    ocr_engine.close_all()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
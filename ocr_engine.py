@@ -0,0 +1,234 @@
+# OCR 引擎：pytesseract 每次调用都会启动一个 tesseract 进程并重新加载 chi_sim 语言模型，
+# 小图片的识别时间主要花在这上面。tesserocr 引擎在进程池的每个工作进程中常驻一个
+# Tesseract 实例，语言模型只加载一次。
+#
+# OCR_ENGINE:
+#   auto         安装了 tesserocr 时使用进程池，否则使用 pytesseract（默认）
+#   tesserocr    进程池
+#   pytesseract  每次调用启动 tesseract 进程
+import os
+import sys
+import types
+import threading
+import contextlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+import pytesseract
+import tracing
+
+try:  # 可选依赖：pip install tesserocr（需要系统中的 libtesseract）
+    import tesserocr
+except ImportError:
+    tesserocr = None
+
+OCR_ENGINE = os.getenv("OCR_ENGINE", "auto")
+OCR_LANG = os.getenv("OCR_LANG", "eng+chi_sim")
+OCR_POOL_SIZE = int(os.getenv("OCR_POOL_SIZE", str(min(4, os.cpu_count() or 1))))
+OCR_TIMEOUT = float(os.getenv("OCR_TIMEOUT", "60"))  # 单次识别的超时（秒）
+OCR_TESSDATA = os.getenv("OCR_TESSDATA")  # tessdata 目录，不设置时使用 tesserocr 编译时的默认路径
+
+# Tesseract 的页面切分模式：3 自动分析版面，6 按一整块文本识别
+PSM_AUTO = 3
+PSM_BLOCK = 6
+
+
+class PytesseractEngine:
+    name = "pytesseract"
+
+    def __init__(self, lang=OCR_LANG):
+        self.lang = lang
+
+    def image_to_string(self, img, psm=PSM_AUTO):
+        return pytesseract.image_to_string(img, lang=self.lang, config=f"--psm {psm}")
+
+    def close(self):
+        pass
+
+
+# ---- 工作进程中运行 ----
+_api = None
+
+
+def _init_worker(lang, tessdata):
+    global _api
+    kwargs = {"lang": lang}
+    if tessdata:
+        kwargs["path"] = tessdata
+    _api = tesserocr.PyTessBaseAPI(**kwargs)
+
+
+def _recognize(img, psm):
+    _api.SetPageSegMode(psm)
+    _api.SetImage(img)
+    return _api.GetUTF8Text()
+
+
+def _ping():
+    return os.getpid()
+
+
+# ---- 主进程中运行 ----
+def _pool_context():
+    """
+    工作进程的启动方式：有 forkserver 时（Linux/macOS）用它，并预先在 fork 服务进程里
+    导入本模块（及 tesserocr），工作进程 fork 出来即可用；否则用 spawn（Windows）。
+    两者都不继承 Gradio 进程中的线程和锁。
+    """
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        ctx = multiprocessing.get_context("forkserver")
+        ctx.set_forkserver_preload([__name__])
+        return ctx
+    return multiprocessing.get_context("spawn")
+
+
+@contextlib.contextmanager
+def _hidden_main():
+    """
+    启动工作进程期间让 multiprocessing 看不到主模块
+
+    spawn 和 forkserver 的子进程都会把父进程的主脚本当作 __mp_main__ 重新执行一遍
+    （预加载也避免不了），对 gradio_app 来说就是在每个 OCR 工作进程里再导入一遍
+    agents、构建一遍界面。工作进程只需要本模块中的函数，不需要主模块。
+    """
+    main = sys.modules["__main__"]
+    sys.modules["__main__"] = types.ModuleType("__main__")
+    try:
+        yield
+    finally:
+        sys.modules["__main__"] = main
+
+
+class TesserocrPoolEngine:
+    """
+    tesserocr 进程池：每个工作进程初始化时创建一个 PyTessBaseAPI 并一直复用
+
+    工作进程用 forkserver（Windows 上为 spawn）方式启动，不继承 Gradio 进程中的线程和锁，
+    也不重新执行主脚本。进程池崩溃或识别超时时重建进程池，本次调用改用 pytesseract
+    识别；连续失败（例如缺少语言模型导致工作进程无法初始化）达到 max_failures 次后
+    不再重建，之后都用 pytesseract。
+
+    参数:
+        workers (int): 工作进程数
+        lang (str): 语言
+    """
+
+    name = "tesserocr"
+
+    max_failures = 3
+
+    def __init__(self, workers=OCR_POOL_SIZE, lang=OCR_LANG, timeout=OCR_TIMEOUT):
+        if tesserocr is None:
+            raise ImportError("tesserocr 引擎需要安装 tesserocr：pip install tesserocr")
+        self.workers = workers
+        self.lang = lang
+        self.timeout = timeout
+        self._fallback = PytesseractEngine(lang)
+        self._lock = threading.Lock()
+        self._pool = None
+        self._failures = 0
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                with _hidden_main():
+                    pool = ProcessPoolExecutor(
+                        max_workers=self.workers,
+                        mp_context=_pool_context(),
+                        initializer=_init_worker,
+                        initargs=(self.lang, OCR_TESSDATA),
+                    )
+                    # 非 fork 方式下工作进程在提交任务且没有空闲进程时才启动；
+                    # 这里一次提交 workers 个任务，把进程都在隐藏主模块期间启动起来
+                    for _ in range(self.workers):
+                        pool.submit(_ping)
+                self._pool = pool
+            return self._pool
+
+    def _discard(self, pool, reason):
+        """丢弃出错的进程池（下次调用时重建），返回是否由本次调用负责丢弃"""
+        with self._lock:
+            if self._pool is not pool:
+                return False
+            self._pool = None
+            self._failures += 1
+        print(f"OCR 进程池{reason}（第 {self._failures} 次），本次改用 pytesseract")
+        return True
+
+    def warm_up(self):
+        """启动全部工作进程并加载语言模型，避免第一批请求承担启动开销"""
+        pool = self._get_pool()
+        futures = [pool.submit(_ping) for _ in range(self.workers)]
+        return len({f.result(timeout=self.timeout) for f in futures})
+
+    def image_to_string(self, img, psm=PSM_AUTO):
+        if self._failures >= self.max_failures:
+            return self._fallback.image_to_string(img, psm)
+        pool = self._get_pool()
+        try:
+            text = pool.submit(_recognize, img, psm).result(timeout=self.timeout)
+            self._failures = 0
+            return text
+        except BrokenProcessPool:
+            self._discard(pool, "异常退出")
+            pool.shutdown(wait=False)
+            return self._fallback.image_to_string(img, psm)
+        except FutureTimeoutError:
+            if self._discard(pool, f"识别超时（{self.timeout} 秒）"):
+                # 卡住的工作进程不会自己结束，终止后其他在途任务会以 BrokenProcessPool 退回 pytesseract
+                for process in list(getattr(pool, "_processes", {}).values()):
+                    process.terminate()
+                pool.shutdown(wait=False, cancel_futures=True)
+            return self._fallback.image_to_string(img, psm)
+
+    def close(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+
+ENGINES = {
+    "pytesseract": PytesseractEngine,
+    "tesserocr": TesserocrPoolEngine,
+}
+
+_engines = {}
+_engines_lock = threading.Lock()
+_default = OCR_ENGINE
+
+
+def get_engine(name=None):
+    """按名称取得（必要时创建）OCR 引擎，auto 在没有 tesserocr 时退回 pytesseract"""
+    name = name or _default
+    if name == "auto":
+        name = "tesserocr" if tesserocr is not None else "pytesseract"
+    if name not in ENGINES:
+        raise ValueError(f"未知的 OCR 引擎: {name}")
+    with _engines_lock:
+        if name not in _engines:
+            _engines[name] = ENGINES[name]()
+            print(f"OCR 引擎: {name}")
+        return _engines[name]
+
+
+def use(name):
+    """切换默认引擎（基准测试用）"""
+    global _default
+    get_engine(name)
+    _default = name
+
+
+def close_all():
+    with _engines_lock:
+        engines = list(_engines.values())
+        _engines.clear()
+    for engine in engines:
+        engine.close()
+
+
+def image_to_string(img, psm=PSM_AUTO):
+    engine = get_engine()
+    with tracing.span("ocr.tesseract", engine=engine.name, width=img.width, height=img.height):
+        return engine.image_to_string(img, psm)
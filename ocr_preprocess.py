@@ -0,0 +1,208 @@
+# 上传图片的 OCR 预处理：缩放到适合识别的分辨率、灰度化、自适应二值化、纠正倾斜，
+# 再按文字行的分布切出文字区域，各区域并行识别后按从上到下的顺序拼接。
+import os
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from PIL import Image, ImageOps
+import tracing
+import ocr_engine
+
+# 图片带有 DPI 信息时缩放到该 DPI；没有时把长边限制在 OCR_MAX_SIDE 像素
+OCR_TARGET_DPI = int(os.getenv("OCR_TARGET_DPI", "300"))
+OCR_MAX_SIDE = int(os.getenv("OCR_MAX_SIDE", "2500"))
+OCR_THRESHOLD_BLOCK = int(os.getenv("OCR_THRESHOLD_BLOCK", "31"))  # 自适应阈值的窗口边长（像素，奇数）
+OCR_THRESHOLD_C = float(os.getenv("OCR_THRESHOLD_C", "12"))  # 比窗口均值暗多少才算文字
+OCR_MAX_SKEW = float(os.getenv("OCR_MAX_SKEW", "10"))  # 纠偏搜索的最大角度（度）
+OCR_MAX_REGIONS = int(os.getenv("OCR_MAX_REGIONS", "8"))
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+_REGION_PADDING = 8
+
+
+def downsample(img):
+    """按 DPI 或长边上限缩小图片，不会放大"""
+    scale = 1.0
+    dpi = img.info.get("dpi")
+    if dpi and dpi[0] and dpi[0] > OCR_TARGET_DPI:
+        scale = OCR_TARGET_DPI / float(dpi[0])
+    longest = max(img.size) * scale
+    if longest > OCR_MAX_SIDE:
+        scale *= OCR_MAX_SIDE / longest
+    if scale >= 1.0:
+        return img
+    size = (max(1, int(img.width * scale)), max(1, int(img.height * scale)))
+    return img.resize(size, Image.LANCZOS)
+
+
+def to_grayscale(img):
+    """按 EXIF 方向摆正后转灰度并拉伸对比度"""
+    img = ImageOps.exif_transpose(img)
+    return ImageOps.autocontrast(img.convert("L"), cutoff=1)
+
+
+def adaptive_threshold(gray, block=OCR_THRESHOLD_BLOCK, c=OCR_THRESHOLD_C):
+    """
+    局部均值自适应二值化：像素比所在窗口的均值暗 c 以上记为文字
+
+    用积分图计算窗口均值，光照不均的手机照片也能得到干净的黑白图。
+
+    返回:
+        np.ndarray: bool 数组，True 表示文字像素
+    """
+    a = np.asarray(gray, dtype=np.float64)
+    pad = block // 2
+    padded = np.pad(a, pad, mode="edge")
+    integral = np.pad(padded.cumsum(0).cumsum(1), ((1, 0), (1, 0)))
+    window = (
+        integral[block:, block:]
+        - integral[:-block, block:]
+        - integral[block:, :-block]
+        + integral[:-block, :-block]
+    )
+    mean = window / (block * block)
+    return a < mean - c
+
+
+def _rotate_ink(ink, angle):
+    img = Image.fromarray(ink.astype(np.uint8) * 255)
+    return np.asarray(img.rotate(angle, resample=Image.NEAREST, fillcolor=0)) > 0
+
+
+def _profile_score(ink):
+    # 文字行水平时，逐行墨迹数的起伏最大
+    rows = ink.sum(axis=1).astype(np.float64)
+    return float(np.sum(np.diff(rows) ** 2))
+
+
+def estimate_skew(ink, max_angle=OCR_MAX_SKEW):
+    """
+    用水平投影法估计倾斜角度：先按 1 度粗搜，再在最优角度附近按 0.1 度细搜
+
+    返回:
+        float: 需要逆时针旋转的角度（度）
+    """
+    # 在缩小的图上搜索，长边约 800 像素已足够精确
+    step = max(1, int(max(ink.shape) / 800))
+    small = ink[::step, ::step]
+    if not small.any():
+        return 0.0
+    best = max(np.arange(-max_angle, max_angle + 0.5, 1.0), key=lambda a: _profile_score(_rotate_ink(small, a)))
+    fine = np.arange(best - 1.0, best + 1.05, 0.1)
+    return float(max(fine, key=lambda a: _profile_score(_rotate_ink(small, a))))
+
+
+def deskew(ink, angle):
+    if abs(angle) < 0.1:
+        return ink
+    return _rotate_ink(ink, angle)
+
+
+def text_regions(ink, max_regions=OCR_MAX_REGIONS):
+    """
+    按行投影找出文字行，把间距小的相邻行合并成段落区域
+
+    参数:
+        ink (np.ndarray): 二值图，True 表示文字像素
+        max_regions (int): 区域数上限，超出时合并间距最小的相邻区域
+
+    返回:
+        list: [(left, top, right, bottom), ...]，从上到下
+    """
+    height, width = ink.shape
+    rows = ink.sum(axis=1)
+    # 纸张边缘、阴影等在每一行都有少量墨迹，以行间空白处的水平作为基线
+    baseline = np.percentile(rows, 10)
+    is_text = rows > baseline + max(2, width * 0.005)
+    bands = []
+    start = None
+    for y, flag in enumerate(is_text):
+        if flag and start is None:
+            start = y
+        elif not flag and start is not None:
+            bands.append([start, y])
+            start = None
+    if start is not None:
+        bands.append([start, height])
+    # 去掉过矮的噪点行
+    bands = [b for b in bands if b[1] - b[0] >= 4]
+    if not bands:
+        return []
+    line_height = float(np.median([b[1] - b[0] for b in bands]))
+    merged = [bands[0]]
+    for band in bands[1:]:
+        if band[0] - merged[-1][1] < line_height * 1.5:
+            merged[-1][1] = band[1]
+        else:
+            merged.append(band)
+    while len(merged) > max_regions:
+        gaps = [merged[i + 1][0] - merged[i][1] for i in range(len(merged) - 1)]
+        i = int(np.argmin(gaps))
+        merged[i][1] = merged.pop(i + 1)[1]
+
+    regions = []
+    for top, bottom in merged:
+        cols = np.flatnonzero(ink[top:bottom].any(axis=0))
+        regions.append(
+            (
+                max(0, int(cols[0]) - _REGION_PADDING),
+                max(0, top - _REGION_PADDING),
+                min(width, int(cols[-1]) + 1 + _REGION_PADDING),
+                min(height, bottom + _REGION_PADDING),
+            )
+        )
+    return regions
+
+
+def preprocess(img):
+    """
+    返回:
+        tuple: (二值化并纠偏后的 PIL 图片, 文字区域列表)
+    """
+    with tracing.span("ocr.preprocess", width=img.width, height=img.height) as span:
+        gray = to_grayscale(downsample(img))
+        ink = adaptive_threshold(gray)
+        angle = estimate_skew(ink)
+        ink = deskew(ink, angle)
+        regions = text_regions(ink)
+        span.set_attribute("skew", round(angle, 1))
+        span.set_attribute("regions", len(regions))
+    # 交给 Tesseract 的是白底黑字
+    return Image.fromarray(np.where(ink, 0, 255).astype(np.uint8)), regions
+
+
+def _ocr_crop(crop):
+    # 单个文字区域按一整块文本识别
+    return ocr_engine.image_to_string(crop, psm=ocr_engine.PSM_BLOCK)
+
+
+_executor = None
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=OCR_WORKERS, thread_name_prefix="ocr")
+    return _executor
+
+
+def ocr_image(img, ocr_fn=_ocr_crop):
+    """
+    预处理后分区域并行识别
+
+    参数:
+        img (PIL.Image): 原始图片
+        ocr_fn (callable): 识别单个区域的函数，默认使用 ocr_engine 选定的引擎
+
+    返回:
+        str: 各区域文本按从上到下的顺序拼接
+    """
+    binary, regions = preprocess(img)
+    if not regions:
+        return ""
+    crops = [binary.crop(box) for box in regions]
+    with tracing.span("ocr.recognize", regions=len(crops)):
+        if len(crops) == 1:
+            texts = [ocr_fn(crops[0])]
+        else:
+            texts = list(_get_executor().map(ocr_fn, crops))
+    return "\n".join(text.strip() for text in texts if text.strip())
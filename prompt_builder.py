@@ -0,0 +1,153 @@
+import hashlib
+import threading
+from collections import OrderedDict
+import tracing
+
+# 组装提示词时按“从最稳定到最不稳定”的顺序排列：
+#   系统提示词（每个智能体固定） -> 固定的回答要求 -> 章节 -> 检索到的背景知识 -> 相关知识点 -> 用户问题
+# 这样同一智能体、同一章节的请求共享尽可能长的前缀，能命中上游的 KV/前缀缓存。
+
+RAG_INSTRUCTIONS = (
+    "请根据你的角色设定回答最后给出的用户问题。"
+    "下面会提供从本地知识库检索到的背景知识，如果与问题相关，请主要根据背景知识回答。"
+)
+EXERCISE_INSTRUCTIONS = (
+    "请基于以下信息出一道题目，要求生成题目+答案+解析，格式如下：\n"
+    "【题目】...\n【答案】...\n【解析】..."
+)
+
+
+class Prompt:
+    """
+    分段组装的提示词
+
+    参数:
+        system (str): 系统提示词
+        segments (list): [(段名, 文本), ...]，按稳定程度从高到低排列，空文本会被忽略
+    """
+
+    def __init__(self, system, segments):
+        self.system = system
+        self.segments = [(name, text) for name, text in segments if text]
+
+    @property
+    def user(self):
+        return "\n\n".join(text for _, text in self.segments)
+
+    def prefix_hashes(self):
+        """
+        每个分段边界处的累计前缀哈希
+
+        返回:
+            list: [(段名, 前缀哈希), ...]，第一个为仅含系统提示词的前缀
+        """
+        h = hashlib.sha256(self.system.encode("utf-8"))
+        hashes = [("system", h.hexdigest()[:16])]
+        for i, (name, text) in enumerate(self.segments):
+            h.update(("\n\n" if i else "\x00").encode("utf-8"))
+            h.update(text.encode("utf-8"))
+            hashes.append((name, h.copy().hexdigest()[:16]))
+        return hashes
+
+
+class PrefixTracker:
+    """
+    统计本进程内提示词前缀的复用情况，估计上游前缀缓存可能命中的比例
+
+    记录每个前缀哈希最近是否出现过（LRU），命中时记下可复用的最长分段。
+    """
+
+    def __init__(self, capacity=4096):
+        self.capacity = capacity
+        self._seen = OrderedDict()
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.reused = {}  # 段名 -> 次数
+
+    def observe(self, prompt):
+        longest = None
+        with self._lock:
+            self.requests += 1
+            for name, digest in prompt.prefix_hashes():
+                if digest in self._seen:
+                    self._seen.move_to_end(digest)
+                    longest = name
+                else:
+                    self._seen[digest] = True
+                    if len(self._seen) > self.capacity:
+                        self._seen.popitem(last=False)
+            if longest:
+                self.reused[longest] = self.reused.get(longest, 0) + 1
+        return longest
+
+    def stats(self):
+        with self._lock:
+            return {"requests": self.requests, "reused_prefix": dict(self.reused)}
+
+
+prefix_tracker = PrefixTracker()
+
+
+def _record(prompt):
+    hashes = prompt.prefix_hashes()
+    tracing.set_attribute("prompt.prefix_hash", hashes[-2][1] if len(hashes) > 1 else hashes[0][1])
+    tracing.set_attribute("prompt.reused_prefix", prefix_tracker.observe(prompt) or "none")
+
+
+def build_rag_prompt(system_prompt, question, context, chapter=None, related_terms=None):
+    """
+    组装带检索背景知识的问答提示词
+
+    参数:
+        system_prompt (str): 智能体的系统提示词
+        question (str): 用户原始问题
+        context (str): 检索到的背景知识
+        chapter (str): 选择的章节，None 或“全部章节”表示不限定
+        related_terms (list): 知识图谱中找到的相关知识点，按相关度从高到低排列
+
+    返回:
+        Prompt: 组装好的提示词
+    """
+    chapter_block = (
+        f"请重点关注第{chapter}章的内容。" if chapter and chapter != "全部章节" else ""
+    )
+    context_block = f"--- 背景知识开始 ---\n{context}\n--- 背景知识结束 ---"
+    # 知识点已按相关度从高到低排好，保持原顺序，只去掉重复项
+    terms_block = (
+        "相关知识点：" + "、".join(dict.fromkeys(related_terms)) if related_terms else ""
+    )
+    prompt = Prompt(
+        system_prompt,
+        [
+            ("instructions", RAG_INSTRUCTIONS),
+            ("chapter", chapter_block),
+            ("context", context_block),
+            ("terms", terms_block),
+            ("question", f"用户问题：\n{question}"),
+        ],
+    )
+    _record(prompt)
+    return prompt
+
+
+def build_exercise_prompt(
+    system_prompt, chapter=None, topic=None, difficulty="中等", question_type=None, variant=None
+):
+    """
+    组装出题提示词：固定格式要求在前，章节、题型、难度居中，知识点最后
+
+    variant 为同一条件下批量出题时的序号，附在最后，使各题的请求互不相同、考查角度不重复。
+    """
+    prompt = Prompt(
+        system_prompt,
+        [
+            ("instructions", EXERCISE_INSTRUCTIONS),
+            ("chapter", f"第{chapter}章" if chapter else ""),
+            ("type", f"题型：{question_type}" if question_type else ""),
+            ("difficulty", f"难度：{difficulty}"),
+            ("topic", f"知识点：{topic}" if topic else ""),
+            ("variant", f"这是同一条件下的第{variant}道题，请与其他题目的考查角度不同。" if variant else ""),
+        ],
+    )
+    _record(prompt)
+    return prompt
@@ -0,0 +1,175 @@
+import os
+import threading
+from dotenv import load_dotenv
+from langchain_embed_siliconflow import SiliconFlowEmbeddings
+#from langchain.vectorstores import Chroma
+from langchain_community.vectorstores import Chroma
+from shared_cache import CachedEmbeddings
+import chapter_vectors
+import tracing
+
+# 向量库的配置、加载与检索。agents、检索服务、检索评测和 chapter_vectors 的命令行等都从这里加载，
+# 只需要向量库的脚本不必导入 agents（及其大模型、知识图谱等依赖）
+load_dotenv()
+silicon_api_key = os.getenv("SILICON_API_KEY")
+silicon_api_base = os.getenv("SILICON_API_BASE", "https://api.siliconflow.cn/v1")
+
+persist_directory = "./local_pdf_chroma_db_sf"
+collection_name = "sf_pdf_documents_collection"
+# 向量检索后端：chroma（默认）或 npy（vector_index.py 导出的内存映射索引，多进程共享页缓存）
+vector_backend = os.getenv("VECTOR_BACKEND", "chroma")
+vector_index_dir = os.getenv("VECTOR_INDEX_DIR", "./local_vector_index")
+# 查询向量来源：api（SiliconFlow 接口，默认）或 local（本机 ONNX Runtime，见 local_embeddings.py）
+embedding_backend = os.getenv("EMBEDDING_BACKEND", "api")
+
+
+def _make_embeddings():
+    """按 EMBEDDING_BACKEND 创建向量模型，外层统一加共享缓存"""
+    if embedding_backend == "local":
+        from local_embeddings import LocalBgeEmbeddings
+
+        return CachedEmbeddings(LocalBgeEmbeddings())
+    return CachedEmbeddings(
+        SiliconFlowEmbeddings(
+            api_key=silicon_api_key,
+            model_name="BAAI/bge-large-zh-v1.5",
+            api_base_url=silicon_api_base,
+        )
+    )
+
+
+def load_vector_store():
+    """
+    按 VECTOR_BACKEND 加载向量库
+
+    返回:
+        tuple: (向量模型, 向量库)，不可用时向量库为 None
+    """
+    if not (silicon_api_key or embedding_backend == "local"):
+        print("警告: 未配置 SILICON_API_KEY。RAG 上下文检索功能将不可用。")
+        return None, None
+    if vector_backend == "npy" and os.path.exists(vector_index_dir):
+        try:
+            from vector_index import NumpyVectorIndex
+
+            embeddings = _make_embeddings()
+            store = NumpyVectorIndex(vector_index_dir, embedding_function=embeddings)
+            print(f"本地向量索引已加载用于 RAG（{len(store)} 条）。")
+            return embeddings, store
+        except Exception as e:
+            print(f"加载本地向量索引时出错: {e}。RAG 功能可能受限。")
+            return None, None
+    if os.path.exists(persist_directory):
+        try:
+            embeddings = _make_embeddings()
+            store = Chroma(
+                collection_name=collection_name,
+                persist_directory=persist_directory,
+                embedding_function=embeddings,
+            )
+            print(f"Chroma 数据库已成功加载用于 RAG (向量模型: {embedding_backend})。")
+            return embeddings, store
+        except Exception as e:
+            print(f"初始化 RAG 组件 (SiliconFlow) 时出错: {e}。RAG 功能可能受限。")
+            return None, None
+    print(
+        f"警告: Chroma 数据库目录 '{persist_directory}' 未找到。RAG 将不检索上下文。"
+    )
+    return None, None
+
+
+# 本进程加载的向量库，由 init_local_retrieval 填充
+embeddings_model_instance = None
+vector_store_instance = None
+chapter_vector_index = None
+_chapter_vectors_ready = False
+_chapter_vectors_lock = threading.Lock()
+
+
+def init_local_retrieval():
+    """在本进程加载向量库；章节中心向量推迟到第一次章节检索时再加载（见 get_chapter_vector_index）"""
+    global embeddings_model_instance, vector_store_instance, chapter_vector_index
+    global _chapter_vectors_ready
+    embeddings_model_instance, vector_store_instance = load_vector_store()
+    chapter_vector_index = None
+    _chapter_vectors_ready = False
+
+
+def get_chapter_vector_index():
+    """
+    返回章节中心向量，第一次调用时加载或计算
+
+    计算需要扫描整个向量库，缺标记的章节还要请求嵌入接口，因此不在加载向量库时进行，
+    不做章节检索的进程不承担这部分开销。
+
+    返回:
+        ChapterVectors | None: 不可用时返回 None，检索退回拼接查询
+    """
+    global chapter_vector_index, _chapter_vectors_ready
+    if not _chapter_vectors_ready:
+        with _chapter_vectors_lock:
+            if not _chapter_vectors_ready:
+                if vector_store_instance is not None and chapter_vectors.CHAPTER_BIAS > 0:
+                    chapter_vector_index = chapter_vectors.load_or_build(
+                        vector_store_instance, embeddings_model_instance
+                    )
+                _chapter_vectors_ready = True
+    return chapter_vector_index
+
+
+def build_retrieval_query(question, related_terms):
+    """
+    检索查询：问题后附加知识图谱中的相关知识点
+
+    保持 query_from_neo4j 给出的相关度顺序，不排序（查询文本本身不参与提示词前缀缓存）。
+    """
+    return question + "".join("," + term for term in related_terms)
+
+
+def search_documents(query, k=12, selected_chapter=None, query_vector=None, filter=None):
+    """
+    在本进程加载的向量库中检索 top-k 分块
+
+    参数:
+        query (str): 检索查询
+        k (int): 返回条数
+        selected_chapter (str): 选择的章节，查询向量会向该章中心偏移
+        query_vector (list): 可选，已经算好的查询向量，提供时不再请求嵌入接口
+        filter (dict): 可选，元数据等值过滤，如 {"source": "教材.pdf"}
+
+    返回:
+        list: Document 列表
+    """
+    search_vector = query_vector
+    if selected_chapter and selected_chapter != "全部章节":
+        chapter_query_vector = None
+        chapter_index = get_chapter_vector_index()
+        if chapter_index is not None:
+            # 问题本身的向量与章节中心合成，同一问题在不同章节下复用嵌入缓存
+            chapter_query_vector = chapter_index.bias(
+                query_vector
+                if query_vector is not None
+                else embeddings_model_instance.embed_query(query),
+                selected_chapter,
+            )
+        if chapter_query_vector is not None:
+            search_vector = chapter_query_vector
+        else:
+            # 没有章节中心时退回拼接查询，调用方给的向量不含章节信息，改用拼接后的文本检索
+            query = f"第{selected_chapter}章 {query}"
+            search_vector = None
+
+    kwargs = {}
+    if filter:
+        # Chroma 的 where 条件多个字段时需要写成 $and
+        if len(filter) > 1 and not hasattr(vector_store_instance, "matrix"):
+            filter = {"$and": [{key: value} for key, value in filter.items()]}
+        kwargs["filter"] = filter
+    with tracing.span("chroma.search", k=k) as search_span:
+        if search_vector is not None:
+            search_span.set_attribute("by_vector", True)
+            docs = vector_store_instance.similarity_search_by_vector(search_vector, k=k, **kwargs)
+        else:
+            docs = vector_store_instance.similarity_search(query, k=k, **kwargs)
+        search_span.set_attribute("hits", len(docs))
+    return docs
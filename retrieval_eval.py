@@ -0,0 +1,293 @@
+# 检索质量与延迟评测：在带标注页码的课程问题集上比较不同检索配置的
+# recall@k、MRR、背景知识 token 数和各阶段耗时。
+#
+# 用法:
+#   python retrieval_eval.py bootstrap            # 为未标注的问题生成候选页码，供人工审核
+#   python retrieval_eval.py run                  # 在线运行（同时写入嵌入缓存）
+#   python retrieval_eval.py run --offline        # 只用嵌入缓存，缓存未命中的问题记为失败
+#   python retrieval_eval.py run --configs baseline,chapter_bias --k 8 --save eval/results.json
+import os
+import re
+import sys
+import json
+import time
+import argparse
+
+GOLDEN_SET_PATH = os.getenv("GOLDEN_SET_PATH", "./eval/golden_set.json")
+
+# 各检索配置：
+#   chapter: none 不考虑章节；prefix 旧做法，把“第{章节}章”拼在查询前；bias 查询向量向章节中心偏移
+#   filter: 是否按章节标记过滤检索结果（保留 8 条，没有命中时取前 6 条）
+#   terms: 是否在查询后附加知识图谱扩展出的知识点（使用问题集中冻结的 terms）
+#   agent: 直接调用智能体使用的检索代码（rag_store.build_retrieval_query、rag_store.search_documents），
+#          评测结果随线上实现一起变化，其余键只作说明
+CONFIGS = {
+    "baseline": {"chapter": "none", "filter": False, "terms": False},
+    "chapter_prefix": {"chapter": "prefix", "filter": True, "terms": False},
+    "chapter_bias": {"chapter": "bias", "filter": True, "terms": False},
+    "terms": {"chapter": "none", "filter": False, "terms": True},
+    "current": {"chapter": "bias", "filter": True, "terms": True, "agent": True},
+}
+
+_TOKEN_RE = re.compile(r"[\u4e00-\u9fff]|[A-Za-z0-9_]+|[^\sA-Za-z0-9_\u4e00-\u9fff]")
+
+
+def estimate_tokens(text):
+    """粗略估计 token 数：每个汉字、每个英文单词或数字、每个标点各算一个"""
+    return len(_TOKEN_RE.findall(text or ""))
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+
+
+def load_golden_set(path=GOLDEN_SET_PATH):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_golden_set(golden, path=GOLDEN_SET_PATH):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(golden, f, ensure_ascii=False, indent=2)
+        f.write("\n")
+    os.replace(tmp, path)
+
+
+class OfflineEmbeddingError(Exception):
+    """离线模式下查询向量不在缓存中"""
+
+
+class _OfflineBase:
+    """只读缓存时的占位向量模型：任何缓存未命中都直接报错，不访问网络"""
+
+    def __init__(self, model_name):
+        self.model_name = model_name
+
+    def embed_query(self, text):
+        raise OfflineEmbeddingError(text[:30])
+
+    def embed_documents(self, texts):
+        raise OfflineEmbeddingError(texts[0][:30] if texts else "")
+
+
+def score(expected_pages, retrieved_pages):
+    """
+    返回:
+        tuple: (recall, 倒数排名)，倒数排名在没有命中时为 0
+    """
+    expected = set(expected_pages)
+    found = expected.intersection(retrieved_pages)
+    recall = len(found) / len(expected) if expected else 0.0
+    rr = 0.0
+    for rank, page in enumerate(retrieved_pages, start=1):
+        if page in expected:
+            rr = 1.0 / rank
+            break
+    return recall, rr
+
+
+class Evaluator:
+    """
+    在本进程加载的向量库上按配置检索并计分
+
+    参数:
+        offline (bool): 只使用嵌入缓存
+        k (int): 检索条数
+    """
+
+    def __init__(self, offline=False, k=12):
+        import rag_store
+        from shared_cache import CachedEmbeddings
+
+        if rag_store.vector_store_instance is None:
+            rag_store.init_local_retrieval()
+        if rag_store.vector_store_instance is None:
+            raise RuntimeError("向量库未加载，无法评测")
+        self.store = rag_store.vector_store_instance
+        self.chapter_index = rag_store.get_chapter_vector_index()
+        self.embeddings = rag_store.embeddings_model_instance
+        if offline:
+            self.embeddings = CachedEmbeddings(_OfflineBase(self.embeddings.model_name))
+        self.k = k
+
+    def retrieve(self, item, config):
+        """
+        返回:
+            tuple: (RetrievalResult, 背景知识文本, 各阶段耗时（秒）)
+        """
+        from retrieval_result import RetrievalResult
+
+        if config.get("agent"):
+            return self._retrieve_as_agent(item)
+        chapter = item.get("chapter")
+        query = item["question"]
+        if config["terms"] and item.get("terms"):
+            query += "".join("," + term for term in item["terms"])
+
+        t0 = time.perf_counter()
+        if chapter and config["chapter"] == "prefix":
+            vector = self.embeddings.embed_query(f"第{chapter}章 {query}")
+        else:
+            vector = self.embeddings.embed_query(query)
+            if chapter and config["chapter"] == "bias" and self.chapter_index is not None:
+                vector = self.chapter_index.bias(vector, chapter) or vector
+        t1 = time.perf_counter()
+        result = RetrievalResult(self.store.similarity_search_by_vector(vector, k=self.k))
+        t2 = time.perf_counter()
+        if chapter and config["filter"]:
+            result = result.filter_chapter(chapter, keep=8, fallback=6)
+        context = result.context
+        t3 = time.perf_counter()
+        return result, context, {"embed": t1 - t0, "search": t2 - t1, "post": t3 - t2}
+
+    def _retrieve_as_agent(self, item):
+        # 与 Agent._retrieve 相同的检索路径，查询向量由本评测的向量模型计算（离线时只读缓存）
+        import rag_store
+        from retrieval_result import RetrievalResult
+
+        chapter = item.get("chapter")
+        query = rag_store.build_retrieval_query(item["question"], item.get("terms") or [])
+        t0 = time.perf_counter()
+        vector = self.embeddings.embed_query(query)
+        t1 = time.perf_counter()
+        result = RetrievalResult(
+            rag_store.search_documents(query, self.k, chapter, query_vector=vector)
+        )
+        t2 = time.perf_counter()
+        if chapter and chapter != "全部章节" and result:
+            result = result.filter_chapter(chapter, keep=8, fallback=6)
+        context = result.context
+        t3 = time.perf_counter()
+        return result, context, {"embed": t1 - t0, "search": t2 - t1, "post": t3 - t2}
+
+    def evaluate(self, items, name, config):
+        rows = []
+        failures = 0
+        for item in items:
+            try:
+                result, context, timings = self.retrieve(item, config)
+            except OfflineEmbeddingError:
+                failures += 1
+                continue
+            pages = [doc.metadata.get("page") for doc in result]
+            recall, rr = score(item["pages"], pages)
+            rows.append(
+                {
+                    "id": item["id"],
+                    "recall": recall,
+                    "rr": rr,
+                    "returned": len(pages),
+                    "context_tokens": estimate_tokens(context),
+                    "timings": timings,
+                }
+            )
+        n = len(rows)
+        total = [sum(r["timings"].values()) for r in rows]
+
+        def mean(key):
+            return sum(r[key] for r in rows) / n if n else 0.0
+
+        return {
+            "config": name,
+            "k": self.k,
+            "questions": n,
+            "cache_misses": failures,
+            "recall": mean("recall"),
+            "mrr": mean("rr"),
+            "returned": mean("returned"),
+            "context_tokens": mean("context_tokens"),
+            "embed_p50_ms": percentile([r["timings"]["embed"] for r in rows], 50) * 1000,
+            "search_p50_ms": percentile([r["timings"]["search"] for r in rows], 50) * 1000,
+            "post_p50_ms": percentile([r["timings"]["post"] for r in rows], 50) * 1000,
+            "total_p95_ms": percentile(total, 95) * 1000,
+            "per_question": rows,
+        }
+
+
+def print_table(results, version):
+    print(f"问题集版本 {version}")
+    header = (
+        f"{'配置':<16}{'题数':>6}{'recall@k':>10}{'MRR':>8}{'返回条数':>10}{'上下文token':>12}"
+        f"{'嵌入p50':>10}{'检索p50':>10}{'后处理p50':>12}{'总计p95':>10}"
+    )
+    print(header)
+    print("-" * 104)
+    for r in results:
+        misses = f"  (缓存未命中 {r['cache_misses']})" if r["cache_misses"] else ""
+        print(
+            f"{r['config'] + '@' + str(r['k']):<16}{r['questions']:>6}{r['recall']:>10.3f}{r['mrr']:>8.3f}"
+            f"{r['returned']:>10.1f}{r['context_tokens']:>12.0f}{r['embed_p50_ms']:>10.1f}"
+            f"{r['search_p50_ms']:>10.1f}{r['post_p50_ms']:>12.2f}{r['total_p95_ms']:>10.1f}{misses}"
+        )
+
+
+def bootstrap(golden, top=5, with_terms=False):
+    """
+    为没有标注页码的问题写入候选页码和片段预览，供人工审核后移入 pages
+
+    with_terms 为真时同时调用实体提取和知识图谱扩展，把结果冻结到 terms 中，
+    之后离线评测 terms 配置时不再访问大模型和 Neo4j。
+    """
+    evaluator = Evaluator(k=top)
+    from retrieval_result import normalize_display_text
+
+    updated = 0
+    for item in golden["questions"]:
+        if with_terms and "terms" not in item:
+            import use_neo4j
+
+            item["terms"] = use_neo4j.query_from_neo4j(item["question"])
+        if item.get("pages"):
+            continue
+        result, _, _ = evaluator.retrieve(item, CONFIGS["chapter_bias"])
+        item["candidates"] = [
+            {"page": doc.metadata.get("page"), "preview": normalize_display_text(doc.page_content)[:80]}
+            for doc in result
+        ]
+        updated += 1
+    return updated
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="检索质量与延迟评测")
+    parser.add_argument("command", choices=["run", "bootstrap"])
+    parser.add_argument("--golden", default=GOLDEN_SET_PATH)
+    parser.add_argument("--configs", default=",".join(CONFIGS), help="逗号分隔的配置名")
+    parser.add_argument("--k", type=int, default=12)
+    parser.add_argument("--offline", action="store_true", help="只使用嵌入缓存")
+    parser.add_argument("--save", help="把结果保存为 JSON")
+    parser.add_argument("--terms", action="store_true", help="bootstrap 时冻结知识图谱扩展结果")
+    args = parser.parse_args(argv)
+
+    golden = load_golden_set(args.golden)
+    if args.command == "bootstrap":
+        count = bootstrap(golden, with_terms=args.terms)
+        save_golden_set(golden, args.golden)
+        print(f"已为 {count} 个问题写入候选页码，请审核后把确认的页码填入 pages 并删除 candidates")
+        return 0
+
+    items = [q for q in golden["questions"] if q.get("pages")]
+    if not items:
+        print("问题集中还没有标注页码的问题，请先运行 bootstrap 并人工审核。")
+        return 1
+    evaluator = Evaluator(offline=args.offline, k=args.k)
+    results = []
+    for name in args.configs.split(","):
+        name = name.strip()
+        if name not in CONFIGS:
+            print(f"未知配置: {name}")
+            continue
+        results.append(evaluator.evaluate(items, name, CONFIGS[name]))
+    print_table(results, golden.get("version"))
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump({"version": golden.get("version"), "results": results}, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
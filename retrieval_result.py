@@ -0,0 +1,168 @@
+import os
+import sys
+import json
+import argparse
+import chapter_vectors
+
+# 入库时预先计算并写入分块元数据的字段
+DISPLAY_TEXT_KEY = "display_text"  # 去掉换行、合并空白后的展示文本
+CHAPTERS_KEY = "chapters"  # 分块中出现的章节序号，逗号分隔（Chroma 元数据只支持标量）
+
+APPENDIX_ITEM = "\n\n片段 {index} (来自页码: {page}):\n{text}"
+
+
+def normalize_display_text(text):
+    """把分块文本整理成一行展示文本：换行替换为空格，连续空白合并为一个"""
+    return " ".join((text or "").split())
+
+
+def enrich_metadata(text, metadata=None):
+    """
+    计算分块的展示文本和章节标记，返回新的元数据字典
+
+    参数:
+        text (str): 分块文本
+        metadata (dict): 原有元数据
+    """
+    enriched = dict(metadata or {})
+    enriched[DISPLAY_TEXT_KEY] = normalize_display_text(text)
+    tags = chapter_vectors.tag_chapters([text])[0]
+    enriched[CHAPTERS_KEY] = ",".join(str(n) for n in sorted(tags))
+    return enriched
+
+
+_missing_warned = False
+
+
+def _ensure(doc):
+    # 旧集合中的分块没有预计算字段时现算。结果只写进本次检索得到的 Document，
+    # 不写回向量库，下次检索命中同一分块还要再算一遍；要省掉这部分开销必须先运行补写命令
+    global _missing_warned
+    if doc.metadata is None:
+        doc.metadata = {}
+    if DISPLAY_TEXT_KEY not in doc.metadata or CHAPTERS_KEY not in doc.metadata:
+        if not _missing_warned:
+            _missing_warned = True
+            print("提示: 向量库中的分块缺少预计算的展示文本和章节标记，每次检索都会现算，"
+                  "请运行 python retrieval_result.py 补写")
+        doc.metadata.update(enrich_metadata(doc.page_content, doc.metadata))
+    return doc.metadata
+
+
+def chapter_tags(doc):
+    value = _ensure(doc)[CHAPTERS_KEY]
+    return {int(n) for n in value.split(",") if n}
+
+
+class RetrievalResult:
+    """
+    一次检索得到的分块
+
+    章节过滤和参考片段附录都直接使用元数据中预先算好的章节标记和展示文本，
+    每次请求只做与输出大小成正比的拼接。
+
+    参数:
+        docs (list): LangChain Document 列表
+    """
+
+    def __init__(self, docs=None):
+        self.docs = list(docs or [])
+
+    def __len__(self):
+        return len(self.docs)
+
+    def __iter__(self):
+        return iter(self.docs)
+
+    def filter_chapter(self, selected_chapter, keep=8, fallback=6):
+        """
+        只保留带有该章节标记的分块；一个都没有时退回前 fallback 条原始结果
+
+        返回:
+            RetrievalResult: 过滤后的结果
+        """
+        number, _ = chapter_vectors.parse_chapter(selected_chapter)
+        if number is None:
+            return RetrievalResult(self.docs[:fallback])
+        matched = [doc for doc in self.docs if number in chapter_tags(doc)]
+        return RetrievalResult(matched[:keep] if matched else self.docs[:fallback])
+
+    @property
+    def context(self):
+        """传给大模型的背景知识"""
+        return "\n\n".join(doc.page_content for doc in self.docs)
+
+    def appendix(self):
+        """回答后附加的参考片段（含页码）"""
+        items = []
+        for i, doc in enumerate(self.docs):
+            metadata = _ensure(doc)
+            page = metadata.get("page")
+            items.append(
+                APPENDIX_ITEM.format(
+                    index=i + 1,
+                    page="未知页码" if page is None else page,
+                    text=metadata[DISPLAY_TEXT_KEY],
+                )
+            )
+        return "".join(items)
+
+
+def enrich_chroma(vector_store, batch_size=500):
+    """为已有 Chroma 集合中的分块补写预计算字段，返回更新的条数"""
+    collection = vector_store._collection
+    data = collection.get(include=["documents", "metadatas"])
+    updated = 0
+    for start in range(0, len(data["ids"]), batch_size):
+        ids = data["ids"][start : start + batch_size]
+        metadatas = [
+            enrich_metadata(text, meta)
+            for text, meta in zip(
+                data["documents"][start : start + batch_size],
+                data["metadatas"][start : start + batch_size],
+            )
+        ]
+        collection.update(ids=ids, metadatas=metadatas)
+        updated += len(ids)
+    return updated
+
+
+def enrich_npy_index(index_dir):
+    """为 vector_index 导出的索引重写 metadata.jsonl，返回更新的条数"""
+    from vector_index import METADATA_FILE
+
+    path = os.path.join(index_dir, METADATA_FILE)
+    with open(path, "r", encoding="utf-8") as f:
+        records = [json.loads(line) for line in f]
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        for record in records:
+            record["metadata"] = enrich_metadata(record["page_content"], record["metadata"])
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    os.replace(tmp, path)
+    return len(records)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="为已入库的分块补写展示文本和章节标记")
+    parser.add_argument("--persist-directory", default="./local_pdf_chroma_db_sf")
+    parser.add_argument("--collection", default="sf_pdf_documents_collection")
+    parser.add_argument("--npy-index", help="改为处理 vector_index 导出的索引目录")
+    args = parser.parse_args(argv)
+
+    if args.npy_index:
+        count = enrich_npy_index(args.npy_index)
+    else:
+        from langchain_community.vectorstores import Chroma
+
+        if not os.path.exists(args.persist_directory):
+            print(f"Chroma 数据库目录 '{args.persist_directory}' 未找到。")
+            return 1
+        store = Chroma(collection_name=args.collection, persist_directory=args.persist_directory)
+        count = enrich_chroma(store)
+    print(f"已更新 {count} 个分块的元数据")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,318 @@
+# 独立的检索服务：在一个进程中加载向量库和章节中心向量，通过 HTTP 提供检索接口，
+# 各个 Gradio 工作进程和离线任务（出题库构建、检索评测）共用同一份索引和缓存。
+#
+# 接口:
+#   GET  /health          状态、分块数、结果缓存命中情况
+#   POST /search          {"query": "...", "k": 12, "chapter": "第三章：需求分析", "filter": {"page": 3}}
+#   POST /batch_search    {"queries": [{"query": "..."}, ...]}，所有查询的向量一次性批量计算
+#
+# 用法:
+#   python retrieval_service.py --port 8765
+#   RETRIEVAL_SERVICE_URL=http://127.0.0.1:8765 python gradio_app.py
+import os
+import sys
+import json
+import argparse
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import requests
+from dotenv import load_dotenv
+from langchain_core.documents import Document
+import tracing
+import rag_store
+
+load_dotenv()
+
+RETRIEVAL_SERVICE_HOST = os.getenv("RETRIEVAL_SERVICE_HOST", "127.0.0.1")
+RETRIEVAL_SERVICE_PORT = int(os.getenv("RETRIEVAL_SERVICE_PORT", "8765"))
+RETRIEVAL_CACHE_SIZE = int(os.getenv("RETRIEVAL_CACHE_SIZE", "2048"))
+RETRIEVAL_MAX_BATCH = int(os.getenv("RETRIEVAL_MAX_BATCH", "10000"))
+RETRIEVAL_MAX_K = 100
+# 客户端超时（秒）：单条检索在回答的关键路径上，批量检索可能包含上千条查询
+RETRIEVAL_TIMEOUT = float(os.getenv("RETRIEVAL_TIMEOUT", "10"))
+RETRIEVAL_BATCH_TIMEOUT = float(os.getenv("RETRIEVAL_BATCH_TIMEOUT", "600"))
+
+
+def _doc_to_json(doc):
+    return {"page_content": doc.page_content, "metadata": doc.metadata or {}}
+
+
+def _doc_from_json(data):
+    return Document(page_content=data["page_content"], metadata=data.get("metadata") or {})
+
+
+class BadRequest(Exception):
+    """请求参数不合法，返回 400"""
+
+
+class RetrievalService:
+    """
+    检索服务的业务逻辑，与 HTTP 处理分开，便于在进程内直接调用
+
+    参数:
+        cache_size (int): 检索结果 LRU 缓存的条数，0 表示不缓存
+    """
+
+    def __init__(self, cache_size=RETRIEVAL_CACHE_SIZE):
+        # 只依赖 rag_store，不导入 agents（及其大模型、知识图谱等依赖）
+        if rag_store.vector_store_instance is None:
+            rag_store.init_local_retrieval()
+        # 常驻服务启动时就准备好章节中心向量，不让第一条章节检索承担计算开销
+        rag_store.get_chapter_vector_index()
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def available(self):
+        return rag_store.vector_store_instance is not None
+
+    def document_count(self):
+        store = rag_store.vector_store_instance
+        if store is None:
+            return 0
+        if hasattr(store, "matrix"):
+            return len(store)
+        return store._collection.count()
+
+    def health(self):
+        with self._lock:
+            cache = {"size": len(self._cache), "hits": self.hits, "misses": self.misses}
+        return {
+            "status": "ok" if self.available else "unavailable",
+            "backend": rag_store.vector_backend,
+            "documents": self.document_count(),
+            "chapter_vectors": rag_store.chapter_vector_index is not None,
+            "cache": cache,
+        }
+
+    @staticmethod
+    def _parse(request):
+        if isinstance(request, str):
+            request = {"query": request}
+        if not isinstance(request, dict) or not isinstance(request.get("query"), str):
+            raise BadRequest("每条检索请求需要字符串字段 query")
+        k = request.get("k", 12)
+        if not isinstance(k, int) or not 1 <= k <= RETRIEVAL_MAX_K:
+            raise BadRequest(f"k 需要是 1~{RETRIEVAL_MAX_K} 的整数")
+        filter = request.get("filter")
+        if filter is not None and not isinstance(filter, dict):
+            raise BadRequest("filter 需要是对象，如 {\"page\": 3}")
+        return {
+            "query": request["query"],
+            "k": k,
+            "chapter": request.get("chapter"),
+            "filter": filter or None,
+            "vector": request.get("vector"),
+        }
+
+    def _cache_key(self, request):
+        if request["vector"] is not None:
+            return None
+        return json.dumps(
+            [request["query"], request["k"], request["chapter"], request["filter"]],
+            ensure_ascii=False,
+            sort_keys=True,
+        )
+
+    def _cache_get(self, key):
+        if key is None or self.cache_size <= 0:
+            return None
+        with self._lock:
+            value = self._cache.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._cache.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def _cache_put(self, key, value):
+        if key is None or self.cache_size <= 0:
+            return
+        with self._lock:
+            self._cache[key] = value
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def _run(self, request, vector=None):
+        docs = rag_store.search_documents(
+            request["query"],
+            request["k"],
+            request["chapter"],
+            query_vector=vector if vector is not None else request["vector"],
+            filter=request["filter"],
+        )
+        return [_doc_to_json(doc) for doc in docs]
+
+    def search(self, request):
+        request = self._parse(request)
+        key = self._cache_key(request)
+        cached = self._cache_get(key)
+        if cached is not None:
+            return cached
+        result = self._run(request)
+        self._cache_put(key, result)
+        return result
+
+    def batch_search(self, requests_):
+        """
+        批量检索：未命中缓存且未自带向量的查询一次性批量计算向量，再逐条检索
+
+        返回:
+            list: 与输入顺序一致的结果列表
+        """
+        if not isinstance(requests_, list) or not requests_:
+            raise BadRequest("queries 需要是非空列表")
+        if len(requests_) > RETRIEVAL_MAX_BATCH:
+            raise BadRequest(f"单次最多 {RETRIEVAL_MAX_BATCH} 条查询")
+        parsed = [self._parse(r) for r in requests_]
+        keys = [self._cache_key(r) for r in parsed]
+        results = [self._cache_get(key) for key in keys]
+        pending = [i for i, r in enumerate(results) if r is None]
+        to_embed = [i for i in pending if parsed[i]["vector"] is None]
+        vectors = {}
+        if to_embed:
+            with tracing.span("retrieval.batch_embed", queries=len(to_embed)):
+                embedded = rag_store.embeddings_model_instance.embed_documents(
+                    [parsed[i]["query"] for i in to_embed]
+                )
+            vectors = dict(zip(to_embed, embedded))
+        for i in pending:
+            results[i] = self._run(parsed[i], vectors.get(i))
+            self._cache_put(keys[i], results[i])
+        return results
+
+
+class _Handler(BaseHTTPRequestHandler):
+    service = None
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/health":
+            self.send_error(404)
+            return
+        health = self.service.health()
+        self._send_json(200 if health["status"] == "ok" else 503, health)
+
+    def do_POST(self):
+        path = self.path.split("?")[0]
+        if path not in ("/search", "/batch_search"):
+            self.send_error(404)
+            return
+        if not self.service.available:
+            self._send_json(503, {"error": "向量库未加载"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            payload = json.loads(self.rfile.read(length) or b"{}")
+            if path == "/search":
+                with tracing.span("retrieval.search"):
+                    self._send_json(200, {"documents": self.service.search(payload)})
+            else:
+                queries = payload.get("queries") if isinstance(payload, dict) else None
+                with tracing.span("retrieval.batch_search", queries=len(queries or [])):
+                    self._send_json(200, {"results": self.service.batch_search(queries)})
+        except (BadRequest, ValueError) as e:
+            self._send_json(400, {"error": str(e)})
+        except Exception as e:
+            print(f"检索服务处理请求出错: {e}")
+            self._send_json(500, {"error": str(e)})
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server(service, host=RETRIEVAL_SERVICE_HOST, port=RETRIEVAL_SERVICE_PORT):
+    """在后台线程启动检索服务，返回 (server, base_url)"""
+    handler = type("RetrievalHandler", (_Handler,), {"service": service})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+class RetrievalClient:
+    """
+    检索服务的客户端，返回与向量库接口相同的 Document 列表
+
+    参数:
+        base_url (str): 检索服务地址，如 http://127.0.0.1:8765
+    """
+
+    def __init__(self, base_url, timeout=RETRIEVAL_TIMEOUT, batch_timeout=RETRIEVAL_BATCH_TIMEOUT):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.batch_timeout = batch_timeout
+        self.session = requests.Session()
+
+    def _post(self, path, payload, timeout):
+        response = self.session.post(f"{self.base_url}{path}", json=payload, timeout=timeout)
+        if response.status_code != 200:
+            raise RuntimeError(f"检索服务返回 {response.status_code}: {response.text[:200]}")
+        return response.json()
+
+    def search(self, query, k=12, chapter=None, filter=None, vector=None):
+        payload = {"query": query, "k": k}
+        if chapter:
+            payload["chapter"] = chapter
+        if filter:
+            payload["filter"] = filter
+        if vector is not None:
+            payload["vector"] = list(vector)
+        with tracing.span("retrieval.client", k=k) as span:
+            documents = self._post("/search", payload, self.timeout)["documents"]
+            span.set_attribute("hits", len(documents))
+        return [_doc_from_json(d) for d in documents]
+
+    def batch_search(self, queries):
+        """
+        参数:
+            queries (list): 查询字符串，或与 /search 请求体相同的字典
+
+        返回:
+            list: 每条查询的 Document 列表
+        """
+        with tracing.span("retrieval.client.batch", queries=len(queries)):
+            results = self._post("/batch_search", {"queries": queries}, self.batch_timeout)["results"]
+        return [[_doc_from_json(d) for d in documents] for documents in results]
+
+    def health(self):
+        response = self.session.get(f"{self.base_url}/health", timeout=self.timeout)
+        return response.json()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="启动本地检索服务")
+    parser.add_argument("--host", default=RETRIEVAL_SERVICE_HOST)
+    parser.add_argument("--port", type=int, default=RETRIEVAL_SERVICE_PORT)
+    parser.add_argument("--metrics-port", type=int, help="同时在该端口提供 /metrics")
+    args = parser.parse_args(argv)
+
+    service = RetrievalService()
+    if not service.available:
+        print("向量库未加载，检索服务无法启动。")
+        return 1
+    if args.metrics_port:
+        tracing.start_metrics_server(args.metrics_port)
+    server, base_url = start_server(service, args.host, args.port)
+    print(f"检索服务已启动：{base_url}（{service.document_count()} 个分块）")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
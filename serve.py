@@ -0,0 +1,145 @@
+# 多进程部署：启动 N 个 gradio_app 工作进程（各占一个端口），
+# 共享同一个 SQLite 缓存（向量缓存、回答缓存、聊天记录），并生成本地 nginx 负载均衡配置。
+#
+# Gradio 的队列状态保存在各进程内存中，同一个浏览器会话的 queue/join 和 queue/data
+# 必须落到同一个进程，因此负载均衡按会话 Cookie 做会话保持：首次请求由 nginx 随机
+# 生成 gradio_worker Cookie（$request_id），之后按它做一致性哈希。不用 ip_hash，是因为
+# 同一 NAT（整个机房、校园网）或本机压测的所有客户端 IP 相同，会全部落到一个进程上。
+# 不保存 Cookie 的客户端每次请求都会被随机分配，脚本需用 requests.Session 之类保持 Cookie。
+#
+# 用法:
+#   python serve.py --workers 4 --base-port 7861 --nginx-conf ./cache/nginx_gradio.conf
+#   nginx -c $(pwd)/cache/nginx_gradio.conf     # 对外监听 7860
+import os
+import sys
+import time
+import signal
+import argparse
+import subprocess
+
+# 工作进程和检索服务默认的查询向量攒批窗口（毫秒），环境变量 EMBED_BATCH_WINDOW_MS 优先
+DEPLOY_EMBED_BATCH_WINDOW_MS = "5"
+
+NGINX_TEMPLATE = """worker_processes auto;
+events {{ worker_connections 4096; }}
+http {{
+    map $cookie_gradio_worker $sticky_key {{
+        "" $request_id;
+        default $cookie_gradio_worker;
+    }}
+    map $cookie_gradio_worker $sticky_cookie {{
+        "" "gradio_worker=$request_id; Path=/; HttpOnly; SameSite=Lax";
+        default "";
+    }}
+    upstream gradio_workers {{
+        hash $sticky_key consistent;
+{servers}
+    }}
+    server {{
+        listen {listen};
+        client_max_body_size 50m;
+        location / {{
+            proxy_pass http://gradio_workers;
+            proxy_http_version 1.1;
+            proxy_set_header Upgrade $http_upgrade;
+            proxy_set_header Connection "upgrade";
+            proxy_set_header Host $host;
+            proxy_set_header X-Forwarded-For $proxy_add_x_forwarded_for;
+            add_header Set-Cookie $sticky_cookie always;
+            # 队列结果通过 SSE 推送，关闭缓冲并放宽超时
+            proxy_buffering off;
+            proxy_read_timeout 600s;
+        }}
+    }}
+}}
+"""
+
+
+def write_nginx_conf(path, ports, listen):
+    servers = "\n".join(f"        server 127.0.0.1:{p};" for p in ports)
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(NGINX_TEMPLATE.format(servers=servers, listen=listen))
+    print(f"nginx 配置已写入 {path}")
+
+
+def start_worker(index, port, args):
+    env = dict(os.environ)
+    env["GRADIO_SERVER_PORT"] = str(port)
+    env["GRADIO_SERVER_NAME"] = args.host
+    env["METRICS_PORT"] = str(args.metrics_base_port + index)
+    env.setdefault("SHARED_CACHE_PATH", os.path.abspath(args.cache_path))
+    if args.answer_cache_ttl is not None:
+        env["ANSWER_CACHE_TTL"] = str(args.answer_cache_ttl)
+    if args.retrieval_port:
+        env["RETRIEVAL_SERVICE_URL"] = f"http://127.0.0.1:{args.retrieval_port}"
+    # 课堂部署并发高，默认开启查询向量攒批（见 langchain_embed_siliconflow.py）
+    env.setdefault("EMBED_BATCH_WINDOW_MS", DEPLOY_EMBED_BATCH_WINDOW_MS)
+    print(f"启动工作进程 {index}：端口 {port}，指标端口 {env['METRICS_PORT']}")
+    return subprocess.Popen([sys.executable, "gradio_app.py"], env=env)
+
+
+def start_retrieval_service(args):
+    env = dict(os.environ)
+    env.setdefault("SHARED_CACHE_PATH", os.path.abspath(args.cache_path))
+    env.setdefault("EMBED_BATCH_WINDOW_MS", DEPLOY_EMBED_BATCH_WINDOW_MS)
+    print(f"启动检索服务：端口 {args.retrieval_port}")
+    return subprocess.Popen(
+        [sys.executable, "retrieval_service.py", "--port", str(args.retrieval_port)], env=env
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="以多进程方式部署 Gradio 应用")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--base-port", type=int, default=7861, help="第一个工作进程的端口")
+    parser.add_argument("--metrics-base-port", type=int, default=9464)
+    parser.add_argument("--listen", type=int, default=7860, help="nginx 对外端口")
+    parser.add_argument("--nginx-conf", default="./cache/nginx_gradio.conf")
+    parser.add_argument("--cache-path", default="./cache/shared_cache.sqlite3")
+    parser.add_argument("--answer-cache-ttl", type=int, help="回答缓存时长（秒）")
+    parser.add_argument(
+        "--retrieval-port",
+        type=int,
+        help="启动共享的检索服务（retrieval_service.py），工作进程不再各自加载向量库",
+    )
+    args = parser.parse_args(argv)
+
+    ports = [args.base_port + i for i in range(args.workers)]
+    write_nginx_conf(args.nginx_conf, ports, args.listen)
+    retrieval = start_retrieval_service(args) if args.retrieval_port else None
+    workers = {i: start_worker(i, port, args) for i, port in enumerate(ports)}
+
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    # 简单的守护：工作进程意外退出时重启
+    while not stopping:
+        time.sleep(1)
+        if retrieval is not None and retrieval.poll() is not None and not stopping:
+            print(f"检索服务已退出（状态 {retrieval.returncode}），正在重启")
+            retrieval = start_retrieval_service(args)
+        for i, proc in list(workers.items()):
+            if proc.poll() is not None and not stopping:
+                print(f"工作进程 {i} 已退出（状态 {proc.returncode}），正在重启")
+                workers[i] = start_worker(i, ports[i], args)
+
+    processes = list(workers.values()) + ([retrieval] if retrieval is not None else [])
+    for proc in processes:
+        proc.terminate()
+    for proc in processes:
+        proc.wait(timeout=30)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
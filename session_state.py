@@ -0,0 +1,232 @@
+# 浏览器会话的聊天状态：gr.State 中只保存消息 id 和长度，消息正文保存在共享缓存中。
+#
+# gr.State 的内容:
+#   {"sid": "会话 id", "threads": {"智能体名": [[消息 id, 字节数], ...]}, "next": 下一个消息 id}
+#
+# 每个会话的正文总量有上限，超出时删除最早的消息；空闲超过 SESSION_IDLE_TTL 秒的会话
+# 连同正文一起清理。/metrics 中的 session_state 指标给出当前会话数和占用的内存。
+import os
+import json
+import time
+import uuid
+import threading
+import tracing
+from shared_cache import get_shared_cache
+
+SESSION_IDLE_TTL = int(os.getenv("SESSION_IDLE_TTL", "3600"))  # 秒
+SESSION_MAX_MESSAGES = int(os.getenv("SESSION_MAX_MESSAGES", "200"))  # 每个智能体
+SESSION_MAX_BYTES = int(os.getenv("SESSION_MAX_BYTES", str(2 * 1024 * 1024)))  # 每个会话的正文总量
+SESSION_SWEEP_INTERVAL = 60  # 两次清理空闲会话的最短间隔（秒）
+
+
+def _size(content):
+    return len(content.encode("utf-8"))
+
+
+class SessionStore:
+    """
+    管理各会话的消息 id 列表和共享缓存中的消息正文
+
+    参数:
+        cache (SharedCache): 保存正文的共享缓存
+        idle_ttl (int): 会话空闲多久后清理（秒）
+        max_messages (int): 每个智能体最多保留的消息数
+        max_bytes (int): 每个会话正文的总字节数上限
+    """
+
+    namespace = "message"
+
+    def __init__(
+        self,
+        cache=None,
+        idle_ttl=SESSION_IDLE_TTL,
+        max_messages=SESSION_MAX_MESSAGES,
+        max_bytes=SESSION_MAX_BYTES,
+    ):
+        self.cache = cache or get_shared_cache()
+        self.idle_ttl = idle_ttl
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._sessions = {}  # sid -> [最后活动时间, state]
+        self._last_sweep = time.monotonic()
+
+    def _key(self, state, message_id):
+        return f"{state['sid']}:{message_id}"
+
+    def _keys(self, state):
+        return [
+            self._key(state, message_id)
+            for entries in state["threads"].values()
+            for message_id, _ in entries
+        ]
+
+    def ensure(self, state):
+        """
+        取得（必要时初始化）会话状态并记录一次活动
+
+        参数:
+            state: gr.State 中的值，初始为 {}
+
+        返回:
+            dict: 会话状态，调用方应把它作为新的 gr.State 值返回
+        """
+        if not isinstance(state, dict) or "sid" not in state:
+            state = {"sid": uuid.uuid4().hex, "threads": {}, "next": 0}
+        now = time.monotonic()
+        with self._lock:
+            entry = self._sessions.get(state["sid"])
+            first = entry is None
+            refresh = first or now - entry[0] > SESSION_SWEEP_INTERVAL
+            self._sessions[state["sid"]] = [now, state]
+            sweep = now - self._last_sweep > SESSION_SWEEP_INTERVAL
+            if sweep:
+                self._last_sweep = now
+        if refresh and not first:
+            # 正文的过期时间随会话活动顺延，工作进程退出后遗留的正文也会自然过期
+            self.cache.touch(self.namespace, self._keys(state), self.idle_ttl)
+        if sweep:
+            self.sweep()
+        return state
+
+    def append(self, state, thread, role, content):
+        """追加一条消息，返回消息 id"""
+        message_id = state["next"]
+        state["next"] += 1
+        self.cache.set_json(
+            self.namespace,
+            self._key(state, message_id),
+            {"role": role, "content": content},
+            ttl=self.idle_ttl,
+        )
+        state["threads"].setdefault(thread, []).append([message_id, _size(content)])
+        self._trim(state, thread)
+        return message_id
+
+    def update(self, state, thread, message_id, content):
+        """替换一条消息的正文（如上传习题时的占位回答）"""
+        entries = state["threads"].get(thread, [])
+        for entry in entries:
+            if entry[0] == message_id:
+                key = self._key(state, message_id)
+                message = self.cache.get_json(self.namespace, key) or {"role": "assistant"}
+                message["content"] = content
+                self.cache.set_json(self.namespace, key, message, ttl=self.idle_ttl)
+                entry[1] = _size(content)
+                self._trim(state, thread)
+                return
+
+    def replace(self, state, thread, messages):
+        """用一组消息替换某个智能体的全部记录（如切换智能体时载入保存的聊天记录）"""
+        old = [self._key(state, message_id) for message_id, _ in state["threads"].pop(thread, [])]
+        if old:
+            self.cache.delete_many(self.namespace, old)
+        for message in messages[-self.max_messages :]:
+            self.append(state, thread, message["role"], message["content"])
+
+    def messages(self, state, thread):
+        """
+        返回:
+            list: Chatbot 使用的 [{"role", "content"}, ...]；已过期的正文会被跳过并从 id 列表中移除
+        """
+        if not isinstance(state, dict) or "sid" not in state:
+            return []
+        entries = state["threads"].get(thread, [])
+        stored = self.cache.get_many_json(
+            self.namespace, [self._key(state, entry[0]) for entry in entries]
+        )
+        result = []
+        alive = []
+        for entry in entries:
+            message = stored.get(self._key(state, entry[0]))
+            if message is not None:
+                result.append(message)
+                alive.append(entry)
+        if len(alive) != len(entries):
+            state["threads"][thread] = alive
+        return result
+
+    def _trim(self, state, thread):
+        entries = state["threads"][thread]
+        removed = []
+        while len(entries) > self.max_messages:
+            removed.append(entries.pop(0))
+        total = sum(size for thread_entries in state["threads"].values() for _, size in thread_entries)
+        # 超出会话总量时先删当前智能体最早的消息（保留刚写入的这一条），再删其他智能体的
+        for name, thread_entries in [(thread, entries)] + [
+            item for item in state["threads"].items() if item[0] != thread
+        ]:
+            keep = 1 if name == thread else 0
+            while total > self.max_bytes and len(thread_entries) > keep:
+                entry = thread_entries.pop(0)
+                removed.append(entry)
+                total -= entry[1]
+        if removed:
+            self.cache.delete_many(
+                self.namespace, [self._key(state, message_id) for message_id, _ in removed]
+            )
+
+    def release(self, state):
+        """删除会话的全部正文（gr.State 被 Gradio 回收或会话空闲过期时调用）"""
+        if not isinstance(state, dict) or "sid" not in state:
+            return
+        with self._lock:
+            self._sessions.pop(state["sid"], None)
+        keys = self._keys(state)
+        if keys:
+            self.cache.delete_many(self.namespace, keys)
+        state["threads"] = {}
+
+    def sweep(self):
+        """清理空闲超过 idle_ttl 的会话，返回清理的会话数"""
+        deadline = time.monotonic() - self.idle_ttl
+        with self._lock:
+            idle = [state for last_seen, state in self._sessions.values() if last_seen < deadline]
+        for state in idle:
+            self.release(state)
+        return len(idle)
+
+    def report(self):
+        """
+        返回:
+            dict: sessions 会话数，messages 消息数，state_bytes gr.State 本身占用的内存（按 JSON 大小估算），
+                  stored_bytes 共享缓存中正文的总字节数
+        """
+        with self._lock:
+            states = [state for _, state in self._sessions.values()]
+        messages = 0
+        stored = 0
+        resident = 0
+        for state in states:
+            for entries in list(state["threads"].values()):
+                messages += len(entries)
+                stored += sum(size for _, size in entries)
+            try:
+                resident += len(json.dumps(state, ensure_ascii=False).encode("utf-8"))
+            except RuntimeError:  # 其他线程正在修改该会话
+                pass
+        return {
+            "sessions": len(states),
+            "messages": messages,
+            "state_bytes": resident,
+            "stored_bytes": stored,
+        }
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_session_store():
+    """进程内单例，同时注册 /metrics 中的 session_state 指标"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = SessionStore()
+                tracing.register_gauge(
+                    "session_state",
+                    "会话状态：sessions 会话数、messages 消息数、state_bytes 常驻内存、stored_bytes 缓存中的正文",
+                    lambda: [({"kind": k}, v) for k, v in _store.report().items()],
+                )
+    return _store
@@ -0,0 +1,273 @@
+import os
+import json
+import time
+import array
+import asyncio
+import sqlite3
+import threading
+from typing import List
+from dotenv import load_dotenv
+from langchain_core.embeddings import Embeddings
+import tracing
+from cache_keys import hash_key
+
+load_dotenv()
+
+# 多个 Gradio 工作进程共享的本地缓存（SQLite，WAL 模式下支持多进程并发读写）
+SHARED_CACHE_PATH = os.getenv("SHARED_CACHE_PATH", "./cache/shared_cache.sqlite3")
+# 问答结果缓存时长（秒），0 表示不缓存回答
+ANSWER_CACHE_TTL = int(os.getenv("ANSWER_CACHE_TTL", "0"))
+# 查询向量缓存时长（秒），0 表示永不过期
+EMBEDDING_CACHE_TTL = int(os.getenv("EMBEDDING_CACHE_TTL", "0"))
+# 清理过期条目的最小间隔（秒）：写入时顺带检查，0 表示不自动清理
+CACHE_PURGE_INTERVAL = int(os.getenv("CACHE_PURGE_INTERVAL", "600"))
+
+
+class SharedCache:
+    """
+    基于 SQLite 的键值缓存，按命名空间区分，支持过期时间
+
+    每个线程持有自己的连接；多个进程打开同一个文件即可共享缓存。
+    """
+
+    def __init__(self, path=SHARED_CACHE_PATH, purge_interval=CACHE_PURGE_INTERVAL):
+        self.path = path
+        self.purge_interval = purge_interval
+        self._next_purge = time.monotonic() + purge_interval
+        self._purge_lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS kv ("
+            " namespace TEXT NOT NULL,"
+            " key TEXT NOT NULL,"
+            " value BLOB,"
+            " expires_at REAL,"
+            " PRIMARY KEY (namespace, key)"
+            ") WITHOUT ROWID"
+        )
+        conn.commit()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, namespace, key):
+        row = self._conn().execute(
+            "SELECT value, expires_at FROM kv WHERE namespace = ? AND key = ?",
+            (namespace, key),
+        ).fetchone()
+        if row is None:
+            return None
+        value, expires_at = row
+        if expires_at is not None and expires_at < time.time():
+            return None
+        return value
+
+    def get_many(self, namespace, keys):
+        """
+        一次查询取回多个键
+
+        返回:
+            dict: {键: 值}，不存在或已过期的键不在其中
+        """
+        keys = list(keys)
+        result = {}
+        now = time.time()
+        conn = self._conn()
+        # 每条语句的参数个数有上限（旧版 SQLite 为 999），分批查询
+        for start in range(0, len(keys), 500):
+            chunk = keys[start : start + 500]
+            rows = conn.execute(
+                "SELECT key, value, expires_at FROM kv WHERE namespace = ?"
+                f" AND key IN ({','.join('?' * len(chunk))})",
+                [namespace, *chunk],
+            ).fetchall()
+            for key, value, expires_at in rows:
+                if expires_at is None or expires_at >= now:
+                    result[key] = value
+        return result
+
+    def set(self, namespace, key, value, ttl=None):
+        expires_at = time.time() + ttl if ttl else None
+        conn = self._conn()
+        conn.execute(
+            "INSERT OR REPLACE INTO kv (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+            (namespace, key, value, expires_at),
+        )
+        conn.commit()
+        self._maybe_purge()
+
+    def _maybe_purge(self):
+        """距上次清理超过 purge_interval 时删除过期条目；同一时刻只有一个线程执行"""
+        if not self.purge_interval or time.monotonic() < self._next_purge:
+            return
+        if not self._purge_lock.acquire(blocking=False):
+            return
+        try:
+            self._next_purge = time.monotonic() + self.purge_interval
+            removed = self.purge_expired()
+            if removed:
+                print(f"共享缓存清理了 {removed} 条过期条目")
+        except sqlite3.Error as e:
+            print(f"清理过期缓存失败: {e}")
+        finally:
+            self._purge_lock.release()
+
+    def delete(self, namespace, key):
+        conn = self._conn()
+        conn.execute("DELETE FROM kv WHERE namespace = ? AND key = ?", (namespace, key))
+        conn.commit()
+
+    def delete_many(self, namespace, keys):
+        conn = self._conn()
+        conn.executemany(
+            "DELETE FROM kv WHERE namespace = ? AND key = ?", [(namespace, key) for key in keys]
+        )
+        conn.commit()
+
+    def touch(self, namespace, keys, ttl):
+        """把若干条目的过期时间顺延为从现在起 ttl 秒"""
+        expires_at = time.time() + ttl
+        conn = self._conn()
+        conn.executemany(
+            "UPDATE kv SET expires_at = ? WHERE namespace = ? AND key = ?",
+            [(expires_at, namespace, key) for key in keys],
+        )
+        conn.commit()
+
+    def get_json(self, namespace, key):
+        value = self.get(namespace, key)
+        return None if value is None else json.loads(value)
+
+    def get_many_json(self, namespace, keys):
+        return {key: json.loads(value) for key, value in self.get_many(namespace, keys).items()}
+
+    def set_json(self, namespace, key, obj, ttl=None):
+        self.set(namespace, key, json.dumps(obj, ensure_ascii=False), ttl)
+
+    def purge_expired(self):
+        """删除已过期的条目，返回删除条数"""
+        conn = self._conn()
+        cur = conn.execute(
+            "DELETE FROM kv WHERE expires_at IS NOT NULL AND expires_at < ?", (time.time(),)
+        )
+        conn.commit()
+        return cur.rowcount
+
+
+_shared_cache = None
+_shared_cache_lock = threading.Lock()
+
+
+def get_shared_cache():
+    """进程内单例"""
+    global _shared_cache
+    if _shared_cache is None:
+        with _shared_cache_lock:
+            if _shared_cache is None:
+                _shared_cache = SharedCache()
+    return _shared_cache
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    给任意 Embeddings 加一层共享缓存，向量以 float32 字节存储
+
+    参数:
+        base (Embeddings): 实际计算向量的实现
+        cache (SharedCache): 共享缓存
+        namespace (str): 缓存命名空间，不同模型应使用不同的命名空间
+        ttl (int): 过期时间（秒），0 表示不过期
+    """
+
+    def __init__(self, base, cache=None, namespace="embedding", ttl=EMBEDDING_CACHE_TTL):
+        self.base = base
+        self.cache = cache or get_shared_cache()
+        self.model_name = getattr(base, "model_name", type(base).__name__)
+        self.namespace = f"{namespace}:{self.model_name}"
+        self.ttl = ttl
+
+    def _lookup(self, text):
+        value = self.cache.get(self.namespace, hash_key(text))
+        if value is None:
+            return None
+        vec = array.array("f")
+        vec.frombytes(value)
+        return vec.tolist()
+
+    def _store(self, text, vector):
+        # 全零向量是接口出错时的占位结果，不缓存
+        if any(vector):
+            self.cache.set(
+                self.namespace, hash_key(text), array.array("f", vector).tobytes(), self.ttl
+            )
+
+    def embed_query(self, text: str) -> List[float]:
+        with tracing.span("embedding.cache") as span:
+            cached = self._lookup(text)
+            span.set_attribute("cache.hit", cached is not None)
+            if cached is not None:
+                return cached
+            vector = self.base.embed_query(text)
+            self._store(text, vector)
+            return vector
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        results = [self._lookup(t) for t in texts]
+        missing = [i for i, r in enumerate(results) if r is None]
+        if missing:
+            vectors = self.base.embed_documents([texts[i] for i in missing])
+            for i, vector in zip(missing, vectors):
+                results[i] = vector
+                self._store(texts[i], vector)
+        return results
+
+    def _store_many(self, texts, vectors):
+        for text, vector in zip(texts, vectors):
+            self._store(text, vector)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        # SQLite 在多进程写入时可能等待文件锁（最长 30 秒），查找和写入都放到线程中
+        with tracing.span("embedding.cache") as span:
+            cached = await asyncio.to_thread(self._lookup, text)
+            span.set_attribute("cache.hit", cached is not None)
+            if cached is not None:
+                return cached
+            vector = await self.base.aembed_query(text)
+            await asyncio.to_thread(self._store, text, vector)
+            return vector
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        results = await asyncio.to_thread(lambda: [self._lookup(t) for t in texts])
+        missing = [i for i, r in enumerate(results) if r is None]
+        if missing:
+            missing_texts = [texts[i] for i in missing]
+            vectors = await self.base.aembed_documents(missing_texts)
+            for i, vector in zip(missing, vectors):
+                results[i] = vector
+            await asyncio.to_thread(self._store_many, missing_texts, vectors)
+        return results
+
+
+class HistoryStore:
+    """各智能体的聊天记录，保存在共享缓存中，供所有工作进程读写"""
+
+    namespace = "history"
+
+    def __init__(self, cache=None):
+        self.cache = cache or get_shared_cache()
+
+    def load(self, bot_type):
+        return self.cache.get_json(self.namespace, bot_type)
+
+    def save(self, bot_type, messages):
+        self.cache.set_json(self.namespace, bot_type, messages)
@@ -0,0 +1,83 @@
+import threading
+import tracing
+from cache_keys import hash_key
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+        self.callers = 1
+
+
+class SingleFlight:
+    """
+    合并并发的相同请求：同一个键同时只执行一次，其余调用等待并共享结果
+
+    与缓存不同，结果不会保留，调用完成后下一次请求会重新执行。
+
+    参数:
+        name (str): 名称，用于追踪属性
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn, *args, **kwargs):
+        """
+        执行 fn(*args, **kwargs)，相同 key 的并发调用只执行一次
+
+        参数:
+            key (str): 请求键，通常为参数的哈希
+            fn (callable): 实际执行的函数
+
+        返回:
+            fn 的返回值；fn 抛出的异常会传给所有等待者
+        """
+        return self.do_shared(key, fn, *args, **kwargs)[0]
+
+    def do_shared(self, key, fn, *args, **kwargs):
+        """
+        与 do 相同，另外返回本调用方的序号和共享这次执行的调用方总数，用于分摊用量
+
+        返回:
+            tuple: (fn 的返回值, 序号, 调用方总数)，实际执行 fn 的调用方序号为 0
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                position = 0
+            else:
+                call.waiters += 1
+                position = call.waiters
+
+        if not leader:
+            tracing.set_attribute(f"singleflight.{self.name}", "shared")
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, position, call.callers
+
+        try:
+            call.result = fn(*args, **kwargs)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            # 键已移除，不会再有新的等待者
+            call.callers = call.waiters + 1
+            if call.waiters:
+                tracing.set_attribute(f"singleflight.{self.name}.waiters", call.waiters)
+            call.done.set()
+        return call.result, 0, call.callers
+
+    def key(self, *parts):
+        return hash_key(self.name, *parts)
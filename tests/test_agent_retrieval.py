@@ -0,0 +1,58 @@
+import os
+import sys
+import asyncio
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import agents
+import rag_store
+
+
+class _FakeStore:
+    def __init__(self):
+        self.calls = []
+
+    def similarity_search(self, query, k=4, **kwargs):
+        self.calls.append(("text", query))
+        return []
+
+    def similarity_search_by_vector(self, vector, k=4, **kwargs):
+        self.calls.append(("vector", vector))
+        return []
+
+
+class _FakeEmbeddings:
+    def __init__(self):
+        self.queries = []
+
+    def embed_query(self, text):
+        self.queries.append(text)
+        return [1.0, 0.0]
+
+    async def aembed_query(self, text):
+        self.queries.append(text)
+        return [1.0, 0.0]
+
+
+class AsyncRetrievalQueryTest(unittest.TestCase):
+    def test_async_path_embeds_the_same_query_as_sync_path(self):
+        embeddings = _FakeEmbeddings()
+        agent = agents.ConceptExplanationAgent()
+        retrieve = mock.Mock(return_value=("背景", agents.RetrievalResult()))
+        with mock.patch.object(rag_store, "vector_store_instance", _FakeStore()), \
+                mock.patch.object(rag_store, "embeddings_model_instance", embeddings), \
+                mock.patch.object(agents, "retrieval_client", None), \
+                mock.patch.object(agents.use_neo4j, "query_from_neo4j", return_value=["UML", "类图"]), \
+                mock.patch.object(agent, "_retrieve", retrieve), \
+                mock.patch.object(agent, "_generate", return_value=("回答", True)):
+            asyncio.run(agent._aprocess("什么是用例图"))
+        self.assertEqual(embeddings.queries, ["什么是用例图,UML,类图"])
+        retrieve.assert_called_once_with(
+            "什么是用例图,UML,类图", None, query_vector=[1.0, 0.0]
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
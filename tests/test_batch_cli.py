@@ -0,0 +1,81 @@
+import os
+import sys
+import json
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import batch_cli
+
+
+class BatchFilesTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def _write(self, name, text):
+        path = os.path.join(self.tmp.name, name)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text)
+        return path
+
+    def test_exercise_jobs_expand_by_count(self):
+        path = self._write(
+            "jobs.jsonl",
+            '{"id": "q1", "agent": "概念解释智能体", "input": "什么是软件危机？", "count": 3}\n'
+            "\n"
+            '{"id": "ex", "agent": "出题智能体", "chapter": "第三章：需求分析", "count": 3}\n'
+            '{"agent": "出题智能体"}\n',
+        )
+        jobs = batch_cli.load_jobs(path)
+        self.assertEqual([j["id"] for j in jobs], ["q1", "ex#1", "ex#2", "ex#3", "line4"])
+        self.assertEqual([j.get("variant") for j in jobs[1:4]], [1, 2, 3])
+        self.assertTrue(all(j["chapter"] == "第三章：需求分析" for j in jobs[1:4]))
+        self.assertNotIn("count", jobs[1])
+        # 非出题任务的 count 原样保留，不展开
+        self.assertEqual(jobs[0]["count"], 3)
+
+    def test_duplicate_ids_after_expansion_are_rejected(self):
+        path = self._write(
+            "jobs.jsonl",
+            '{"id": "ex", "agent": "出题智能体", "count": 2}\n'
+            '{"id": "ex#2", "agent": "出题智能体"}\n',
+        )
+        with self.assertRaises(ValueError):
+            batch_cli.load_jobs(path)
+
+    def test_missing_agent_is_rejected(self):
+        path = self._write("jobs.jsonl", '{"id": "q1", "input": "问题"}\n')
+        with self.assertRaises(ValueError):
+            batch_cli.load_jobs(path)
+
+    def test_checkpoint_keeps_only_successful_ids(self):
+        lines = [
+            json.dumps({"id": "a", "status": "ok"}),
+            json.dumps({"id": "b", "status": "error"}),
+            json.dumps({"id": "c", "status": "ok"}),
+            '{"id": "d", "sta',  # 上次中断时写了一半的行
+        ]
+        path = self._write("out.jsonl", "\n".join(lines))
+        self.assertEqual(batch_cli.load_checkpoint(path), {"a", "c"})
+
+    def test_missing_checkpoint_is_empty(self):
+        self.assertEqual(batch_cli.load_checkpoint(os.path.join(self.tmp.name, "none.jsonl")), set())
+
+
+class SplitExerciseTest(unittest.TestCase):
+    def test_split_sections(self):
+        result = "【题目】什么是耦合？\n【答案】模块间互连程度的度量\n【解析】见第五章"
+        self.assertEqual(
+            batch_cli.split_exercise(result),
+            {"question": "什么是耦合？", "answer": "模块间互连程度的度量", "explanation": "见第五章"},
+        )
+
+    def test_unformatted_result(self):
+        self.assertIsNone(batch_cli.split_exercise("抱歉，AI服务暂时不可用。"))
+        self.assertIsNone(batch_cli.split_exercise(None))
+
+
+if __name__ == "__main__":
+    unittest.main()
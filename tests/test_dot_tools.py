@@ -0,0 +1,92 @@
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import dot_tools
+from dot_tools import DotError, prepare
+
+
+def fix(code):
+    return prepare(code, font="TestFont")
+
+
+class PrepareTest(unittest.TestCase):
+    def test_valid_code_is_unchanged(self):
+        code = "digraph G { A -> B; B -> C; }"
+        fixed, graph, repairs = fix(code)
+        self.assertEqual(fixed, code)
+        self.assertEqual(repairs, [])
+        self.assertEqual(graph.nodes, {"A", "B", "C"})
+        self.assertEqual(graph.edges, 2)
+
+    def test_bom_is_whitespace(self):
+        _, graph, repairs = fix("\ufeffdigraph G { A -> B; }")
+        self.assertEqual(repairs, [])
+        self.assertTrue(graph.directed)
+
+    def test_unclosed_attribute_list(self):
+        fixed, graph, repairs = fix('digraph G {\n  A [label="开始"\n  A -> B;\n}')
+        self.assertIn('A [label="开始"]\n', fixed)
+        self.assertIn("第 3 行附近：补上缺少的 ']'", repairs)
+        self.assertEqual(graph.edges, 1)
+
+    def test_keywords_used_as_node_names_are_quoted(self):
+        fixed, graph, _ = fix("digraph G {\n  start -> node;\n  node -> end;\n}")
+        self.assertIn('start -> "node";', fixed)
+        self.assertIn('"node" -> end;', fixed)
+        self.assertEqual(graph.nodes, {"start", "node", "end"})
+
+    def test_unquoted_attribute_value(self):
+        fixed, _, repairs = fix("digraph G { A [label=处理(1)]; A -> B; }")
+        self.assertIn('A [label="处理(1)"]', fixed)
+        self.assertIn("第 1 行：属性值 处理(1) 加上引号", repairs)
+
+    def test_unescaped_quotes_in_string(self):
+        fixed, _, _ = fix('digraph G { A [label="他说"好"的"]; A -> B; }')
+        self.assertIn(r'A [label="他说\"好\"的"]', fixed)
+
+    def test_missing_closing_quote(self):
+        fixed, _, repairs = fix('digraph G {\n  A [label="未结束];\n  A -> B;\n}')
+        self.assertIn('A [label="未结束"];', fixed)
+        self.assertIn("第 2 行：补上缺少的结尾引号", repairs)
+
+    def test_missing_header_is_added(self):
+        fixed, graph, repairs = fix("A -> B;\nB -> C;")
+        self.assertTrue(fixed.startswith("digraph G {"))
+        self.assertEqual(repairs, ["开头：补上 digraph 声明"])
+        self.assertEqual(graph.edges, 2)
+
+    def test_edge_operators_follow_graph_type(self):
+        fixed, graph, _ = fix("graph G { A -> B; B -- C; }")
+        self.assertEqual(fixed, "digraph G { A -> B; B -> C; }")
+        self.assertTrue(graph.directed)
+
+    def test_braces_are_balanced(self):
+        self.assertEqual(fix("digraph G { A -> B;")[0], "digraph G { A -> B;\n}")
+        self.assertEqual(fix("digraph G { A -> B; }}")[0], "digraph G { A -> B; }")
+
+    def test_chinese_labels_get_font(self):
+        fixed, _, repairs = fix('digraph G { A [label="开始", fontname="SimSun"]; }')
+        self.assertIn('fontname="TestFont"', fixed)
+        self.assertNotIn("SimSun", fixed)
+        self.assertIn("设置中文字体", repairs)
+
+    def test_unrepairable_code_raises_with_line(self):
+        with self.assertRaises(DotError) as ctx:
+            fix("digraph G {\n  A -> ;\n}")
+        self.assertIn("第 2 行", str(ctx.exception))
+
+    def test_size_limits(self):
+        with mock.patch.object(dot_tools, "DOT_MAX_NODES", 2):
+            with self.assertRaises(DotError):
+                fix("digraph G { A -> B; B -> C; }")
+        with mock.patch.object(dot_tools, "DOT_MAX_CHARS", 10):
+            with self.assertRaises(DotError):
+                fix("digraph G { A -> B; }")
+
+
+if __name__ == "__main__":
+    unittest.main()
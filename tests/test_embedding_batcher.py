@@ -0,0 +1,61 @@
+import os
+import sys
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import tracing
+from embedding_batcher import MicroBatcher, _split_usage
+
+
+class SplitUsageTest(unittest.TestCase):
+    def test_shares_sum_to_total(self):
+        shares = _split_usage({"prompt_tokens": 10}, [1, 1, 1])
+        self.assertEqual([s["prompt_tokens"] for s in shares], [3, 3, 4])
+
+    def test_shares_follow_weights(self):
+        shares = _split_usage({"prompt_tokens": 12}, [1, 2])
+        self.assertEqual([s["prompt_tokens"] for s in shares], [4, 8])
+
+
+class MicroBatcherUsageTest(unittest.TestCase):
+    def test_usage_is_booked_on_caller_spans(self):
+        ended = []
+        listener = ended.append
+        tracing.register_span_listener(listener)
+        self.addCleanup(tracing._span_listeners.remove, listener)
+
+        def batch_fn(items):
+            tracing.record_usage({"prompt_tokens": 10 * len(items)})
+            return [item.upper() for item in items]
+
+        batcher = MicroBatcher(batch_fn, window=0.2, max_batch=2, name="test")
+        barrier = threading.Barrier(2)
+
+        def call(item):
+            with tracing.span("caller", who=item):
+                barrier.wait()
+                return batcher(item)
+
+        results = {}
+        threads = [
+            threading.Thread(target=lambda i=item: results.setdefault(i, call(i)))
+            for item in ("ab", "cd")
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results, {"ab": "AB", "cd": "CD"})
+        callers = [s for s in ended if s.name == "caller"]
+        self.assertEqual(sorted(s.attributes["prompt_tokens"] for s in callers), [10, 10])
+        self.assertEqual(sorted(s.attributes["batch.size"] for s in callers), [2, 2])
+        batch_spans = [s for s in ended if s.name == "test.batch"]
+        self.assertTrue(batch_spans)
+        self.assertNotIn("prompt_tokens", batch_spans[0].attributes)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,35 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import graph_cache
+from mock_backends import InMemoryGraph
+
+EDGES = [
+    ("软件工程", "包含", "需求分析"),
+    ("需求分析", "使用", None),
+    ("需求分析", "使用", "用例图"),
+]
+
+
+class RefreshSnapshotTest(unittest.TestCase):
+    def test_unnamed_endpoints_do_not_force_full_export(self):
+        graph = InMemoryGraph(edges=EDGES)
+        snapshot = graph_cache.export_snapshot(graph)
+        self.assertEqual(snapshot.edge_count, 2)
+        _, mode = graph_cache.refresh_snapshot(graph, snapshot)
+        self.assertEqual(mode, "unchanged")
+
+    def test_new_edges_are_fetched_incrementally(self):
+        graph = InMemoryGraph(edges=EDGES)
+        snapshot = graph_cache.export_snapshot(graph)
+        graph = InMemoryGraph(edges=EDGES + [(None, "属于", "UML"), ("类图", "属于", "UML")])
+        updated, mode = graph_cache.refresh_snapshot(graph, snapshot)
+        self.assertEqual(mode, "incremental")
+        self.assertEqual(updated.edge_count, 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,49 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import graph_cache
+from graph_expansion import GraphExpander, RemoteGraphSource
+from mock_backends import InMemoryGraph
+
+EDGES = [
+    ("软件测试", "包含", "单元测试"),
+    ("单元测试", "相关", "软件测试"),
+    ("软件测试", "包含", "集成测试"),
+    ("集成测试", "使用", None),
+    ("集成测试", "使用", None),
+    ("软件工程", "包含", "集成测试"),
+]
+
+
+class GraphExpanderTest(unittest.TestCase):
+    def test_weights_of_parallel_relations_are_summed(self):
+        source = RemoteGraphSource(InMemoryGraph(edges=EDGES))
+        expander = GraphExpander(rel_weights={"包含": 1.0, "相关": 0.5})
+        scores = expander.score(source, ["软件测试"])
+        # 单元测试：两条关系 1.0 + 0.5，度数 2；集成测试：一条关系，度数 2（无名端点不计）
+        self.assertAlmostEqual(scores["单元测试"], 1.5 / 2.0)
+        self.assertAlmostEqual(scores["集成测试"], 1.0 / 2.0)
+
+    def test_remote_degree_matches_snapshot(self):
+        graph = InMemoryGraph(edges=EDGES)
+        snapshot = graph_cache.export_snapshot(graph)
+        source = RemoteGraphSource(graph)
+        for name in ["软件测试", "单元测试", "集成测试", "软件工程"]:
+            self.assertEqual(source.degree(name), snapshot.degree(name), name)
+
+    def test_snapshot_and_remote_rank_the_same(self):
+        graph = InMemoryGraph()
+        snapshot = graph_cache.export_snapshot(graph)
+        expander = GraphExpander(max_hops=2)
+        remote = expander.expand(RemoteGraphSource(graph), ["需求分析"])
+        local = expander.expand(snapshot, ["需求分析"])
+        self.assertEqual([n for n, _ in remote], [n for n, _ in local])
+        for (_, a), (_, b) in zip(remote, local):
+            self.assertAlmostEqual(a, b)
+
+
+if __name__ == "__main__":
+    unittest.main()
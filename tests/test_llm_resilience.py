@@ -0,0 +1,148 @@
+import os
+import sys
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from unittest import mock
+
+from llm_resilience import (
+    CircuitBreaker,
+    CircuitOpenError,
+    NonRetryableError,
+    RetryableError,
+    retry_call,
+)
+
+
+class CircuitBreakerTest(unittest.TestCase):
+    def test_opens_after_threshold(self):
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+        breaker.record_failure()
+        self.assertEqual(breaker.state, "closed")
+        breaker.record_failure()
+        self.assertEqual(breaker.state, "open")
+        self.assertFalse(breaker.allow())
+
+    def test_half_open_allows_single_probe(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.01)
+        breaker.record_failure()
+        time.sleep(0.02)
+        self.assertEqual(breaker.state, "half_open")
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+
+    def test_probe_success_closes(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.01)
+        breaker.record_failure()
+        time.sleep(0.02)
+        self.assertTrue(breaker.allow())
+        breaker.record_success()
+        self.assertEqual(breaker.state, "closed")
+        self.assertTrue(breaker.allow())
+
+    def test_probe_failure_reopens_then_recovers(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.01)
+        breaker.record_failure()
+        time.sleep(0.02)
+        self.assertTrue(breaker.allow())
+        breaker.record_failure()
+        self.assertEqual(breaker.state, "open")
+        time.sleep(0.02)
+        self.assertTrue(breaker.allow())
+
+
+class PostChatTest(unittest.TestCase):
+    def test_client_error_ends_half_open_probe(self):
+        import client_hw
+
+        endpoint = client_hw._Endpoint("http://llm.invalid", None, "key")
+        endpoint.breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.01)
+        endpoint.breaker.record_failure()
+        time.sleep(0.02)
+        self.assertTrue(endpoint.breaker.allow())
+        response = mock.Mock(status_code=400)
+        with mock.patch.object(client_hw.requests, "post", return_value=response):
+            with self.assertRaises(NonRetryableError):
+                client_hw._post_chat(endpoint, "{}")
+        self.assertEqual(endpoint.breaker.state, "closed")
+        self.assertTrue(endpoint.breaker.allow())
+
+
+class CoalescedChatUsageTest(unittest.TestCase):
+    def test_each_caller_books_a_share_of_the_usage(self):
+        import threading
+        import tracing
+        import client_hw
+
+        ended = []
+        listener = ended.append
+        tracing.register_span_listener(listener)
+        self.addCleanup(tracing._span_listeners.remove, listener)
+        release = threading.Event()
+        response = mock.Mock(status_code=200)
+        response.json.return_value = {
+            "choices": [{"message": {"content": "回答"}}],
+            "usage": {"prompt_tokens": 10, "completion_tokens": 5},
+        }
+
+        def post(*args, **kwargs):
+            release.wait(5)
+            return response
+
+        results = []
+
+        def call():
+            with tracing.span("caller"):
+                results.append(client_hw.get_model_response("系统", "问题", call_site="test"))
+
+        with mock.patch.object(client_hw.requests, "post", side_effect=post) as post_mock:
+            threads = [threading.Thread(target=call) for _ in range(3)]
+            for thread in threads:
+                thread.start()
+            while True:
+                with client_hw._chat_flight._lock:
+                    calls = list(client_hw._chat_flight._calls.values())
+                if calls and calls[0].waiters == 2:
+                    break
+            release.set()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(post_mock.call_count, 1)
+        self.assertEqual(results, ["回答"] * 3)
+        chats = [s for s in ended if s.name == "llm.chat"]
+        self.assertEqual(len(chats), 3)
+        self.assertEqual(sorted(s.attributes["prompt_tokens"] for s in chats), [3, 3, 4])
+        self.assertEqual(sum(s.attributes["completion_tokens"] for s in chats), 5)
+        self.assertTrue(all(s.attributes.get("model") for s in chats))
+
+
+class RetryCallTest(unittest.TestCase):
+    def test_stops_retrying_when_breaker_opens(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=60)
+        calls = []
+
+        def fn():
+            calls.append(1)
+            breaker.record_failure()
+            raise RetryableError("HTTP 503")
+
+        with self.assertRaises(CircuitOpenError):
+            retry_call(fn, max_retries=3, base_delay=0, breaker=breaker)
+        self.assertEqual(len(calls), 1)
+
+    def test_retries_until_success(self):
+        results = iter([RetryableError("timeout"), "ok"])
+
+        def fn():
+            result = next(results)
+            if isinstance(result, Exception):
+                raise result
+            return result
+
+        self.assertEqual(retry_call(fn, max_retries=2, base_delay=0), "ok")
+
+
+if __name__ == "__main__":
+    unittest.main()
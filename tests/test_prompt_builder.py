@@ -0,0 +1,31 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import prompt_builder
+
+
+class BuildRagPromptTest(unittest.TestCase):
+    def test_terms_keep_relevance_order(self):
+        prompt = prompt_builder.build_rag_prompt(
+            "系统", "什么是栈？", "背景", related_terms=["栈", "队列", "数组", "栈"]
+        )
+        self.assertIn("相关知识点：栈、队列、数组", prompt.user)
+
+    def test_segments_in_stability_order(self):
+        prompt = prompt_builder.build_rag_prompt(
+            "系统", "问题", "背景", chapter="3", related_terms=["栈"]
+        )
+        names = [name for name, _ in prompt.segments]
+        self.assertEqual(names, ["instructions", "chapter", "context", "terms", "question"])
+
+    def test_empty_terms_and_all_chapters_are_dropped(self):
+        prompt = prompt_builder.build_rag_prompt("系统", "问题", "背景", chapter="全部章节")
+        names = [name for name, _ in prompt.segments]
+        self.assertEqual(names, ["instructions", "context", "question"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,86 @@
+import os
+import sys
+import subprocess
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import rag_store
+
+
+class _FakeStore:
+    def __init__(self):
+        self.calls = []
+
+    def similarity_search(self, query, k=4, **kwargs):
+        self.calls.append(("text", query))
+        return []
+
+    def similarity_search_by_vector(self, vector, k=4, **kwargs):
+        self.calls.append(("vector", vector))
+        return []
+
+
+class _FakeEmbeddings:
+    def __init__(self):
+        self.queries = []
+
+    def embed_query(self, text):
+        self.queries.append(text)
+        return [1.0, 0.0]
+
+    async def aembed_query(self, text):
+        self.queries.append(text)
+        return [1.0, 0.0]
+
+
+class _FakeChapterIndex:
+    def bias(self, vector, chapter):
+        return None if chapter == "9" else [0.0, 1.0]
+
+
+class SearchDocumentsTest(unittest.TestCase):
+    def setUp(self):
+        self.store = _FakeStore()
+        patches = [
+            mock.patch.object(rag_store, "vector_store_instance", self.store),
+            mock.patch.object(rag_store, "embeddings_model_instance", _FakeEmbeddings()),
+            mock.patch.object(rag_store, "_chapter_vectors_ready", True),
+            mock.patch.object(rag_store, "chapter_vector_index", None),
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+
+    def test_no_centroid_searches_prefixed_text_even_with_vector(self):
+        rag_store.search_documents("什么是用例图", selected_chapter="3", query_vector=[1.0, 0.0])
+        self.assertEqual(self.store.calls, [("text", "第3章 什么是用例图")])
+
+    def test_unknown_chapter_falls_back_to_prefixed_text(self):
+        with mock.patch.object(rag_store, "chapter_vector_index", _FakeChapterIndex()):
+            rag_store.search_documents("什么是用例图", selected_chapter="9", query_vector=[1.0, 0.0])
+        self.assertEqual(self.store.calls, [("text", "第9章 什么是用例图")])
+
+    def test_centroid_biases_the_given_vector(self):
+        with mock.patch.object(rag_store, "chapter_vector_index", _FakeChapterIndex()):
+            rag_store.search_documents("什么是用例图", selected_chapter="3", query_vector=[1.0, 0.0])
+        self.assertEqual(self.store.calls, [("vector", [0.0, 1.0])])
+
+    def test_all_chapters_uses_the_given_vector(self):
+        rag_store.search_documents("什么是用例图", selected_chapter="全部章节", query_vector=[1.0, 0.0])
+        self.assertEqual(self.store.calls, [("vector", [1.0, 0.0])])
+
+
+class RetrievalServiceImportTest(unittest.TestCase):
+    def test_service_does_not_import_agents(self):
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        code = "import sys, retrieval_service; print('agents' in sys.modules)"
+        out = subprocess.run(
+            [sys.executable, "-c", code], cwd=root, capture_output=True, text=True, check=True
+        )
+        self.assertEqual(out.stdout.strip().splitlines()[-1], "False")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,102 @@
+import os
+import sys
+import json
+import hashlib
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import rag_store
+import retrieval_eval
+from vector_index import NumpyVectorIndex, write_index
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURE_PATH = os.path.join(ROOT, "eval", "fixture_set.json")
+
+
+class _BigramEmbeddings:
+    """按汉字二元组哈希的词袋向量，文本重合越多相似度越高"""
+
+    model_name = "bigram-test"
+
+    def embed_query(self, text):
+        vec = np.zeros(512, dtype=np.float32)
+        for a, b in zip(text, text[1:]):
+            digest = hashlib.md5((a + b).encode("utf-8")).digest()
+            vec[int.from_bytes(digest[:4], "big") % 512] += 1.0
+        norm = np.linalg.norm(vec)
+        return (vec / norm if norm else vec).tolist()
+
+    def embed_documents(self, texts):
+        return [self.embed_query(t) for t in texts]
+
+
+class RetrievalEvalTest(unittest.TestCase):
+    def setUp(self):
+        with open(FIXTURE_PATH, "r", encoding="utf-8") as f:
+            self.fixture = json.load(f)
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        embeddings = _BigramEmbeddings()
+        chunks = self.fixture["chunks"]
+        texts = [c["text"] for c in chunks]
+        write_index(
+            self.tmp.name,
+            [str(i) for i in range(len(chunks))],
+            embeddings.embed_documents(texts),
+            texts,
+            [{"page": c["page"]} for c in chunks],
+        )
+        store = NumpyVectorIndex(self.tmp.name, embedding_function=embeddings)
+        patches = [
+            mock.patch.object(rag_store, "vector_store_instance", store),
+            mock.patch.object(rag_store, "embeddings_model_instance", embeddings),
+            mock.patch.object(rag_store, "chapter_vector_index", None),
+            mock.patch.object(rag_store, "_chapter_vectors_ready", True),
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+
+    def test_fixture_labels_point_at_chunks(self):
+        pages = {c["page"] for c in self.fixture["chunks"]}
+        for item in self.fixture["questions"]:
+            self.assertTrue(item["pages"], item["id"])
+            self.assertTrue(set(item["pages"]) <= pages, item["id"])
+
+    def test_run_on_labeled_fixture(self):
+        out = os.path.join(self.tmp.name, "results.json")
+        code = retrieval_eval.main(["run", "--golden", FIXTURE_PATH, "--k", "4", "--save", out])
+        self.assertEqual(code, 0)
+        with open(out, "r", encoding="utf-8") as f:
+            results = {r["config"]: r for r in json.load(f)["results"]}
+        self.assertEqual(set(results), set(retrieval_eval.CONFIGS))
+        for r in results.values():
+            self.assertEqual(r["questions"], len(self.fixture["questions"]))
+        self.assertGreaterEqual(results["current"]["recall"], 0.8)
+        self.assertGreater(results["current"]["mrr"], 0.5)
+
+    def test_current_uses_agent_retrieval_code(self):
+        item = self.fixture["questions"][3]
+        evaluator = retrieval_eval.Evaluator(k=4)
+        with mock.patch.object(
+            rag_store, "search_documents", wraps=rag_store.search_documents
+        ) as search:
+            evaluator.retrieve(item, retrieval_eval.CONFIGS["current"])
+        query = rag_store.build_retrieval_query(item["question"], item["terms"])
+        self.assertEqual(search.call_args.args[:3], (query, 4, item["chapter"]))
+
+    def test_unlabeled_golden_set_exits_with_error(self):
+        path = os.path.join(self.tmp.name, "golden.json")
+        retrieval_eval.save_golden_set(
+            {"version": 1, "questions": [{"id": "q", "question": "问题", "pages": []}]}, path
+        )
+        self.assertEqual(retrieval_eval.main(["run", "--golden", path]), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,79 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain_core.documents import Document
+
+import retrieval_result
+from retrieval_result import RetrievalResult, enrich_metadata
+
+
+def _doc(text, page=None, enrich=True):
+    metadata = {} if page is None else {"page": page}
+    if enrich:
+        metadata = enrich_metadata(text, metadata)
+    return Document(page_content=text, metadata=metadata)
+
+
+class EnrichMetadataTest(unittest.TestCase):
+    def test_display_text_and_chapter_tags(self):
+        metadata = enrich_metadata("第三章  需求分析\n与第十一章\n面向对象", {"page": 3})
+        self.assertEqual(metadata["page"], 3)
+        self.assertEqual(metadata["display_text"], "第三章 需求分析 与第十一章 面向对象")
+        self.assertEqual(metadata["chapters"], "3,11")
+
+    def test_original_metadata_is_not_modified(self):
+        original = {"page": 1}
+        enrich_metadata("第一章 软件工程学概述", original)
+        self.assertEqual(original, {"page": 1})
+
+
+class FilterChapterTest(unittest.TestCase):
+    def setUp(self):
+        self.result = RetrievalResult([
+            _doc("第一章 概述", 1),
+            _doc("第三章 需求分析", 30),
+            _doc("用例图 见第3章", 31),
+            _doc("无章节标记", 40),
+        ])
+
+    def test_keeps_tagged_chunks_in_order(self):
+        filtered = self.result.filter_chapter("第三章：需求分析", keep=8, fallback=2)
+        self.assertEqual([d.metadata["page"] for d in filtered], [30, 31])
+
+    def test_keep_limits_matches(self):
+        filtered = self.result.filter_chapter("3", keep=1, fallback=2)
+        self.assertEqual([d.metadata["page"] for d in filtered], [30])
+
+    def test_no_match_falls_back_to_top_results(self):
+        filtered = self.result.filter_chapter("第十三章", keep=8, fallback=2)
+        self.assertEqual([d.metadata["page"] for d in filtered], [1, 30])
+
+    def test_unknown_chapter_falls_back(self):
+        filtered = self.result.filter_chapter("附录", keep=8, fallback=3)
+        self.assertEqual(len(filtered), 3)
+
+
+class AppendixTest(unittest.TestCase):
+    def test_appendix_uses_display_text_and_pages(self):
+        result = RetrievalResult([_doc("第一行\n第二行", 5), _doc("没有页码")])
+        self.assertEqual(
+            result.appendix(),
+            "\n\n片段 1 (来自页码: 5):\n第一行 第二行"
+            "\n\n片段 2 (来自页码: 未知页码):\n没有页码",
+        )
+        self.assertEqual(result.context, "第一行\n第二行\n\n没有页码")
+
+    def test_missing_fields_are_computed_on_the_fly(self):
+        retrieval_result._missing_warned = True
+        doc = _doc("第二章\n可行性研究", 20, enrich=False)
+        result = RetrievalResult([doc]).filter_chapter("2")
+        self.assertEqual(len(result), 1)
+        self.assertEqual(doc.metadata["display_text"], "第二章 可行性研究")
+        self.assertEqual(doc.metadata["chapters"], "2")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,52 @@
+import os
+import sys
+import tempfile
+import argparse
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import serve
+
+
+class NginxConfTest(unittest.TestCase):
+    def test_sessions_are_pinned_by_cookie(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "conf", "nginx.conf")
+            serve.write_nginx_conf(path, [7861, 7862], 7860)
+            with open(path, "r", encoding="utf-8") as f:
+                conf = f.read()
+        self.assertIn("hash $sticky_key consistent;", conf)
+        self.assertNotIn("ip_hash", conf)
+        self.assertIn("server 127.0.0.1:7861;", conf)
+        self.assertIn("server 127.0.0.1:7862;", conf)
+        self.assertIn("listen 7860;", conf)
+        self.assertEqual(conf.count("{"), conf.count("}"))
+
+
+class StartWorkerTest(unittest.TestCase):
+    ARGS = argparse.Namespace(
+        host="127.0.0.1",
+        metrics_base_port=9464,
+        cache_path="./cache/shared.sqlite3",
+        answer_cache_ttl=None,
+        retrieval_port=None,
+    )
+
+    def _env(self, environ):
+        with mock.patch.dict(os.environ, environ, clear=True), \
+                mock.patch.object(serve.subprocess, "Popen") as popen:
+            serve.start_worker(0, 7861, self.ARGS)
+        return popen.call_args.kwargs["env"]
+
+    def test_workers_enable_embedding_batching(self):
+        self.assertEqual(self._env({})["EMBED_BATCH_WINDOW_MS"], "5")
+
+    def test_environment_overrides_batch_window(self):
+        env = self._env({"EMBED_BATCH_WINDOW_MS": "0"})
+        self.assertEqual(env["EMBED_BATCH_WINDOW_MS"], "0")
+
+
+if __name__ == "__main__":
+    unittest.main()
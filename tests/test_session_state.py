@@ -0,0 +1,37 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from shared_cache import SharedCache
+from session_state import SessionStore
+
+
+class SessionStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cache = SharedCache(os.path.join(self.tmp.name, "cache.sqlite3"))
+        self.store = SessionStore(cache=self.cache)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_get_many_skips_missing_and_expired(self):
+        self.cache.set("ns", "a", "1")
+        self.cache.set("ns", "b", "2", ttl=-1)
+        self.assertEqual(self.cache.get_many("ns", ["a", "b", "c"]), {"a": "1"})
+
+    def test_messages_keep_order_and_drop_expired_ids(self):
+        state = self.store.ensure({})
+        for i in range(3):
+            self.store.append(state, "bot", "user", f"q{i}")
+        self.cache.delete(SessionStore.namespace, f"{state['sid']}:1")
+        messages = self.store.messages(state, "bot")
+        self.assertEqual([m["content"] for m in messages], ["q0", "q2"])
+        self.assertEqual([entry[0] for entry in state["threads"]["bot"]], [0, 2])
+
+
+if __name__ == "__main__":
+    unittest.main()
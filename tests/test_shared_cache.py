@@ -0,0 +1,93 @@
+import os
+import sys
+import asyncio
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from shared_cache import CachedEmbeddings, HistoryStore, SharedCache
+
+
+class _CountingEmbeddings:
+    model_name = "counting"
+
+    def __init__(self):
+        self.calls = []
+
+    def embed_query(self, text):
+        self.calls.append(text)
+        return [0.0, 0.0] if text == "失败" else [float(len(text)), 1.0]
+
+    def embed_documents(self, texts):
+        return [self.embed_query(t) for t in texts]
+
+    async def aembed_query(self, text):
+        return self.embed_query(text)
+
+    async def aembed_documents(self, texts):
+        return self.embed_documents(texts)
+
+
+class SharedCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.path = os.path.join(self.tmp.name, "cache.sqlite3")
+
+    def test_ttl_and_namespaces(self):
+        cache = SharedCache(self.path, purge_interval=0)
+        cache.set("a", "k", "1")
+        cache.set("b", "k", "2", ttl=-1)
+        self.assertEqual(cache.get("a", "k"), "1")
+        self.assertIsNone(cache.get("b", "k"))
+        cache.set_json("a", "j", {"x": [1, "二"]})
+        self.assertEqual(cache.get_json("a", "j"), {"x": [1, "二"]})
+
+    def test_set_purges_expired_rows_after_interval(self):
+        cache = SharedCache(self.path, purge_interval=3600)
+        cache.set("a", "old", "1", ttl=-1)
+        cache.set("a", "new", "2")
+        count = lambda: cache._conn().execute("SELECT COUNT(*) FROM kv").fetchone()[0]
+        self.assertEqual(count(), 2)  # 未到清理间隔
+        cache._next_purge = 0
+        cache.set("a", "newer", "3")
+        self.assertEqual(count(), 2)
+
+    def test_shared_between_instances(self):
+        SharedCache(self.path).set("a", "k", "1")
+        self.assertEqual(SharedCache(self.path).get("a", "k"), "1")
+        store = HistoryStore(SharedCache(self.path))
+        store.save("bot", [{"role": "user", "content": "你好"}])
+        self.assertEqual(HistoryStore(SharedCache(self.path)).load("bot")[0]["content"], "你好")
+
+
+class CachedEmbeddingsTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.base = _CountingEmbeddings()
+        self.embeddings = CachedEmbeddings(
+            self.base, cache=SharedCache(os.path.join(self.tmp.name, "cache.sqlite3"))
+        )
+
+    def test_query_is_cached(self):
+        self.assertEqual(self.embeddings.embed_query("耦合"), [2.0, 1.0])
+        self.assertEqual(self.embeddings.embed_query("耦合"), [2.0, 1.0])
+        self.assertEqual(asyncio.run(self.embeddings.aembed_query("耦合")), [2.0, 1.0])
+        self.assertEqual(self.base.calls, ["耦合"])
+
+    def test_zero_placeholder_is_not_cached(self):
+        self.embeddings.embed_query("失败")
+        self.embeddings.embed_query("失败")
+        self.assertEqual(self.base.calls, ["失败", "失败"])
+
+    def test_documents_only_embed_missing(self):
+        self.embeddings.embed_query("a")
+        result = asyncio.run(self.embeddings.aembed_documents(["a", "bb"]))
+        self.assertEqual(result, [[1.0, 1.0], [2.0, 1.0]])
+        self.assertEqual(self.base.calls, ["a", "bb"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,106 @@
+import os
+import sys
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from singleflight import SingleFlight
+
+
+class SingleFlightTest(unittest.TestCase):
+    def _run_concurrently(self, flight, key, fn, callers=4):
+        results, errors = [], []
+        started = threading.Barrier(callers)
+
+        def call():
+            started.wait()
+            try:
+                results.append(flight.do(key, fn))
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=call) for _ in range(callers)]
+        for thread in threads:
+            thread.start()
+        return threads, results, errors
+
+    def test_concurrent_calls_share_one_execution(self):
+        flight = SingleFlight("test")
+        release = threading.Event()
+        calls = []
+
+        def fn():
+            calls.append(1)
+            release.wait(5)
+            return "结果"
+
+        threads, results, errors = self._run_concurrently(flight, flight.key("q"), fn)
+        # 等所有调用方都挂到同一个请求上再放行
+        while True:
+            with flight._lock:
+                call = flight._calls.get(flight.key("q"))
+                if call is not None and call.waiters == 3:
+                    break
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(calls, [1])
+        self.assertEqual(results, ["结果"] * 4)
+        self.assertEqual(errors, [])
+
+    def test_error_reaches_all_waiters_and_next_call_reruns(self):
+        flight = SingleFlight("test")
+        release = threading.Event()
+
+        def fail():
+            release.wait(5)
+            raise RuntimeError("接口出错")
+
+        threads, results, errors = self._run_concurrently(flight, "k", fail, callers=3)
+        while True:
+            with flight._lock:
+                call = flight._calls.get("k")
+                if call is not None and call.waiters == 2:
+                    break
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(errors), 3)
+        self.assertEqual(flight.do("k", lambda: "重试成功"), "重试成功")
+
+    def test_do_shared_reports_position_and_callers(self):
+        flight = SingleFlight("test")
+        release = threading.Event()
+        shared = []
+
+        def fn():
+            release.wait(5)
+            return "结果"
+
+        def call():
+            shared.append(flight.do_shared("k", fn))
+
+        threads = [threading.Thread(target=call) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        while True:
+            with flight._lock:
+                call_state = flight._calls.get("k")
+                if call_state is not None and call_state.waiters == 2:
+                    break
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sorted(position for _, position, _ in shared), [0, 1, 2])
+        self.assertEqual({(result, callers) for result, _, callers in shared}, {("结果", 3)})
+        self.assertEqual(flight.do_shared("k", lambda: "单独"), ("单独", 0, 1))
+
+    def test_keys_depend_on_name_and_parts(self):
+        self.assertEqual(SingleFlight("a").key("x", 1), SingleFlight("a").key("x", 1))
+        self.assertNotEqual(SingleFlight("a").key("x"), SingleFlight("b").key("x"))
+        self.assertNotEqual(SingleFlight("a").key("ab", "c"), SingleFlight("a").key("a", "bc"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,59 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from upload_pipeline import split_exercises
+
+
+def split(text, **kwargs):
+    return list(split_exercises([(0, text)], **kwargs))
+
+
+class SplitExercisesTest(unittest.TestCase):
+    def test_numbered_exercises_drop_preamble(self):
+        text = "软件工程期末复习题\n说明：共三题\n1. 什么是软件危机？\n2、瀑布模型的缺点\n第3题 解释耦合"
+        self.assertEqual(
+            split(text),
+            ["1. 什么是软件危机？", "2、瀑布模型的缺点", "第3题 解释耦合"],
+        )
+
+    def test_out_of_sequence_numbers_stay_in_the_exercise(self):
+        text = "1. 下列说法正确的是\n(1) 需求分析\n5. 版本的说明\n2. 第二题"
+        self.assertEqual(
+            split(text),
+            ["1. 下列说法正确的是\n(1) 需求分析\n5. 版本的说明", "2. 第二题"],
+        )
+
+    def test_section_headings_separate_and_restart_numbering(self):
+        text = "一、选择题\n1. 甲\n2. 乙\n二、简答题\n1. 丙"
+        self.assertEqual(split(text), ["1. 甲", "2. 乙", "1. 丙"])
+
+    def test_exercises_span_pages(self):
+        pages = [(0, "1. 第一题开头"), (1, "第一题结尾\n2. 第二题")]
+        self.assertEqual(list(split_exercises(pages)), ["1. 第一题开头\n第一题结尾", "2. 第二题"])
+
+    def test_decimal_numbers_are_not_exercise_numbers(self):
+        self.assertEqual(split("1. 题目\n2.5 倍的工作量"), ["1. 题目\n2.5 倍的工作量"])
+
+    def test_max_exercises(self):
+        text = "\n".join(f"{i}. 题{i}" for i in range(1, 10))
+        self.assertEqual(split(text, max_exercises=3), ["1. 题1", "2. 题2", "3. 题3"])
+
+    def test_long_exercise_is_truncated(self):
+        (text,) = split("1. " + "很长" * 50, max_chars=20)
+        self.assertTrue(text.startswith("1. 很长"))
+        self.assertTrue(text.endswith("……（题目过长，已截断）"))
+        self.assertEqual(len(text), 20 + len("……（题目过长，已截断）"))
+
+    def test_unnumbered_text_is_chunked_by_length(self):
+        text = "\n".join(["甲" * 8, "乙" * 8, "丙" * 8])
+        self.assertEqual(split(text, max_chars=20), ["甲" * 8 + "\n" + "乙" * 8, "丙" * 8])
+
+    def test_empty_input(self):
+        self.assertEqual(split(""), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,26 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from usage_ledger import UsageLedger
+
+
+class UsageLedgerTest(unittest.TestCase):
+    def test_records_are_written_in_background(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            ledger = UsageLedger(path=os.path.join(tmp, "usage.sqlite3"), refresh=60)
+            self.assertEqual(ledger.tokens("alice"), 0)
+            for _ in range(3):
+                ledger.record("chat", "m", 10, 5, user="alice")
+            # 汇总缓存中立即可见，不必等写入
+            self.assertEqual(ledger.tokens("alice"), 45)
+            ledger.flush()
+            rows = ledger.summary(group_by=("user",))
+            self.assertEqual([(r["user"], r["calls"], r["prompt"]) for r in rows], [("alice", 3, 30)])
+
+
+if __name__ == "__main__":
+    unittest.main()
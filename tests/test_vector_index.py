@@ -0,0 +1,77 @@
+import os
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from vector_index import NumpyVectorIndex, write_index
+
+
+def _fixture(count=200, dim=64, seed=0):
+    rng = np.random.default_rng(seed)
+    query = rng.normal(size=dim).astype(np.float32)
+    # 与查询的相似度由噪声大小决定，彼此拉开距离，量化误差不足以改变排序
+    noise = np.linspace(0.2, 8.0, count)[:, None] * rng.normal(size=(count, dim))
+    vectors = query + noise.astype(np.float32)
+    order = rng.permutation(count)
+    return query, vectors[order]
+
+
+class NumpyVectorIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def _write(self, name, vectors, quantize):
+        path = os.path.join(self.tmp.name, name)
+        count = len(vectors)
+        write_index(
+            path,
+            [str(i) for i in range(count)],
+            vectors,
+            [f"分块 {i}" for i in range(count)],
+            [{"page": i} for i in range(count)],
+            quantize=quantize,
+        )
+        return NumpyVectorIndex(path)
+
+    def test_int8_top_k_matches_float32(self):
+        query, vectors = _fixture()
+        exact = self._write("f32", vectors, quantize=False)
+        quantized = self._write("i8", vectors, quantize=True)
+        top_exact = [i for i, _ in exact.search_by_vector(query, k=10)]
+        top_quantized = [i for i, _ in quantized.search_by_vector(query, k=10)]
+        self.assertEqual(top_quantized, top_exact)
+        np.testing.assert_allclose(quantized.scores(query), exact.scores(query), atol=0.01)
+
+    def test_int8_scores_span_multiple_blocks(self):
+        query, vectors = _fixture(count=50)
+        exact = self._write("f32", vectors, quantize=False)
+        quantized = self._write("i8", vectors, quantize=True)
+        import vector_index
+
+        block_rows = vector_index.SEARCH_BLOCK_ROWS
+        vector_index.SEARCH_BLOCK_ROWS = 7
+        try:
+            blocked = quantized.scores(query)
+        finally:
+            vector_index.SEARCH_BLOCK_ROWS = block_rows
+        np.testing.assert_allclose(blocked, exact.scores(query), atol=0.01)
+
+    def test_filter_and_documents(self):
+        query, vectors = _fixture(count=20)
+        index = self._write("f32", vectors, quantize=False)
+        docs = index.similarity_search_by_vector(query, k=3, filter={"page": 5})
+        self.assertEqual([d.metadata["page"] for d in docs], [5])
+        self.assertIn("display_text", docs[0].metadata)
+
+    def test_empty_input_is_rejected(self):
+        with self.assertRaises(ValueError):
+            write_index(os.path.join(self.tmp.name, "empty"), [], [], [], [])
+
+
+if __name__ == "__main__":
+    unittest.main()
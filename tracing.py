@@ -0,0 +1,367 @@
+import os
+import json
+import time
+import uuid
+import threading
+import contextvars
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# span 导出文件（每行一条 OTLP/JSON 的 resourceSpans 记录），置空则不导出
+TRACE_EXPORT_FILE = os.getenv("TRACE_EXPORT_FILE", "./traces/spans.jsonl")
+# /metrics 端口
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9464"))
+SERVICE_NAME = os.getenv("TRACE_SERVICE_NAME", "softeng-assistant")
+
+# 直方图桶（秒），覆盖从缓存命中到长回答生成的范围
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    """一次阶段调用的记录：名称、所属请求、起止时间、属性与错误类型"""
+
+    def __init__(self, name, trace_id, parent=None, attributes=None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent = parent
+        self.parent_id = parent.span_id if parent else None
+        self.attributes = dict(attributes or {})
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.error_kind = None
+        # 根 span 负责收集整条请求的 span，结束时一次性导出
+        self.children = [] if parent is None else None
+
+    @property
+    def request_id(self):
+        return self.trace_id
+
+    @property
+    def duration(self):
+        end_ns = self.end_ns if self.end_ns is not None else time.time_ns()
+        return (end_ns - self.start_ns) / 1e9
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def root(self):
+        span = self
+        while span.parent is not None:
+            span = span.parent
+        return span
+
+
+class Histogram:
+    """累积型直方图，输出 Prometheus 文本格式"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+
+_lock = threading.Lock()
+_histograms = {}  # stage -> Histogram
+_counters = {}  # (metric, labels) -> value
+_export_lock = threading.Lock()
+_gauges = {}  # metric -> (说明, 返回 [(labels dict, value), ...] 的函数)
+_span_listeners = []  # 每个 span 结束时调用的函数，如 usage_ledger 记录 token 用量
+
+
+def _inc(metric, labels, value=1):
+    key = (metric, tuple(sorted(labels.items())))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def _observe(span):
+    with _lock:
+        hist = _histograms.get(span.name)
+        if hist is None:
+            hist = _histograms[span.name] = Histogram()
+        hist.observe(span.duration)
+    if span.error_kind:
+        _inc("stage_errors_total", {"stage": span.name, "error_kind": span.error_kind})
+    for kind in ("prompt_tokens", "completion_tokens", "cached_tokens"):
+        value = span.attributes.get(kind)
+        if value:
+            labels = {"stage": span.name, "kind": kind}
+            if "call_site" in span.attributes:
+                labels["call_site"] = span.attributes["call_site"]
+            _inc("tokens_total", labels, value)
+    if "cache.hit" in span.attributes:
+        result = "hit" if span.attributes["cache.hit"] else "miss"
+        _inc("cache_requests_total", {"stage": span.name, "result": result})
+    for listener in _span_listeners:
+        try:
+            listener(span)
+        except Exception as e:
+            print(f"span 监听函数出错: {e}")
+
+
+def current_span():
+    return _current_span.get()
+
+
+def current_request_id():
+    span = _current_span.get()
+    return span.trace_id if span else None
+
+
+def set_attribute(key, value):
+    """给当前 span 设置属性（没有活动 span 时忽略）"""
+    span = _current_span.get()
+    if span is not None:
+        span.set_attribute(key, value)
+
+
+def record_error(kind):
+    """标记当前 span 出错（用于被捕获后降级处理、不会向外抛出的错误）"""
+    span = _current_span.get()
+    if span is not None:
+        span.error_kind = kind
+
+
+def record_usage(usage, share=None):
+    """
+    把 OpenAI 兼容接口返回的 usage 块记到当前 span 上
+
+    参数:
+        usage (dict): 接口返回的 usage
+        share (tuple): 可选，(序号, 份数)。多个调用方共享一次请求时各记平均的一份，
+            余数记在序号 0 上，各份合计等于实际用量
+    """
+    if not usage:
+        return
+    details = usage.get("prompt_tokens_details") or {}
+    values = {
+        "prompt_tokens": usage.get("prompt_tokens", 0),
+        "completion_tokens": usage.get("completion_tokens", 0),
+        "cached_tokens": details.get("cached_tokens", usage.get("prompt_cache_hit_tokens", 0)),
+    }
+    if share is not None:
+        index, parts = share
+        values = {
+            key: value // parts + (value % parts if index == 0 else 0)
+            for key, value in values.items()
+        }
+    set_attribute("prompt_tokens", values["prompt_tokens"])
+    set_attribute("completion_tokens", values["completion_tokens"])
+    if values["cached_tokens"]:
+        set_attribute("cached_tokens", values["cached_tokens"])
+
+
+@contextmanager
+def span(name, **attributes):
+    """
+    记录一个阶段的 span；没有外层 span 时自动开启新的请求
+
+    参数:
+        name (str): 阶段名，如 'neo4j.extract'、'chroma.search'
+        **attributes: 附加属性
+
+    用法:
+        with tracing.span("llm.generate", agent=self.name) as s:
+            ...
+            s.set_attribute("prompt_tokens", 120)
+    """
+    parent = _current_span.get()
+    trace_id = parent.trace_id if parent else uuid.uuid4().hex
+    current = Span(name, trace_id, parent, attributes)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.error_kind = type(e).__name__
+        raise
+    finally:
+        current.end_ns = time.time_ns()
+        _current_span.reset(token)
+        _observe(current)
+        root = current.root()
+        if root is not current:
+            root.children.append(current)
+        else:
+            _export(current)
+
+
+def _to_otlp(s):
+    attributes = [
+        {"key": k, "value": _otlp_value(v)} for k, v in s.attributes.items()
+    ]
+    attributes.append({"key": "request.id", "value": {"stringValue": s.trace_id}})
+    if s.error_kind:
+        attributes.append({"key": "error.type", "value": {"stringValue": s.error_kind}})
+    return {
+        "traceId": s.trace_id,
+        "spanId": s.span_id,
+        "parentSpanId": s.parent_id or "",
+        "name": s.name,
+        "kind": 1,  # SPAN_KIND_INTERNAL
+        "startTimeUnixNano": str(s.start_ns),
+        "endTimeUnixNano": str(s.end_ns),
+        "attributes": attributes,
+        "status": {"code": 2 if s.error_kind else 1},
+    }
+
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _export(root):
+    """以 OTLP/JSON 格式把整条请求的 span 追加写入导出文件"""
+    if not TRACE_EXPORT_FILE:
+        return
+    record = {
+        "resourceSpans": [
+            {
+                "resource": {
+                    "attributes": [
+                        {"key": "service.name", "value": {"stringValue": SERVICE_NAME}}
+                    ]
+                },
+                "scopeSpans": [
+                    {
+                        "scope": {"name": "tracing"},
+                        "spans": [_to_otlp(s) for s in [root] + root.children],
+                    }
+                ],
+            }
+        ]
+    }
+    try:
+        with _export_lock:
+            export_dir = os.path.dirname(TRACE_EXPORT_FILE)
+            if export_dir:
+                os.makedirs(export_dir, exist_ok=True)
+            with open(TRACE_EXPORT_FILE, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    except OSError as e:
+        print(f"写入 span 导出文件失败: {e}")
+
+
+def register_gauge(metric, help_text, fn):
+    """注册在 /metrics 中输出的 gauge，fn 在每次抓取时调用，返回 [(labels dict, value), ...]"""
+    with _lock:
+        _gauges[metric] = (help_text, fn)
+
+
+def register_span_listener(fn):
+    """注册 span 结束时调用的函数 fn(span)，在结束该 span 的线程中同步调用"""
+    with _lock:
+        if fn not in _span_listeners:
+            _span_listeners.append(fn)
+
+
+def _format_labels(labels):
+    return ",".join(f'{k}="{v}"' for k, v in labels)
+
+
+def render_metrics():
+    """生成 Prometheus 文本格式的指标"""
+    lines = [
+        "# HELP stage_duration_seconds 各阶段耗时",
+        "# TYPE stage_duration_seconds histogram",
+    ]
+    with _lock:
+        for stage, hist in sorted(_histograms.items()):
+            for bound, count in zip(hist.buckets, hist.counts):
+                lines.append(
+                    f'stage_duration_seconds_bucket{{stage="{stage}",le="{bound}"}} {count}'
+                )
+            lines.append(
+                f'stage_duration_seconds_bucket{{stage="{stage}",le="+Inf"}} {hist.count}'
+            )
+            lines.append(f'stage_duration_seconds_sum{{stage="{stage}"}} {hist.sum}')
+            lines.append(f'stage_duration_seconds_count{{stage="{stage}"}} {hist.count}')
+        seen = set()
+        for (metric, labels), value in sorted(_counters.items()):
+            if metric not in seen:
+                lines.append(f"# TYPE {metric} counter")
+                seen.add(metric)
+            lines.append(f"{metric}{{{_format_labels(labels)}}} {value}")
+        ratios = _prefix_cache_ratios()
+        gauges = sorted(_gauges.items())
+    for metric, (help_text, fn) in gauges:
+        lines.append(f"# HELP {metric} {help_text}")
+        lines.append(f"# TYPE {metric} gauge")
+        for labels, value in fn():
+            lines.append(f"{metric}{{{_format_labels(sorted(labels.items()))}}} {value}")
+    if ratios:
+        lines.append("# HELP prompt_cache_hit_ratio 上游前缀缓存命中的 prompt token 比例")
+        lines.append("# TYPE prompt_cache_hit_ratio gauge")
+        for labels, ratio in ratios:
+            lines.append(f"prompt_cache_hit_ratio{{{_format_labels(labels)}}} {ratio:.4f}")
+    return "\n".join(lines) + "\n"
+
+
+def _prefix_cache_ratios():
+    """按 call_site 计算 cached_tokens / prompt_tokens（调用方持有 _lock）"""
+    totals = {}
+    for (metric, labels), value in _counters.items():
+        if metric != "tokens_total":
+            continue
+        d = dict(labels)
+        key = tuple((k, v) for k, v in labels if k != "kind")
+        entry = totals.setdefault(key, [0, 0])
+        if d["kind"] == "prompt_tokens":
+            entry[0] += value
+        elif d["kind"] == "cached_tokens":
+            entry[1] += value
+    return [(key, cached / prompt) for key, (prompt, cached) in sorted(totals.items()) if prompt]
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render_metrics().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_metrics_server = None
+
+
+def start_metrics_server(port=None, host="127.0.0.1"):
+    """在后台线程启动本地 /metrics 服务，重复调用只启动一次"""
+    global _metrics_server
+    if _metrics_server is not None:
+        return _metrics_server
+    port = METRICS_PORT if port is None else port
+    try:
+        _metrics_server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    except OSError as e:
+        print(f"启动 /metrics 服务失败（端口 {port}）: {e}")
+        return None
+    threading.Thread(target=_metrics_server.serve_forever, daemon=True).start()
+    print(f"指标服务已启动: http://{host}:{port}/metrics")
+    return _metrics_server
@@ -0,0 +1,118 @@
+# 上传习题的处理流程：逐页解析文件，按题号切分出单独的题目，
+# 以有限并发逐题调用智能体，每答完一题就把结果推送到聊天窗口。
+import os
+import re
+import asyncio
+import tracing
+import usage_ledger
+
+UPLOAD_MAX_EXERCISES = int(os.getenv("UPLOAD_MAX_EXERCISES", "20"))
+UPLOAD_MAX_EXERCISE_CHARS = int(os.getenv("UPLOAD_MAX_EXERCISE_CHARS", "1500"))
+UPLOAD_CONCURRENCY = int(os.getenv("UPLOAD_CONCURRENCY", "3"))
+
+# 行首的题号：“1.”“1、”“1．”“1)”“第1题”；“(1)”一类的小问留在题目内部
+_NUMBER_RE = re.compile(r"^\s*(?:第\s*(\d{1,3})\s*题|(\d{1,3})\s*[.、．)）](?!\d))")
+# 大题标题，如“一、选择题”，作为题目之间的分界，本身不算题目
+_SECTION_RE = re.compile(r"^\s*[一二三四五六七八九十]{1,3}\s*[、.．]")
+
+
+def _number(line):
+    match = _NUMBER_RE.match(line)
+    if match is None:
+        return None
+    return int(match.group(1) or match.group(2))
+
+
+def split_exercises(pages, max_exercises=UPLOAD_MAX_EXERCISES, max_chars=UPLOAD_MAX_EXERCISE_CHARS):
+    """
+    从逐页文本中切分出单独的题目
+
+    只有题号是上一题加一（或重新从 1 开始）时才认为是新题，避免把正文里的
+    “2. 版本”之类误判为题号。第一道带题号的题目之前的标题、说明文字不作为题目；
+    整份文件没有题号时按段落合并成不超过 max_chars 的块。单题超长时截断。
+
+    参数:
+        pages (iterable): (页码, 文本) 序列，可以是 file_parser.iter_pages 的生成器
+
+    返回:
+        generator: 逐题产出题目文本，最多 max_exercises 题
+    """
+    current = []
+    size = 0
+    last_number = None
+    count = 0
+
+    def flush():
+        text = "\n".join(current).strip()
+        if len(text) > max_chars:
+            text = text[:max_chars] + "……（题目过长，已截断）"
+        return text
+
+    for _, page_text in pages:
+        for line in page_text.splitlines():
+            number = _number(line)
+            section = number is None and last_number is not None and _SECTION_RE.match(line) is not None
+            if last_number is None:
+                starts = number is not None
+                if starts:
+                    # 丢弃题号之前的说明文字
+                    current, size = [], 0
+            else:
+                starts = number is not None and number in (last_number + 1, 1)
+            # 还没有出现题号时按长度切块
+            chunk = last_number is None and bool(current) and size + len(line) > max_chars
+            if (starts or section or chunk) and current:
+                text = flush()
+                current, size = [], 0
+                if text:
+                    yield text
+                    count += 1
+                    if count >= max_exercises:
+                        return
+            if starts:
+                last_number = number
+            if section:
+                continue
+            if size <= max_chars:
+                current.append(line)
+                size += len(line) + 1
+    if current:
+        text = flush()
+        if text:
+            yield text
+
+
+async def answer_exercises(agent, exercises, concurrency=UPLOAD_CONCURRENCY, user=None):
+    """
+    以有限并发逐题调用 agent.aprocess
+
+    参数:
+        agent: 智能体
+        exercises (list): 题目文本
+        concurrency (int): 同时处理的题数
+        user (str): 用量记到该用户名下；每题开始前检查预算，用完后其余题目直接返回提示
+
+    返回:
+        async generator: 按完成顺序产出 (题目下标, 回答)
+    """
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def answer(index, exercise):
+        async with semaphore:
+            with tracing.span("upload.exercise", index=index, chars=len(exercise)):
+                with usage_ledger.budget(user) as level:
+                    if level == usage_ledger.EXHAUSTED:
+                        return index, usage_ledger.EXHAUSTED_MESSAGE
+                    try:
+                        return index, await agent.aprocess(exercise)
+                    except Exception as e:
+                        return index, f"发生错误：{str(e)}"
+
+    tasks = [asyncio.ensure_future(answer(i, text)) for i, text in enumerate(exercises)]
+    try:
+        for finished in asyncio.as_completed(tasks):
+            yield await finished
+    finally:
+        # 客户端断开时取消尚未完成的题目
+        for task in tasks:
+            task.cancel()
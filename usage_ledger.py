@@ -0,0 +1,473 @@
+# 用量账本：记录每次大模型和嵌入调用的 prompt/completion/cached token 数与耗时，
+# 按用户、智能体、调用点、模型、请求标记，保存在与共享缓存相同的 SQLite 文件中，
+# 多个工作进程共同累计。
+#
+# 记录来源是 tracing 的 span：带有 prompt_tokens 的 span（llm.chat、embedding.*）结束时记一行，
+# 调用点取 span 的 call_site（extraction、各智能体、flowchart），没有时用 span 名。
+#
+# 预算（在 USAGE_WINDOW 秒的滚动窗口内按 prompt + completion 计算，0 表示不限制）:
+#   USAGE_USER_BUDGET    每个用户
+#   USAGE_GLOBAL_BUDGET  全部用户合计
+# 用量达到预算的 USAGE_SOFT_LIMIT 时降级：检索条数降到 USAGE_DEGRADED_K，模型改用
+# model_routing 中 degraded 路由；达到预算时不再调用大模型，直接提示额度已用完。
+#
+# 用法:
+#   python usage_ledger.py report --window 24h --by call_site,model --prices prices.json
+#   python usage_ledger.py report --window 7d --by user --bucket 1d
+#   python usage_ledger.py budget --user 10.0.0.8
+import os
+import re
+import sys
+import json
+import time
+import queue
+import atexit
+import sqlite3
+import argparse
+import threading
+import contextvars
+from contextlib import contextmanager
+import tracing
+from shared_cache import SHARED_CACHE_PATH
+
+USAGE_LEDGER = os.getenv("USAGE_LEDGER", "1") == "1"
+USAGE_LEDGER_PATH = os.getenv("USAGE_LEDGER_PATH", SHARED_CACHE_PATH)
+USAGE_WINDOW = int(os.getenv("USAGE_WINDOW", "86400"))  # 秒
+USAGE_USER_BUDGET = int(os.getenv("USAGE_USER_BUDGET", "0"))  # token
+USAGE_GLOBAL_BUDGET = int(os.getenv("USAGE_GLOBAL_BUDGET", "0"))  # token
+USAGE_SOFT_LIMIT = float(os.getenv("USAGE_SOFT_LIMIT", "0.8"))
+USAGE_DEGRADED_K = int(os.getenv("USAGE_DEGRADED_K", "6"))
+USAGE_REFRESH = float(os.getenv("USAGE_REFRESH", "10"))  # 从数据库重新汇总用量的间隔（秒）
+USAGE_RETENTION_DAYS = int(os.getenv("USAGE_RETENTION_DAYS", "30"))
+
+NORMAL = "normal"
+DEGRADED = "degraded"
+EXHAUSTED = "exhausted"
+EXHAUSTED_MESSAGE = "抱歉，当前时段的 AI 用量额度已用完，请稍后再试。"
+
+# report 允许的分组字段
+GROUP_FIELDS = ("user", "agent", "call_site", "model", "kind", "request_id")
+
+_user = contextvars.ContextVar("usage_user", default=None)
+_level = contextvars.ContextVar("usage_level", default=None)
+
+
+def load_prices(path):
+    """
+    价格表：每百万 token 的价格，按模型名配置，如
+    {"DeepSeek-V3": {"prompt": 2.0, "completion": 8.0, "cached": 0.5}}
+    """
+    if not path:
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def cost_of(usage, prices):
+    """
+    按价格表计算费用；命中前缀缓存的 token 按 cached 价格计，没有配置的模型不计费
+
+    参数:
+        usage (dict): {模型: {"prompt", "completion", "cached"}}
+        prices (dict): 见 load_prices
+    """
+    total = 0.0
+    for model, tokens in usage.items():
+        price = prices.get(model)
+        if not price:
+            continue
+        cached = tokens["cached"]
+        total += (
+            (tokens["prompt"] - cached) * price.get("prompt", 0)
+            + cached * price.get("cached", price.get("prompt", 0))
+            + tokens["completion"] * price.get("completion", 0)
+        ) / 1_000_000
+    return total
+
+
+class UsageLedger:
+    """
+    用量账本与预算判断
+
+    每个线程持有自己的 SQLite 连接。记录由后台线程批量写入，调用方（可能是事件循环）
+    只把记录放进队列。预算判断使用每 refresh 秒从数据库汇总一次的用量，期间本进程新记录
+    的用量直接累加上去，因此同一进程内的连续调用能立即看到自己的消耗，其他进程的消耗
+    最多延迟 refresh 秒。
+
+    参数:
+        path (str): SQLite 文件
+        window (int): 预算窗口（秒）
+        user_budget (int): 每个用户在窗口内的 token 上限，0 表示不限制
+        global_budget (int): 全局 token 上限，0 表示不限制
+        soft_limit (float): 达到预算的该比例时降级
+    """
+
+    def __init__(
+        self,
+        path=USAGE_LEDGER_PATH,
+        window=USAGE_WINDOW,
+        user_budget=USAGE_USER_BUDGET,
+        global_budget=USAGE_GLOBAL_BUDGET,
+        soft_limit=USAGE_SOFT_LIMIT,
+        refresh=USAGE_REFRESH,
+    ):
+        self.path = path
+        self.window = window
+        self.user_budget = user_budget
+        self.global_budget = global_budget
+        self.soft_limit = soft_limit
+        self.refresh = refresh
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._totals = {}  # 用户（None 表示全局）-> [汇总时间, token 数]
+        self._pending = queue.Queue()
+        self._writer = None
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS usage ("
+            " ts REAL NOT NULL,"
+            " user TEXT,"
+            " agent TEXT,"
+            " call_site TEXT,"
+            " model TEXT,"
+            " kind TEXT,"
+            " request_id TEXT,"
+            " prompt INTEGER,"
+            " completion INTEGER,"
+            " cached INTEGER,"
+            " latency REAL"
+            ")"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS usage_ts ON usage (ts)")
+        conn.execute("CREATE INDEX IF NOT EXISTS usage_user_ts ON usage (user, ts)")
+        conn.execute(
+            "DELETE FROM usage WHERE ts < ?", (time.time() - USAGE_RETENTION_DAYS * 86400,)
+        )
+        conn.commit()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def record(self, call_site, model, prompt, completion=0, cached=0, latency=0.0,
+               kind="llm", user=None, agent=None, request_id=None):
+        """记录一次调用：放入写入队列后立即返回，写入失败只打印警告，不影响请求"""
+        self._pending.put(
+            (time.time(), user, agent, call_site, model, kind, request_id,
+             prompt, completion, cached, latency)
+        )
+        tokens = prompt + completion
+        with self._lock:
+            if self._writer is None:
+                self._writer = threading.Thread(
+                    target=self._write_loop, daemon=True, name="usage-ledger-writer"
+                )
+                self._writer.start()
+                atexit.register(self.flush)
+            for key in {None, user}:
+                entry = self._totals.get(key)
+                if entry is not None:
+                    entry[1] += tokens
+
+    def _write_loop(self):
+        while True:
+            rows = [self._pending.get()]
+            while len(rows) < 500:
+                try:
+                    rows.append(self._pending.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                conn = self._conn()
+                conn.executemany("INSERT INTO usage VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+                conn.commit()
+            except sqlite3.Error as e:
+                print(f"写入用量账本失败（{len(rows)} 条）: {e}")
+            finally:
+                for _ in rows:
+                    self._pending.task_done()
+
+    def flush(self):
+        """等待队列中的记录全部写入（进程退出时自动调用）"""
+        self._pending.join()
+
+    def tokens(self, user=None):
+        """
+        返回:
+            int: 窗口内的 token 数（prompt + completion）；user 为 None 时是全局合计
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._totals.get(user)
+            if entry is not None and now - entry[0] <= self.refresh:
+                return entry[1]
+        sql = "SELECT COALESCE(SUM(prompt + completion), 0) FROM usage WHERE ts >= ?"
+        args = [time.time() - self.window]
+        if user is not None:
+            sql += " AND user = ?"
+            args.append(user)
+        tokens = self._conn().execute(sql, args).fetchone()[0]
+        with self._lock:
+            if len(self._totals) > 1024:  # 丢弃长时间不活跃用户的汇总
+                self._totals = {
+                    k: v for k, v in self._totals.items() if now - v[0] <= self.refresh
+                }
+            self._totals[user] = [now, tokens]
+        return tokens
+
+    def level(self, user=None):
+        """
+        返回:
+            str: NORMAL、DEGRADED（达到 soft_limit）或 EXHAUSTED（达到预算），取用户和全局中较紧的一个
+        """
+        ratio = 0.0
+        if self.global_budget > 0:
+            ratio = self.tokens(None) / self.global_budget
+        if user is not None and self.user_budget > 0:
+            ratio = max(ratio, self.tokens(user) / self.user_budget)
+        if ratio >= 1:
+            return EXHAUSTED
+        if ratio >= self.soft_limit:
+            return DEGRADED
+        return NORMAL
+
+    def summary(self, since=None, until=None, group_by=("call_site",), bucket=None):
+        """
+        按时间窗口汇总用量
+
+        参数:
+            since (float): 起始时间戳，None 表示不限
+            until (float): 结束时间戳，None 表示到现在
+            group_by (tuple): 分组字段，取自 GROUP_FIELDS
+            bucket (int): 时间桶大小（秒），提供时按桶分组，结果中 period 为桶的起始时间戳
+
+        返回:
+            list: 每组一个字典，包含分组字段以及 calls、prompt、completion、cached、
+                  latency_avg、latency_max
+        """
+        unknown = [field for field in group_by if field not in GROUP_FIELDS]
+        if unknown:
+            raise ValueError(f"未知的分组字段: {', '.join(unknown)}")
+        self.flush()  # 本进程刚记录、还在队列中的调用也计入
+        columns = list(group_by)
+        if bucket:
+            columns.insert(0, f"CAST(ts / {int(bucket)} AS INTEGER) * {int(bucket)} AS period")
+        where, args = [], []
+        if since is not None:
+            where.append("ts >= ?")
+            args.append(since)
+        if until is not None:
+            where.append("ts < ?")
+            args.append(until)
+        names = (["period"] if bucket else []) + list(group_by)
+        sql = (
+            "SELECT " + ", ".join(columns + [
+                "COUNT(*)", "SUM(prompt)", "SUM(completion)", "SUM(cached)",
+                "AVG(latency)", "MAX(latency)",
+            ])
+            + " FROM usage"
+            + (" WHERE " + " AND ".join(where) if where else "")
+            + (" GROUP BY " + ", ".join(names) + " ORDER BY " + ", ".join(names) if names else "")
+        )
+        rows = []
+        for row in self._conn().execute(sql, args):
+            item = dict(zip(names, row))
+            calls, prompt, completion, cached, latency_avg, latency_max = row[len(names):]
+            item.update(
+                calls=calls,
+                prompt=prompt or 0,
+                completion=completion or 0,
+                cached=cached or 0,
+                latency_avg=latency_avg or 0.0,
+                latency_max=latency_max or 0.0,
+            )
+            rows.append(item)
+        return rows
+
+
+_ledger = None
+_ledger_lock = threading.Lock()
+
+
+def get_usage_ledger():
+    """进程内单例，同时注册 /metrics 中的 usage_window_tokens 指标"""
+    global _ledger
+    if _ledger is None:
+        with _ledger_lock:
+            if _ledger is None:
+                _ledger = UsageLedger()
+                tracing.register_gauge(
+                    "usage_window_tokens",
+                    "预算窗口内的全局 token 用量与预算（0 表示不限制）",
+                    lambda: [
+                        ({"kind": "used"}, _ledger.tokens(None)),
+                        ({"kind": "budget"}, _ledger.global_budget),
+                    ],
+                )
+    return _ledger
+
+
+def _agent_of(span):
+    while span is not None:
+        if "agent" in span.attributes:
+            return span.attributes["agent"]
+        span = span.parent
+    return None
+
+
+def _on_span(span):
+    prompt = span.attributes.get("prompt_tokens")
+    if not USAGE_LEDGER or not prompt:
+        return
+    get_usage_ledger().record(
+        span.attributes.get("call_site", span.name),
+        span.attributes.get("model"),
+        prompt,
+        span.attributes.get("completion_tokens", 0),
+        span.attributes.get("cached_tokens", 0),
+        span.duration,
+        kind="llm" if span.name == "llm.chat" else "embedding",
+        user=_user.get(),
+        agent=_agent_of(span),
+        request_id=span.trace_id,
+    )
+
+
+tracing.register_span_listener(_on_span)
+
+
+def user_of(request):
+    """从 gr.Request 取得用户标识：登录用户名，未启用登录时用客户端地址"""
+    if request is None:
+        return None
+    username = getattr(request, "username", None)
+    if username:
+        return username
+    client = getattr(request, "client", None)
+    return getattr(client, "host", None)
+
+
+@contextmanager
+def budget(user):
+    """
+    在该用户的预算下处理一次请求：其中的大模型和嵌入调用记到该用户名下，
+    并按开始时的用量决定是否降级
+
+    用法:
+        with usage_ledger.budget(user) as level:
+            if level == usage_ledger.EXHAUSTED:
+                return usage_ledger.EXHAUSTED_MESSAGE
+            ...
+    """
+    level = get_usage_ledger().level(user)
+    tokens = (_user.set(user), _level.set(level))
+    try:
+        yield level
+    finally:
+        _level.reset(tokens[1])
+        _user.reset(tokens[0])
+
+
+def current_level():
+    """当前请求的预算状态；不在 budget() 中时（如批量任务）只看全局预算"""
+    level = _level.get()
+    if level is None:
+        if USAGE_GLOBAL_BUDGET <= 0:
+            return NORMAL
+        level = get_usage_ledger().level(None)
+    return level
+
+
+def retrieval_k(k):
+    """降级时减少检索条数"""
+    return min(k, USAGE_DEGRADED_K) if current_level() == DEGRADED else k
+
+
+_DURATION_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+def parse_duration(text):
+    """'90'、'30m'、'24h'、'7d' -> 秒"""
+    match = re.fullmatch(r"(\d+(?:\.\d+)?)([smhd]?)", text.strip())
+    if not match:
+        raise argparse.ArgumentTypeError(f"无法识别的时长: {text}")
+    return float(match.group(1)) * _DURATION_UNITS[match.group(2) or "s"]
+
+
+def print_report(rows, group_by, prices, bucket=None):
+    names = (["period"] if bucket else []) + list(group_by)
+    header = "".join(f"{name:<24}" for name in names)
+    header += f"{'调用':>8}{'prompt':>12}{'cached':>12}{'completion':>12}{'平均秒':>10}{'最长秒':>10}"
+    if prices:
+        header += f"{'费用':>12}"
+    print(header)
+    total = {"calls": 0, "prompt": 0, "cached": 0, "completion": 0, "cost": 0.0}
+    for row in rows:
+        line = ""
+        for name in names:
+            value = row[name]
+            if name == "period":
+                value = time.strftime("%Y-%m-%d %H:%M", time.localtime(value))
+            line += f"{str(value if value is not None else '-'):<24}"
+        line += (
+            f"{row['calls']:>8}{row['prompt']:>12}{row['cached']:>12}{row['completion']:>12}"
+            f"{row['latency_avg']:>10.2f}{row['latency_max']:>10.2f}"
+        )
+        if prices:
+            cost = cost_of({row["model"]: row}, prices)
+            total["cost"] += cost
+            line += f"{cost:>12.4f}"
+        print(line)
+        for key in ("calls", "prompt", "cached", "completion"):
+            total[key] += row[key]
+    print("-" * len(header))
+    print(
+        f"合计 {total['calls']} 次调用，prompt {total['prompt']}（其中缓存命中 {total['cached']}），"
+        f"completion {total['completion']}"
+        + (f"，费用 {total['cost']:.4f}" if prices else "")
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="大模型与嵌入调用的用量账本")
+    sub = parser.add_subparsers(dest="command", required=True)
+    report_parser = sub.add_parser("report", help="按时间窗口汇总用量")
+    report_parser.add_argument("--window", type=parse_duration, default=USAGE_WINDOW, help="统计最近多久，如 24h、7d")
+    report_parser.add_argument("--by", default="call_site,model", help="逗号分隔：" + ",".join(GROUP_FIELDS))
+    report_parser.add_argument("--bucket", type=parse_duration, help="按时间桶分组，如 1h")
+    report_parser.add_argument("--prices", help="价格表 JSON 文件（每百万 token），提供时按模型计算费用")
+    budget_parser = sub.add_parser("budget", help="查看预算使用情况")
+    budget_parser.add_argument("--user", help="用户标识（登录用户名或客户端地址）")
+    args = parser.parse_args(argv)
+
+    ledger = get_usage_ledger()
+    if args.command == "budget":
+        print(f"窗口 {ledger.window}s，全局 {ledger.tokens(None)} / {ledger.global_budget or '不限'}")
+        if args.user:
+            print(f"用户 {args.user}: {ledger.tokens(args.user)} / {ledger.user_budget or '不限'}")
+        print(f"状态: {ledger.level(args.user)}")
+        return 0
+
+    group_by = [field.strip() for field in args.by.split(",") if field.strip()]
+    prices = load_prices(args.prices)
+    if prices and "model" not in group_by:
+        group_by.append("model")
+    try:
+        rows = ledger.summary(time.time() - args.window, group_by=group_by, bucket=args.bucket)
+    except ValueError as e:
+        print(e)
+        return 1
+    print_report(rows, group_by, prices, args.bucket)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,13 +1,18 @@
 import client_hw
+import tracing
+import graph_cache
+from singleflight import SingleFlight
+from graph_expansion import GraphExpander, RemoteGraphSource
 from py2neo import Graph
+import os
 from dotenv import load_dotenv
 load_dotenv()
 
 
 # Neo4j连接
-uri = "bolt://119.3.225.124:7687"
-user = "neo4j"
-password = "1234qwer"
+uri = os.getenv("NEO4J_URI", "bolt://119.3.225.124:7687")
+user = os.getenv("NEO4J_USER", "neo4j")
+password = os.getenv("NEO4J_PASSWORD", "1234qwer")
 
 
 # 连接neo4j
@@ -22,35 +27,47 @@ def connect_neo4j():
         raise
 
 
+# 同一问题的并发查询只做一次实体提取和 Cypher 查询
+_graph_flight = SingleFlight("graph")
+
+
 # 调用api识别实体，从neo4j中查询
 def query_from_neo4j(user_input):
+    result = _graph_flight.do(_graph_flight.key(user_input), _query_from_neo4j, user_input)
+    # 返回副本，避免调用方修改共享的结果
+    return list(result)
+
+
+# 邻居按关系权重和度数打分，只取预算内最相关的知识点，而不是把所有一跳邻居都拼进查询
+_expander = GraphExpander()
+
+
+def _query_from_neo4j(user_input):
+    """
+    提取用户输入中的实体，并在知识图谱中扩展出最相关的知识点
+
+    返回:
+        list: 按相关度降序的知识点名称（不含提取出的实体本身）
+    """
     # 调用api提取实体
     system_content = "你是一个有用的软件工程课程助手,请从用户提供的语句里提取实体，仅返回提取结果，不同实体间用逗号分割"
     user_content = user_input
-    response = client_hw.get_model_response(system_content, user_content)
-    entities = response.split(",")
-    entity_result_set = set()
-    try:
-        graph = connect_neo4j()
-    except Exception as e:
-        print(f"neo4j连接失败：{str(e)}")
-        return entity_result_set
-    for entity in entities:
-        # Cypher查询：匹配实体作为起点或终点的所有直接关系
-        query = """
-            MATCH (start)-[r]->(end)
-            WHERE start.name = $entity OR end.name = $entity
-            RETURN start.name AS 起始节点,
-                   end.name AS 终止节点
-        """
+    with tracing.span("neo4j.extract"):
+        response = client_hw.get_model_response(
+            system_content, user_content, call_site="extraction"
+        )
+    if not response:
+        print("实体提取失败，跳过知识图谱查询")
+        return []
+    entities = [e.strip() for e in response.split(",") if e.strip()]
+    # 本地快照模式：邻居和度数直接查内存索引，不再访问 Neo4j
+    source = graph_cache.get_snapshot(connect_neo4j)
+    if source is None:
         try:
-            # 执行查询
-            result = graph.run(query, parameters={"entity": entity})
-            records = result.data()
-            for idx in records:
-                entity_result_set.add(idx['起始节点'])
-                entity_result_set.add(idx['终止节点'])
+            with tracing.span("neo4j.connect"):
+                graph = connect_neo4j()
         except Exception as e:
-            print(f"查询实体 '{entity}' 时发生错误: {str(e)}")
-    entity_result_set = {i for i in entity_result_set if i is not None}
-    return entity_result_set
+            print(f"neo4j连接失败：{str(e)}")
+            return []
+        source = RemoteGraphSource(graph)
+    return [name for name, _ in _expander.expand(source, entities)]
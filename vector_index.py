@@ -0,0 +1,212 @@
+import os
+import sys
+import json
+import argparse
+import numpy as np
+from langchain_core.documents import Document
+from retrieval_result import enrich_metadata
+
+# 目录结构:
+#   embeddings.npy   归一化后的 float32 向量矩阵，或 int8 量化矩阵
+#   scales.npy       int8 量化时每行的缩放系数（float32）
+#   metadata.jsonl   每行一个分块：{"id", "page_content", "metadata"}
+#   index.json       维度、条数、量化方式
+EMBEDDINGS_FILE = "embeddings.npy"
+SCALES_FILE = "scales.npy"
+METADATA_FILE = "metadata.jsonl"
+INFO_FILE = "index.json"
+# int8 索引按块计算内积，每块转换为 float32 时的临时内存约为 块行数 × 维度 × 4 字节
+SEARCH_BLOCK_ROWS = 4096
+
+
+def _normalize(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (matrix / norms).astype(np.float32)
+
+
+def write_index(out_dir, ids, embeddings, documents, metadatas, quantize=False):
+    """
+    把向量和元数据写成内存映射索引
+
+    参数:
+        out_dir (str): 输出目录
+        ids (list): 分块 id
+        embeddings (list | np.ndarray): 向量
+        documents (list): 分块文本
+        metadatas (list): 分块元数据
+        quantize (bool): 是否量化为 int8（体积减为 1/4，精度略降）
+    """
+    if len(embeddings) == 0:
+        raise ValueError("没有可写入索引的向量（输入为空）")
+    os.makedirs(out_dir, exist_ok=True)
+    # 展示文本和章节标记在导出时一次算好，检索时直接读取
+    metadatas = [enrich_metadata(text, meta) for text, meta in zip(documents, metadatas)]
+    matrix = _normalize(np.asarray(embeddings, dtype=np.float32))
+    info = {"count": int(matrix.shape[0]), "dim": int(matrix.shape[1]), "dtype": "float32"}
+
+    if quantize:
+        # 对称的逐行量化：x ≈ q * scale，scale = max|x| / 127
+        scales = np.abs(matrix).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        matrix = np.round(matrix / scales[:, None]).astype(np.int8)
+        _atomic_save(os.path.join(out_dir, SCALES_FILE), scales.astype(np.float32))
+        info["dtype"] = "int8"
+    _atomic_save(os.path.join(out_dir, EMBEDDINGS_FILE), matrix)
+
+    tmp = os.path.join(out_dir, METADATA_FILE + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        for chunk_id, text, meta in zip(ids, documents, metadatas):
+            f.write(
+                json.dumps(
+                    {"id": chunk_id, "page_content": text, "metadata": meta or {}},
+                    ensure_ascii=False,
+                )
+                + "\n"
+            )
+    os.replace(tmp, os.path.join(out_dir, METADATA_FILE))
+    with open(os.path.join(out_dir, INFO_FILE), "w", encoding="utf-8") as f:
+        json.dump(info, f)
+    return info
+
+
+def _atomic_save(path, array):
+    tmp = path + ".tmp.npy"
+    np.save(tmp, array)
+    os.replace(tmp, path)
+
+
+def build_from_chroma(vector_store, out_dir, quantize=False):
+    """从已有的 Chroma 集合导出全部向量和元数据"""
+    data = vector_store._collection.get(include=["embeddings", "documents", "metadatas"])
+    return write_index(
+        out_dir,
+        data["ids"],
+        data["embeddings"],
+        data["documents"],
+        data["metadatas"],
+        quantize=quantize,
+    )
+
+
+class NumpyVectorIndex:
+    """
+    只读的本地向量索引，向量矩阵以内存映射方式打开
+
+    多个工作进程打开同一个索引时共享操作系统的页缓存，几乎不占用额外内存。
+    检索为精确的内积（向量已归一化，即余弦相似度）top-k，接口与 Chroma 的
+    similarity_search 保持一致，可直接替换 rag_store 中的 vector_store_instance。
+    """
+
+    def __init__(self, index_dir, embedding_function=None):
+        self.index_dir = index_dir
+        self.embedding_function = embedding_function
+        with open(os.path.join(index_dir, INFO_FILE), "r", encoding="utf-8") as f:
+            self.info = json.load(f)
+        self.matrix = np.load(os.path.join(index_dir, EMBEDDINGS_FILE), mmap_mode="r")
+        self.scales = None
+        if self.info.get("dtype") == "int8":
+            self.scales = np.load(os.path.join(index_dir, SCALES_FILE), mmap_mode="r")
+        self.ids = []
+        self.texts = []
+        self.metadatas = []
+        with open(os.path.join(index_dir, METADATA_FILE), "r", encoding="utf-8") as f:
+            for line in f:
+                record = json.loads(line)
+                self.ids.append(record["id"])
+                self.texts.append(record["page_content"])
+                self.metadatas.append(record["metadata"])
+
+    def __len__(self):
+        return self.matrix.shape[0]
+
+    def scores(self, query_vector):
+        """返回查询向量与所有分块的余弦相似度"""
+        q = np.asarray(query_vector, dtype=np.float32)
+        norm = np.linalg.norm(q)
+        if norm > 0:
+            q = q / norm
+        if self.scales is None:
+            return self.matrix @ q
+        # 按块转换为 float32 后与原始查询向量做内积（走 BLAS，整数矩阵乘法没有 BLAS 加速），
+        # 查询向量不量化，避免因取整改变排序；分块避免把整个 int8 矩阵转换成浮点临时数组
+        scores = np.empty(len(self), dtype=np.float32)
+        for start in range(0, len(self), SEARCH_BLOCK_ROWS):
+            block = self.matrix[start : start + SEARCH_BLOCK_ROWS]
+            scores[start : start + len(block)] = block.astype(np.float32) @ q
+        return scores * self.scales
+
+    def search_by_vector(self, query_vector, k=4, filter_fn=None):
+        """
+        精确 top-k 检索
+
+        参数:
+            query_vector: 查询向量
+            k (int): 返回条数
+            filter_fn (callable): 可选，接收元数据返回是否保留
+
+        返回:
+            list: [(下标, 相似度), ...]，按相似度降序
+        """
+        scores = self.scores(query_vector)
+        if filter_fn is not None:
+            mask = np.fromiter(
+                (filter_fn(m) for m in self.metadatas), dtype=bool, count=len(self)
+            )
+            scores = np.where(mask, scores, -np.inf)
+        k = min(k, len(scores))
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(i), float(scores[i])) for i in top if np.isfinite(scores[i])]
+
+    def _to_document(self, i):
+        return Document(page_content=self.texts[i], metadata=dict(self.metadatas[i]))
+
+    @staticmethod
+    def _filter_fn(filter):
+        # 与 Chroma 的简单 where 写法一致：各字段等值匹配
+        if not filter:
+            return None
+        return lambda meta: all(meta.get(key) == value for key, value in filter.items())
+
+    def similarity_search_by_vector(self, embedding, k=4, filter=None, **kwargs):
+        return [
+            self._to_document(i)
+            for i, _ in self.search_by_vector(embedding, k, self._filter_fn(filter))
+        ]
+
+    def similarity_search_with_score(self, query, k=4, filter=None, **kwargs):
+        vector = self.embedding_function.embed_query(query)
+        return [
+            (self._to_document(i), score)
+            for i, score in self.search_by_vector(vector, k, self._filter_fn(filter))
+        ]
+
+    def similarity_search(self, query, k=4, filter=None, **kwargs):
+        vector = self.embedding_function.embed_query(query)
+        return self.similarity_search_by_vector(vector, k, filter=filter)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="从 Chroma 导出内存映射向量索引")
+    parser.add_argument("--persist-directory", default="./local_pdf_chroma_db_sf")
+    parser.add_argument("--collection", default="sf_pdf_documents_collection")
+    parser.add_argument("--out", default="./local_vector_index", help="输出目录")
+    parser.add_argument("--int8", action="store_true", help="以 int8 量化存储")
+    args = parser.parse_args(argv)
+
+    from langchain_community.vectorstores import Chroma
+
+    if not os.path.exists(args.persist_directory):
+        print(f"Chroma 数据库目录 '{args.persist_directory}' 未找到，无法导出。")
+        return 1
+    store = Chroma(collection_name=args.collection, persist_directory=args.persist_directory)
+    info = build_from_chroma(store, args.out, quantize=args.int8)
+    print(f"已导出 {info['count']} 条 {info['dim']} 维向量（{info['dtype']}）到 {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())